@@ -7,33 +7,38 @@ This script requires a Tesseract OCR installation with support for Greek, German
 and it is intended to run on a German Windows system where the notification center is identified by
 the name "Benachrichtigungscenter".
 
+The Windows automation and screenshot libraries are imported when a notification
+reader is created, importing the module for its defaults stays cheap.
+
 """
 
 
 
-import pytesseract
-from PIL import ImageGrab
-import pyautogui
-import uiautomation as auto
 import time
 import re
-from screeninfo import get_monitors
-import pandas as pd
+import abc
+import contextlib
 import argparse
 from datetime import datetime as dt
 import pathlib
 from loguru import logger as lg
 import logger
+import smsSources
+import frameChange
+import ocrEngine
+import codeExtractor
 
 #%% defaults
 
 SMS_DEFAULTS = {
-          'text_pattern'  : r".*(\d{6})\s+ΚΩΔΙΚΟΣ ΓΙΑ ΕΚΔΟΣΗ.*|.*GOVGR.+(\d{6})\s+.*"
+          'text_pattern'  : None
         , 'tesseract_cmd' : r"C:\Program Files\Tesseract-OCR\tesseract.exe"
         , 'timeout'       : 120 
         , 'notification_center_name': "Benachrichtigungscenter"
         , 'clear_button_label'      : "Alle löschen"
         , 'debug'                   : False
+        , 'frame_threshold'         : frameChange.FRAME_DEFAULTS['threshold']
+        , 'ocr_engine'              : ocrEngine.OCR_DEFAULTS['engine']
     }
  
 #%% constants
@@ -42,12 +47,14 @@ DEBUG_DIR = pathlib.Path('./debug')
 
 #%%
 
-class Singleton(type):
+class Singleton(abc.ABCMeta):
     """
     A metaclass for creating singleton classes.
 
     This metaclass ensures that only one instance of a class is created. If an instance
     already exists, it returns the existing instance instead of creating a new one.
+    It derives from ABCMeta, so it can be used for implementations of abstract
+    classes like `smsSources.SMSSource`.
 
     """
     _instances = {}
@@ -56,13 +63,14 @@ class Singleton(type):
             cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
     
-class SMSNotification( metaclass=Singleton ):
+class SMSNotification( smsSources.SMSSource, metaclass=Singleton ):
     """
     A class to handle SMS notifications from the Windows Notification Center.
 
     This class captures screenshots of the notification area, uses OCR to extract text,
     and parses the text to find a specific code based on a regex pattern. It is implemented
-    as a singleton to ensure only one instance manages the notification area.
+    as a singleton to ensure only one instance manages the notification area. It is the
+    polling `smsSources.SMSSource`, see smsSources for push based alternatives.
 
     """
     MESSAGE_PIXEL_WIDHT = 300
@@ -74,39 +82,46 @@ class SMSNotification( metaclass=Singleton ):
     @lg.catch
     def __init__(  self, text_pattern : str, tesseract_cmd : str, timeout : int
                  , notification_center_name = SMS_DEFAULTS['notification_center_name']
-                 , clear_button_label = SMS_DEFAULTS['clear_button_label'], debug=SMS_DEFAULTS['debug']):
+                 , clear_button_label = SMS_DEFAULTS['clear_button_label'], debug=SMS_DEFAULTS['debug']
+                 , frame_threshold = SMS_DEFAULTS['frame_threshold'], ocr_engine = SMS_DEFAULTS['ocr_engine']):
         """
         Initializes the SMSNotification instance.
 
         Args:
-            text_pattern (str): The regex pattern to find the code in the SMS text.
+            text_pattern (str): The regex pattern to find the code in the SMS text, the code is
+                its first non empty group. If None, the codeExtractor is used, which corrects
+                OCR confusions and knows the gov.gr message templates.
             tesseract_cmd (str): The file path to the Tesseract OCR executable.
             timeout (int): The maximum time in seconds to wait for an SMS notification.
             notification_center_name (str, optional): The name of the Windows Notification Center.
                 Defaults to "Benachrichtigungscenter".
             clear_button_label (str, optional): The label of the "Clear All" button.
                 Defaults to "Alle löschen".
+            debug (bool, optional): Store the captured screenshots in the debug folder.
+                Defaults to False.
+            frame_threshold (int, optional): Difference in gray levels a screenshot needs
+                to the previous one to be OCR'd again. Defaults to 8.
+            ocr_engine (str, optional): The OCR engine, 'tesserocr' keeps tesseract loaded
+                in the process, 'pytesseract' starts it for every screenshot, 'auto' uses
+                tesserocr if it is installed. Defaults to 'auto'.
 
         """
         self.debug          = debug
         if self.debug:
             DEBUG_DIR.mkdir(parents= True, exist_ok=True)
             
-        self.text_pattern   = re.compile(text_pattern)
-        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
-        self.timeout        = timeout
+        super().__init__(timeout)
+        self.text_pattern   = None if text_pattern is None else re.compile(text_pattern)
+        self.extractor      = codeExtractor.CodeExtractor()
+        self.ocr            = ocrEngine.createEngine(tesseract_cmd, engine=ocr_engine)
         self.notification_center_name   = notification_center_name
         
         self.clear_button_label         = clear_button_label
+        self.frames                     = frameChange.FrameChangeDetector(threshold=frame_threshold)
         
         
-        monitors = list()
-        for m in get_monitors():
-            monitor = {'name' : m.name, 'x' : m.x, 'y' : m.y, 'width' : m.width, 'height' : m.height, 'is_primary' : m.is_primary }
-            monitors.append(monitor)
-        
-        displays = pd.DataFrame(monitors)
-        self.primary_display = displays[displays.is_primary].iloc[0]
+        from screeninfo import get_monitors
+        self.primary_display = next( m for m in get_monitors() if m.is_primary )
         self.bbox = ( int(self.primary_display.x + self.primary_display.width - SMSNotification.MESSAGE_PIXEL_WIDHT), int(self.primary_display.y),
                       int(self.primary_display.x + self.primary_display.width), int(self.primary_display.y + self.primary_display.height) )
             
@@ -125,6 +140,7 @@ class SMSNotification( metaclass=Singleton ):
         to ensure the notification area is visible for capturing.
 
         """
+        import pyautogui
         pyautogui.click(self.notification_x_click_position, self.notification_y_click_position)
         time.sleep(1)
         return
@@ -143,6 +159,7 @@ class SMSNotification( metaclass=Singleton ):
             PIL.Image.Image: The captured screenshot as a Pillow Image object.
 
         """
+        from PIL import ImageGrab
         return ImageGrab.grab(bbox=self.bbox)  
 
 
@@ -151,7 +168,9 @@ class SMSNotification( metaclass=Singleton ):
     @lg.catch
     def _extract_code(self, text):
         """
-        Extracts the 6-digit code from the given text based on the regex pattern.
+        Extracts the 6-digit code from the given text.
+
+        A code that has been returned before is never returned again.
 
         Args:
             text (str): The text from which to extract the code.
@@ -160,15 +179,19 @@ class SMSNotification( metaclass=Singleton ):
             str: The extracted 6-digit code, or None if no match is found.
 
         """
-        
-        match = re.search(self.text_pattern, text)
-        if match:
-            code = match.group(1)
-            lg.success(f"pattern matched, code: {code}, {match.group(0)}, {self.text_pattern}, {text}")
-            if code is None:
+        if self.text_pattern is None:
+            code = self.extractor.extract(text)
+        else:
+            match = self.text_pattern.search(text)
+            code  = None if match is None else next( (g for g in match.groups() if g), None )
+            if not match is None and code is None:
                 lg.critical("pattern matched, but result is None")
-            return code
-        return None
+            if code in self.extractor.used:
+                code = None
+        if code:
+            lg.success(f"code found: {code}, {text}")
+            self.extractor.markUsed(code)
+        return code
     
 
     @logger.logging     
@@ -184,6 +207,7 @@ class SMSNotification( metaclass=Singleton ):
             bool: True if the button was clicked, False otherwise.
 
         """
+        import uiautomation as auto
         cleared = False
         self._click_notification_icon()
         time.sleep(1)
@@ -198,6 +222,36 @@ class SMSNotification( metaclass=Singleton ):
                     cleared = True
         return cleared
 
+    @logger.logging     
+    @lg.catch
+    def close(self):
+        """Releases the OCR engine."""
+        self.ocr.close()
+        return
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Grants exclusive access to the SMS channel to a single declaration.
+
+        All sessions receive their codes on the same phone, so a code shown in the
+        notification area can not be assigned to its declaration. The caller holds
+        the channel from requesting the SMS until the code is accepted, the
+        notification area is cleared when entering and leaving.
+
+        Yields:
+            SMSNotification: This instance.
+
+        """
+        import uiautomation as auto
+        with self.lock:
+            with auto.UIAutomationInitializerInThread():
+                self.click_clear_all_button()
+                try:
+                    yield self
+                finally:
+                    self.click_clear_all_button()
+
     @logger.logging     
     @lg.catch
     def wait_for_sms_code(self):
@@ -205,7 +259,8 @@ class SMSNotification( metaclass=Singleton ):
         Waits for an SMS code to appear in the Notification Center.
 
         This method repeatedly captures the notification area, uses OCR to extract text,
-        and searches for the code until the timeout is reached. Debug screenshots are saved
+        and searches for the code until the timeout is reached. Screenshots identical to
+        the previous one are not OCR'd again, see frameChange. Debug screenshots are saved
         for each attempt if class has been instantiated with debugging enabled.
         The ocr text is been preprocessed by erplacing \n with ; as it showed significant performance increase.
 
@@ -214,10 +269,15 @@ class SMSNotification( metaclass=Singleton ):
 
         """
         start = time.time()
+        self.frames.reset()
         while (time.time() - start) < self.timeout:
             self._click_notification_icon()
             screenshot = self._capture_notification_area()
-            text = pytesseract.image_to_string(screenshot, lang='ell+deu+eng')
+            if not self.frames.changed(screenshot):
+                # same pixels as the last frame without a code, OCR would not find one either
+                time.sleep(1)
+                continue
+            text = self.ocr.image_to_string(screenshot)
             
             used_text = text
             if isinstance(text, str):
@@ -227,6 +287,7 @@ class SMSNotification( metaclass=Singleton ):
             code = self._extract_code(used_text)
             if code:
                 lg.success(f"code found: {code}")
+                lg.info(f"{self.frames.captured} frames captured, {self.frames.changes} OCR'd")
                 if self.debug:
                     pic = DEBUG_DIR / f"{dt.now().strftime('%Y%m%dT%H%M%S')}_code.png"
                     screenshot.save( pic )
@@ -241,6 +302,7 @@ class SMSNotification( metaclass=Singleton ):
                 lg.warning(f"failed to find pattern in {pic}")
             
             time.sleep(1)
+        lg.info(f"{self.frames.captured} frames captured, {self.frames.changes} OCR'd")
         lg.error("SMS code receiver timeout.")
         return None
     
@@ -0,0 +1,532 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmarks of the performance relevant parts of the bulk declaration.
+
+Each benchmark is a sub command and prints its results as table:
+
+    python benchmark.py ocr --frames debug/*.png
+    python benchmark.py extractor
+    python benchmark.py tracing
+    python benchmark.py portal --batches 10 100 1000 --workers 2 --pipeline
+    python benchmark.py service --jobs 1000 --rate 1 --workers 2
+    python benchmark.py startup --budget 0.3
+
+"""
+
+
+import re
+import sys
+import json
+import time
+import socket
+import pathlib
+import argparse
+import tempfile
+import threading
+import statistics
+import subprocess
+from loguru import logger as lg
+from metrics import percentile
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+#%% helper
+
+def summary(samples):
+    """
+    Summarizes latency samples.
+
+    Args:
+        samples (list): The measured durations in seconds.
+
+    Returns:
+        dict: Count, mean, p50, p95, p99 and max of the samples in milliseconds.
+
+    """
+    ordered = sorted(samples)
+    return { 'n'    : len(ordered)
+           , 'mean' : 1000 * statistics.fmean(ordered)
+           , 'p50'  : 1000 * percentile(ordered, 50)
+           , 'p95'  : 1000 * percentile(ordered, 95)
+           , 'p99'  : 1000 * percentile(ordered, 99)
+           , 'max'  : 1000 * ordered[-1] }
+
+
+def printSummary(name, samples):
+    """Prints the summary of latency samples as one table row."""
+    s = summary(samples)
+    print(f"{name:<32} n={s['n']:<6} mean={s['mean']:9.3f}ms p50={s['p50']:9.3f}ms p95={s['p95']:9.3f}ms p99={s['p99']:9.3f}ms max={s['max']:9.3f}ms")
+
+
+def freePort():
+    """Returns a free local TCP port."""
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+class PeakMemory:
+    """
+    Samples the resident memory of a process and all its children, e.g. the
+    browsers and drivers started by it, and keeps the peak in bytes.
+
+    The peak is None if psutil is not installed.
+
+    """
+
+    def __init__(self, pid, interval=0.2):
+        self.peak     = None
+        self.interval = interval
+        self.stopped  = threading.Event()
+        self.thread   = threading.Thread(target=self._sample, args=(pid,), daemon=True)
+        if not psutil is None:
+            self.thread.start()
+
+    def _sample(self, pid):
+        try:
+            process = psutil.Process(pid)
+        except psutil.Error:
+            return
+        while not self.stopped.wait(self.interval):
+            rss = 0
+            try:
+                for p in [process] + process.children(recursive=True):
+                    rss += p.memory_info().rss
+            except psutil.Error:
+                continue
+            self.peak = max(self.peak or 0, rss)
+
+    def stop(self):
+        self.stopped.set()
+        return self.peak
+
+
+#%% benchmarks
+
+def benchOCR(args):
+    """
+    Compares the per frame latency of the OCR engines.
+
+    Every available engine reads each frame `args['repeat']` times after one warm
+    up call. Without frames a synthetic notification is used.
+
+    """
+    from PIL import Image, ImageDraw
+    import ocrEngine
+
+    frames = [ Image.open(f) for f in args['frames'] ]
+    if not frames:
+        frame = Image.new('RGB', (300, 200), 'white')
+        ImageDraw.Draw(frame).text((10, 80), "GOVGR 123456 KODIKOS GIA EKDOSI", fill='black')
+        frames = [ frame ]
+
+    engines = ['pytesseract'] + ( ['tesserocr'] if ocrEngine.tesserocrInstalled() else [] )
+    for name in engines:
+        engine = ocrEngine.createEngine(args['tesseract'], engine=name)
+        engine.image_to_string(frames[0])
+        samples = list()
+        for _ in range(args['repeat']):
+            for frame in frames:
+                start = time.perf_counter()
+                engine.image_to_string(frame)
+                samples.append(time.perf_counter() - start)
+        engine.close()
+        printSummary(f"ocr {name}", samples)
+    return 0
+
+
+def benchExtractor(args):
+    """
+    Replays the OCR transcript corpus through the code extractors.
+
+    The codeExtractor is compared with the regular expression used before it.
+    Each corpus line holds the OCR `text`, the expected `code` (null if there is
+    none) and the codes already `used`. The benchmark fails if the codeExtractor
+    misses any expectation of the corpus.
+
+    """
+    import codeExtractor
+
+    legacy = re.compile(r".*(\d{6})\s+ΚΩΔΙΚΟΣ ΓΙΑ ΕΚΔΟΣΗ.*|.*GOVGR.+(\d{6})\s+.*")
+    with open(args['corpus'], encoding='utf-8') as f:
+        corpus = [ json.loads(line) for line in f if line.strip() ]
+
+    failures = 0
+    for name, extract in (('legacy regex', None), ('codeExtractor', codeExtractor.CodeExtractor)):
+        samples = list()
+        correct = 0
+        for case in corpus:
+            text = case['text'].replace('\n', ';')
+            for _ in range(args['repeat']):
+                if extract is None:
+                    start = time.perf_counter()
+                    match = legacy.search(text)
+                    code  = None if match is None else next( (g for g in match.groups() if g), None )
+                    code  = None if code in case['used'] else code
+                else:
+                    extractor = extract()
+                    for used in case['used']:
+                        extractor.markUsed(used)
+                    start = time.perf_counter()
+                    code  = extractor.extract(text)
+                samples.append(time.perf_counter() - start)
+            if code == case['code']:
+                correct += 1
+            elif not extract is None:
+                failures += 1
+                print(f"  regression: {case['name']}: expected {case['code']}, got {code}")
+        printSummary(f"{name} {correct}/{len(corpus)} correct", samples)
+    return 1 if failures else 0
+
+
+def benchTracing(args):
+    """
+    Measures the overhead per call of the `logger.logging` decorator.
+
+    A trivial function is called with a large text argument, undecorated, with
+    the eager formatting used before, and with the current decorator with
+    tracing disabled, enabled and sampled. Traced output goes to a sink that
+    drops it, so only the cost of the decorator is measured.
+
+    """
+    import logger
+    from functools import wraps
+
+    def eager(f):
+        @wraps(f)
+        def wrap(*a, **kw):
+            lg.trace("enter: %r args[%r, %r]" % (f.__name__, a, kw))
+            result = f(*a, **kw)
+            lg.trace("exit: %r" % (f.__name__))
+            return result
+        return wrap
+
+    def declare(self, password, text):
+        return text
+
+    text = "Δηλώνω υπεύθυνα ότι " * 200
+    calls = args['calls']
+    def measure(name, f):
+        start = time.perf_counter()
+        for _ in range(calls):
+            f(None, "secret", text)
+        print(f"{name:<40} {1e9 * (time.perf_counter() - start) / calls:10.1f} ns/call")
+
+    lg.remove()
+    lg.add(lambda m: None, level='SUCCESS')
+    logger.configureTracing(False)
+    measure("undecorated", declare)
+    measure("eager formatting, level SUCCESS", eager(declare))
+    measure("logger.logging, tracing off", logger.logging(declare))
+
+    lg.remove()
+    lg.add(lambda m: None, level='TRACE')
+    measure("eager formatting, level TRACE", eager(declare))
+    logger.configureTracing(True)
+    measure("logger.logging, tracing on", logger.logging(declare))
+    logger.configureTracing(True, sample=0.01)
+    measure("logger.logging, tracing 1% sampled", logger.logging(declare))
+    logger.configureTracing(False)
+    return 0
+
+
+def benchPortal(args):
+    """
+    Runs bulkDeclare end to end against the mock portal for several batch sizes.
+
+    Each batch is a CSV with one receiver and `n` rows, processed by a separate
+    bulkDeclare process in an empty working directory with headless Chrome. The
+    mock portal delivers the SMS codes to the webhook SMS source of the run. Per
+    batch the declarations per minute, the p50/p95 of the stages, taken from the
+    metrics file of the run, the peak memory of bulkDeclare with its browsers and
+    the WebDriver commands per declaration are printed.
+
+    """
+    import mockPortal
+
+    script  = pathlib.Path(__file__).absolute().parent / 'bulkDeclare.py'
+    webhook = freePort()
+    portal  = mockPortal.MockPortal(  mockPortal.webhookSender(f"http://127.0.0.1:{webhook}/")
+                                    , port      = 0
+                                    , taxid     = mockPortal.PORTAL_DEFAULTS['taxid']
+                                    , latency   = mockPortal.parseSteps(args['latency'], '--latency')
+                                    , failures  = mockPortal.parseSteps(args['fail'], '--fail')
+                                    , sms_delay = args['sms_delay']
+                                    , seed      = 0 )
+    results = list()
+    try:
+        for n in args['batches']:
+            with tempfile.TemporaryDirectory(prefix='gsis_bench_') as tmp:
+                tmp = pathlib.Path(tmp)
+                with open(tmp / 'jobs.csv', 'w', encoding='utf-8-sig') as f:
+                    f.write('ΔΟΥ ΑΘΗΝΩΝ\n')
+                    f.writelines( f"Δηλώνω υπεύθυνα ότι η δήλωση {i} είναι αληθής.\n" for i in range(n) )
+                command = [ sys.executable, script.as_posix()
+                          , '-u', 'benchmark', '-p', 'benchmark', '--taxid', mockPortal.PORTAL_DEFAULTS['taxid']
+                          , '--email', 'benchmark@example.com', '--csv', 'jobs.csv', '--download-dir', 'downloads'
+                          , '--url', portal.url, '--web_timeout', str(args['web_timeout'])
+                          , '--sms-source', 'webhook', '--sms-webhook-port', str(webhook)
+                          , '--workers', str(args['workers']), '--log-level', 'WARNING' ]
+                command += ['--headless'] if args['headless'] else []
+                command += ['--pipeline'] if args['pipeline'] else []
+                command += ['--reuse-session'] if args['reuse_session'] else []
+                command += ['--no-fused-actions'] if not args['fused_actions'] else []
+                command += ['--http-engine'] if args['http_engine'] else []
+                command += ['--sms-dispatcher'] if args['sms_dispatcher'] else []
+                command += ['--retries', *args['retries']] if args['retries'] else []
+
+                start   = time.perf_counter()
+                process = subprocess.Popen(command, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                memory  = PeakMemory(process.pid)
+                process.wait()
+                wall    = time.perf_counter() - start
+                peak    = memory.stop()
+
+                records = [ json.loads(line) for journal in (tmp / 'downloads').glob('bulk_declare_*.jsonl')
+                            for line in journal.read_text(encoding='utf-8').splitlines() if line.strip() ]
+                issued  = sum( 1 for r in records if r.get('file') )
+                retries = sum( r.get('retries') or 0 for r in records )
+                commands = [ r['commands'] for r in records if r.get('file') and r.get('commands') ]
+                spans   = dict()
+                for summary in (tmp / 'downloads').glob('bulk_declare_*.json'):
+                    spans = json.loads(summary.read_text(encoding='utf-8')).get('spans', {})
+                result = { 'batch' : n, 'issued' : issued, 'failed' : len(records) - issued, 'retries' : retries, 'wall' : wall
+                         , 'per_minute' : 60 * issued / wall, 'peak_mb' : None if peak is None else peak / 2**20
+                         , 'commands' : statistics.fmean(commands) if commands else None
+                         , 'stages' : { k : v for k, v in spans.items() if not '.' in k } }
+                results.append(result)
+
+                print(f"batch {n:<6} issued={issued:<6} failed={result['failed']:<4} retries={retries:<4} wall={wall:9.1f}s "
+                      f"{result['per_minute']:8.1f} decl/min peak={'n/a' if peak is None else f'{peak / 2**20:8.0f}MB'} "
+                      f"commands/decl={'n/a' if not commands else f'{statistics.fmean(commands):.1f}'}")
+                for stage, s in result['stages'].items():
+                    print(f"    {stage:<24} p50={s['p50']:8.3f}s p95={s['p95']:8.3f}s p99={s['p99']:8.3f}s")
+    finally:
+        portal.close()
+    if psutil is None:
+        print("peak memory needs psutil")
+    if not args['out'] is None:
+        pathlib.Path(args['out']).write_text(json.dumps(results, indent=2), encoding='utf-8')
+    return 0 if all( r['failed'] == 0 for r in results ) or args['fail'] else 1
+
+
+def benchService(args):
+    """
+    Measures the throughput of the declaration service under sustained submission.
+
+    The service is started once against the mock portal with headless Chrome,
+    then `args['jobs']` jobs are submitted to its API at `args['rate']` jobs per
+    second, all at once if the rate is 0. The declarations per minute from the
+    first submission to the last finished job, the p50/p95/p99 of the time the
+    jobs waited in the queue and of their time from submission to the PDF, and
+    the peak memory of the service with its browsers are printed.
+
+    """
+    import signal
+    import requests
+    from datetime import datetime as dt
+    import mockPortal
+
+    script  = pathlib.Path(__file__).absolute().parent / 'declarationService.py'
+    webhook = freePort()
+    api     = f"http://127.0.0.1:{freePort()}"
+    portal  = mockPortal.MockPortal(  mockPortal.webhookSender(f"http://127.0.0.1:{webhook}/")
+                                    , port      = 0
+                                    , taxid     = mockPortal.PORTAL_DEFAULTS['taxid']
+                                    , latency   = mockPortal.parseSteps(args['latency'], '--latency')
+                                    , failures  = mockPortal.parseSteps(args['fail'], '--fail')
+                                    , sms_delay = args['sms_delay']
+                                    , seed      = 0 )
+    try:
+        with tempfile.TemporaryDirectory(prefix='gsis_bench_') as tmp:
+            command = [ sys.executable, script.as_posix()
+                      , '-u', 'benchmark', '-p', 'benchmark', '--taxid', mockPortal.PORTAL_DEFAULTS['taxid']
+                      , '--email', 'benchmark@example.com', '--download-dir', 'downloads'
+                      , '--url', portal.url, '--web_timeout', str(args['web_timeout'])
+                      , '--sms-source', 'webhook', '--sms-webhook-port', str(webhook)
+                      , '--service-port', api.rsplit(':', 1)[1]
+                      , '--workers', str(args['workers']), '--force-reissue', '--log-level', 'WARNING' ]
+            command += ['--headless'] if args['headless'] else []
+            command += ['--http-engine'] if args['http_engine'] else []
+            command += ['--sms-dispatcher'] if args['sms_dispatcher'] else []
+            process = subprocess.Popen(command, cwd=tmp, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            memory  = PeakMemory(process.pid)
+            try:
+                started = time.perf_counter()
+                while True:
+                    try:
+                        requests.get(f"{api}/stats", timeout=1)
+                        break
+                    except requests.ConnectionError:
+                        if not process.poll() is None or time.perf_counter() - started > 120:
+                            raise Exception("declaration service did not start")
+                        time.sleep(0.2)
+                print(f"service started in {time.perf_counter() - started:.1f}s")
+
+                start = time.perf_counter()
+                for n in range(args['jobs']):
+                    if args['rate'] > 0:
+                        time.sleep(max(0, start + n / args['rate'] - time.perf_counter()))
+                    requests.post(f"{api}/jobs", json={ 'receiver' : 'ΔΟΥ ΑΘΗΝΩΝ'
+                                                      , 'text'     : f"Δηλώνω υπεύθυνα ότι η δήλωση {n} είναι αληθής." }, timeout=10)
+                while True:
+                    stats = requests.get(f"{api}/stats", timeout=10).json()
+                    if stats['done'] + stats['failed'] >= args['jobs'] or not process.poll() is None:
+                        break
+                    time.sleep(0.2)
+                wall = time.perf_counter() - start
+                jobs = requests.get(f"{api}/jobs", params={ 'limit' : args['jobs'] }, timeout=10).json()
+            finally:
+                if process.poll() is None:
+                    if sys.platform == 'win32':
+                        process.terminate()
+                    else:
+                        process.send_signal(signal.SIGINT) # lets the service stop its browsers
+                    try:
+                        process.wait(timeout=60)
+                    except subprocess.TimeoutExpired:
+                        process.kill()
+                peak = memory.stop()
+    finally:
+        portal.close()
+
+    seconds = lambda a, b: (dt.fromisoformat(b) - dt.fromisoformat(a)).total_seconds()
+    done    = [ j for j in jobs if j['state'] == 'done' ]
+    result  = { 'jobs' : args['jobs'], 'rate' : args['rate'], 'issued' : len(done), 'failed' : stats['failed'], 'wall' : wall
+              , 'per_minute' : 60 * len(done) / wall, 'peak_mb' : None if peak is None else peak / 2**20 }
+    print(f"jobs {args['jobs']:<6} rate={args['rate'] or 'burst'} issued={len(done):<6} failed={stats['failed']:<4} wall={wall:9.1f}s "
+          f"{result['per_minute']:8.1f} decl/min peak={'n/a' if peak is None else f'{peak / 2**20:8.0f}MB'}")
+    if done:
+        printSummary("queue wait", [ seconds(j['submitted'], j['started']) for j in done ])
+        printSummary("submission to PDF", [ seconds(j['submitted'], j['finished']) for j in done ])
+    if psutil is None:
+        print("peak memory needs psutil")
+    if not args['out'] is None:
+        pathlib.Path(args['out']).write_text(json.dumps(result, indent=2), encoding='utf-8')
+    return 0 if stats['failed'] == 0 or args['fail'] else 1
+
+
+def benchStartup(args):
+    """
+    Measures the import time of every entry point against a budget.
+
+    Every module with a `__main__` block is imported `repeat` times in a fresh
+    interpreter with `-X importtime`, the median of its cumulative import time
+    is compared to the budget. For a module over budget the direct imports
+    that took longest are printed. The benchmark fails if any module exceeds
+    the budget or can not be imported.
+
+    """
+    folder  = pathlib.Path(__file__).absolute().parent
+    modules = sorted( f.stem for f in folder.glob('*.py')
+                      if "if __name__ == '__main__'" in f.read_text(encoding='utf-8') )
+    failures = 0
+    for module in modules:
+        samples = list()
+        imports = dict()
+        for _ in range(args['repeat']):
+            process = subprocess.run(  [sys.executable, '-X', 'importtime', '-c', f"import {module}"]
+                                     , cwd=folder, capture_output=True, text=True )
+            if process.returncode != 0:
+                break
+            for line in process.stderr.splitlines():
+                fields = line.split('|')
+                if len(fields) != 3 or not fields[1].strip().isdigit():
+                    continue
+                name = fields[2][1:].rstrip() # one blank after the separator, then the nesting
+                if name.strip() == module and not name.startswith(' '):
+                    samples.append(int(fields[1]) / 1e6)
+                elif name.startswith('  ') and not name.startswith('   '): # imported by the module itself
+                    imports.setdefault(name.strip(), list()).append(int(fields[1]) / 1e6)
+        if not samples:
+            failures += 1
+            print(f"{module:<24} import failed: {process.stderr.strip().splitlines()[-1] if process.stderr.strip() else process.returncode}")
+            continue
+        median = statistics.median(samples)
+        over   = median > args['budget']
+        failures += over
+        print(f"{module:<24} {1000 * median:8.1f}ms{'  over budget' if over else ''}")
+        if over:
+            heaviest = sorted(imports.items(), key=lambda e: statistics.median(e[1]), reverse=True)[:5]
+            for name, durations in heaviest:
+                print(f"    {name:<40} {1000 * statistics.median(durations):8.1f}ms")
+    print(f"{len(modules) - failures}/{len(modules)} entry points within {1000 * args['budget']:.0f}ms")
+    return 1 if failures else 0
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='benchmark'
+        , description="benchmarks of the bulk declaration"
+        )
+    parser.add_argument('--log-level', dest='log_level', default='WARNING', required=False)
+    benchmarks = parser.add_subparsers(dest='benchmark', required=True)
+
+    ocr = benchmarks.add_parser('ocr', help="per frame latency of the OCR engines")
+    ocr.add_argument('--frames', dest='frames', nargs='*', default=[], help="screenshots of the notification area.")
+    ocr.add_argument('--tesseract_cmd', dest='tesseract', default=r"C:\Program Files\Tesseract-OCR\tesseract.exe")
+    ocr.add_argument('--repeat', dest='repeat', default=10, type=int)
+    ocr.set_defaults(func=benchOCR)
+
+    extractor = benchmarks.add_parser('extractor', help="accuracy and latency of the SMS code extraction")
+    extractor.add_argument('--corpus', dest='corpus', default='corpus/sms_ocr.jsonl')
+    extractor.add_argument('--repeat', dest='repeat', default=20, type=int)
+    extractor.set_defaults(func=benchExtractor)
+
+    tracing = benchmarks.add_parser('tracing', help="overhead per call of the tracing decorator")
+    tracing.add_argument('--calls', dest='calls', default=100000, type=int)
+    tracing.set_defaults(func=benchTracing)
+
+    portal = benchmarks.add_parser('portal', help="end to end throughput against the mock portal")
+    portal.add_argument('--batches', dest='batches', nargs='*', default=[10, 100, 1000, 10000], type=int)
+    portal.add_argument('--workers', dest='workers', default=1, type=int)
+    portal.add_argument('--pipeline', dest='pipeline', default=False, action='store_true')
+    portal.add_argument('--reuse-session', dest='reuse_session', default=False, action='store_true')
+    portal.add_argument('--no-fused-actions', dest='fused_actions', default=True, action='store_false', help="use the separate WebDriver commands per click.")
+    portal.add_argument('--http-engine', dest='http_engine', default=False, action='store_true', help="submit the form steps over HTTP.")
+    portal.add_argument('--sms-dispatcher', dest='sms_dispatcher', default=False, action='store_true', help="let the sessions wait for their SMS at the same time.")
+    portal.add_argument('--retries', dest='retries', default=[], nargs='*', help="STEP=N retries of the failed steps, see bulkDeclare --retries.")
+    portal.add_argument('--headed', dest='headless', default=True, action='store_false', help="show the browser windows.")
+    portal.add_argument('--latency', dest='latency', nargs='*', default=[], help="STEP=SECONDS of the mock portal.")
+    portal.add_argument('--fail', dest='fail', nargs='*', default=[], help="STEP=P failure probability of the mock portal.")
+    portal.add_argument('--sms-delay', dest='sms_delay', default=0.5, type=float)
+    portal.add_argument('--web-timeout', dest='web_timeout', default=10, type=int)
+    portal.add_argument('--out', dest='out', default=None, help="JSON file to write the results to.")
+    portal.set_defaults(func=benchPortal)
+
+    service = benchmarks.add_parser('service', help="throughput of the declaration service under sustained submission")
+    service.add_argument('--jobs', dest='jobs', default=100, type=int)
+    service.add_argument('--rate', dest='rate', default=0.0, type=float, help="jobs submitted per second, 0 submits all at once.")
+    service.add_argument('--workers', dest='workers', default=2, type=int)
+    service.add_argument('--http-engine', dest='http_engine', default=False, action='store_true', help="submit the form steps over HTTP.")
+    service.add_argument('--sms-dispatcher', dest='sms_dispatcher', default=False, action='store_true', help="let the sessions wait for their SMS at the same time.")
+    service.add_argument('--headed', dest='headless', default=True, action='store_false', help="show the browser windows.")
+    service.add_argument('--latency', dest='latency', nargs='*', default=[], help="STEP=SECONDS of the mock portal.")
+    service.add_argument('--fail', dest='fail', nargs='*', default=[], help="STEP=P failure probability of the mock portal.")
+    service.add_argument('--sms-delay', dest='sms_delay', default=0.5, type=float)
+    service.add_argument('--web-timeout', dest='web_timeout', default=10, type=int)
+    service.add_argument('--out', dest='out', default=None, help="JSON file to write the results to.")
+    service.set_defaults(func=benchService)
+
+    startup = benchmarks.add_parser('startup', help="import time of every entry point against a budget")
+    startup.add_argument('--budget', dest='budget', default=0.3, type=float, help="seconds an import may take.")
+    startup.add_argument('--repeat', dest='repeat', default=5, type=int)
+    startup.set_defaults(func=benchStartup)
+
+    args = vars(parser.parse_args())
+    if 'latency' in args:
+        import mockPortal
+        try:
+            mockPortal.parseSteps(args['latency'], '--latency')
+            mockPortal.parseSteps(args['fail'], '--fail')
+        except argparse.ArgumentTypeError as e:
+            parser.error(str(e))
+    lg.remove()
+    lg.add(lambda m: print(m, end=''), level=args['log_level'])
+    raise SystemExit(args['func'](args))
@@ -0,0 +1,301 @@
+# -*- coding: utf-8 -*-
+"""
+This module starts the Chrome browsers the declarations run in.
+
+Starting a browser with `webdriver.Chrome(options)` resolves the chromedriver
+with Selenium Manager, spawns a new chromedriver and opens an empty incognito
+profile, which loads every image, font and tracking script of the portal
+again. A `BrowserFactory` does the expensive parts once:
+
+- the chromedriver and Chrome binaries are resolved once and one chromedriver
+  process serves the sessions of all browsers,
+- with a cache directory each browser gets a disk cache slot that survives
+  the browser and the run, so static portal assets are loaded from disk. A slot
+  is used by one browser at a time, `warm` fills the empty slots up front,
+- non-essential resources (images, fonts, media, analytics) can be blocked.
+
+`python browserFactory.py --url <url>` measures the time from the start of a
+browser to its first page with and without the factory.
+
+"""
+
+
+import time
+import pathlib
+import argparse
+import tempfile
+import threading
+from selenium import webdriver
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.common.driver_finder import DriverFinder
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+BROWSER_DEFAULTS = {
+          'headless'  : False
+        , 'cache_dir' : None
+        , 'shared'    : True
+        , 'window'    : '1280,1024'
+        # URL patterns blocked by `block_resources`, images are disabled by a preference
+        , 'blocked'   : [ '*.woff', '*.woff2', '*.ttf', '*.otf', '*.eot'
+                        , '*.mp4', '*.webm', '*.mp3'
+                        , '*google-analytics.com*', '*googletagmanager.com*', '*doubleclick.net*'
+                        , '*hotjar.com*', '*facebook.net*' ]
+    }
+
+#%% logic
+
+class BrowserFactory:
+    """
+    Creates Chrome browsers sharing one resolved chromedriver and a disk cache.
+
+    The factory is thread safe, one instance is meant to serve all sessions of
+    a bulk run. Browsers must be handed back with `release`.
+
+    """
+
+    @logger.logging
+    def __init__(  self, headless=BROWSER_DEFAULTS['headless'], cache_dir=BROWSER_DEFAULTS['cache_dir']
+                 , block_resources=None, shared=BROWSER_DEFAULTS['shared']):
+        """
+        Initializes the BrowserFactory instance and resolves the chromedriver.
+
+        Args:
+            headless (bool, optional): Run Chrome without a window. Defaults to False.
+            cache_dir (str, optional): Directory keeping the disk cache slots across
+                browsers and runs. Defaults to None, each browser starts incognito
+                with an empty cache.
+            block_resources (bool, optional): Block images, fonts, media and analytics.
+                Defaults to None, blocking them in headless mode only.
+            shared (bool, optional): Let one chromedriver process serve all browsers.
+                Defaults to True, otherwise each browser gets its own chromedriver.
+
+        """
+        self.headless        = headless
+        self.cache_dir       = None if cache_dir is None else pathlib.Path(cache_dir)
+        self.block_resources = headless if block_resources is None else block_resources
+        self.shared          = shared
+        self.lock            = threading.Lock()
+        self.slots           = dict() # driver session id -> cache slot
+        self.busy            = set()  # cache slots of running browsers
+        self.profiles        = dict() # driver session id -> temporary profile
+        self.service         = None
+
+        start = time.perf_counter()
+        finder = DriverFinder(Service(), Options())
+        self.driver_path  = finder.get_driver_path()
+        self.browser_path = finder.get_browser_path()
+        lg.debug(f"chromedriver {self.driver_path} resolved in {time.perf_counter() - start:.3f} sec")
+        if not self.cache_dir is None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        return
+
+    def options(self, download_dir, slot=None, profile=None):
+        """
+        Returns the Chrome options of a browser.
+
+        Args:
+            download_dir (str): The directory Chrome saves downloads to.
+            slot (pathlib.Path, optional): The disk cache directory. Defaults to None.
+            profile (str, optional): The temporary user data directory used with a
+                disk cache. Defaults to None, incognito.
+
+        Returns:
+            Options: The options.
+
+        """
+        options = Options()
+        if slot is None:
+            options.add_argument("--incognito") # private mode
+        else:
+            # the profile is temporary, only the cache is kept
+            options.add_argument(f"--user-data-dir={profile}")
+            options.add_argument(f"--disk-cache-dir={slot}")
+        options.add_argument("--disable-popup-blocking")
+        options.add_argument("--no-sandbox")
+        options.add_argument("--disable-dev-shm-usage")
+        if self.headless:
+            options.add_argument("--headless=new")
+            options.add_argument(f"--window-size={BROWSER_DEFAULTS['window']}")
+        if self.browser_path:
+            options.binary_location = self.browser_path
+        prefs = {
+            "download.default_directory": download_dir,  # Zielordner
+            "download.prompt_for_download": False,       # Kein Dialog
+            "download.directory_upgrade": True,
+            "safebrowsing.enabled": True,
+            # Verhindert automatisches Öffnen von PDFs nach dem Download
+            "plugins.always_open_pdf_externally": True
+            }
+        if self.block_resources:
+            prefs["profile.managed_default_content_settings.images"] = 2
+        options.add_experimental_option("prefs", prefs)
+        return options
+
+    def _sharedService(self):
+        """Returns the running chromedriver shared by all browsers, starting it once."""
+        with self.lock:
+            if self.service is None or self.service.process is None or not self.service.process.poll() is None:
+                self.service = Service(executable_path=self.driver_path)
+                self.service.start()
+                lg.debug(f"shared chromedriver listening on {self.service.service_url}")
+            return self.service
+
+    def _acquireSlot(self):
+        """Returns a free disk cache slot, a new one if all are in use."""
+        with self.lock:
+            n = 0
+            while self.cache_dir / f"slot-{n}" in self.busy:
+                n += 1
+            slot = self.cache_dir / f"slot-{n}"
+            self.busy.add(slot)
+        slot.mkdir(exist_ok=True)
+        return slot
+
+    @logger.logging
+    def create(self, download_dir):
+        """
+        Starts a browser.
+
+        Args:
+            download_dir (str): The directory Chrome saves downloads to.
+
+        Returns:
+            WebDriver: The browser, to be handed back with `release`.
+
+        """
+        slot    = None if self.cache_dir is None else self._acquireSlot()
+        profile = None if slot is None else tempfile.TemporaryDirectory(prefix='gsis_profile_')
+        options = self.options(download_dir, slot, None if profile is None else profile.name)
+        try:
+            if self.shared:
+                # loads the remote WebDriver, deferred to the first browser
+                from selenium.webdriver.chromium.remote_connection import ChromiumRemoteConnection
+                service  = self._sharedService()
+                executor = ChromiumRemoteConnection(  remote_server_addr = service.service_url
+                                                    , browser_name       = 'chrome'
+                                                    , vendor_prefix      = 'goog'
+                                                    , keep_alive         = True
+                                                    , ignore_proxy       = options._ignore_local_proxy )
+                driver = webdriver.Remote(command_executor=executor, options=options)
+            else:
+                driver = webdriver.Chrome(options=options, service=Service(executable_path=self.driver_path))
+        except Exception:
+            with self.lock:
+                self.busy.discard(slot)
+            if not profile is None:
+                profile.cleanup()
+            raise
+
+        with self.lock:
+            self.slots[driver.session_id]    = slot
+            self.profiles[driver.session_id] = profile
+        if self.block_resources:
+            driver.execute('executeCdpCommand', { 'cmd' : 'Network.enable', 'params' : {} })
+            driver.execute('executeCdpCommand', { 'cmd' : 'Network.setBlockedURLs', 'params' : { 'urls' : BROWSER_DEFAULTS['blocked'] } })
+        return driver
+
+    @logger.logging
+    def release(self, driver):
+        """
+        Quits a browser created by `create` and frees its disk cache slot.
+
+        Args:
+            driver (WebDriver): The browser.
+
+        """
+        session = driver.session_id
+        try:
+            driver.quit()
+        except Exception as e:
+            lg.debug(f"quitting browser failed: {e}")
+        with self.lock:
+            self.busy.discard(self.slots.pop(session, None))
+            profile = self.profiles.pop(session, None)
+        if not profile is None:
+            profile.cleanup()
+        return
+
+    @logger.logging
+    def warm(self, url, slots):
+        """
+        Fills the empty disk cache slots with the static assets of the portal.
+
+        Args:
+            url (str): The page to load, its assets are cached.
+            slots (int): The number of slots to fill, usually the number of sessions.
+
+        """
+        if self.cache_dir is None:
+            return
+        empty = { f"slot-{n}" for n in range(slots)
+                  if not (self.cache_dir / f"slot-{n}").exists() or not any((self.cache_dir / f"slot-{n}").iterdir()) }
+        if not empty:
+            return
+        with tempfile.TemporaryDirectory() as download_dir:
+            drivers = list()
+            try:
+                # with no browser running the slots are taken in order
+                for _ in range(slots):
+                    drivers.append(self.create(download_dir))
+                for driver in drivers:
+                    if self.slots[driver.session_id].name in empty:
+                        driver.get(url)
+            finally:
+                for driver in drivers:
+                    self.release(driver)
+        lg.info(f"{len(empty)} browser cache slots warmed")
+        return
+
+    @logger.logging
+    def close(self):
+        """Stops the shared chromedriver."""
+        with self.lock:
+            if not self.service is None:
+                self.service.stop()
+                self.service = None
+        return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='browserFactory'
+        , description="measures the time from the start of a browser to its first page"
+        )
+    parser.add_argument('--url', dest='url', required=True)
+    parser.add_argument('--repeat', dest='repeat', default=5, type=int)
+    parser.add_argument('--headless', dest='headless', default=False, action='store_true')
+    parser.add_argument('--cache-dir', dest='cache_dir', default=None)
+    args = vars(parser.parse_args())
+
+    def measure(name, start_browser, stop_browser):
+        samples = list()
+        with tempfile.TemporaryDirectory() as download_dir:
+            for _ in range(args['repeat']):
+                start  = time.perf_counter()
+                driver = start_browser(download_dir)
+                driver.get(args['url'])
+                samples.append(time.perf_counter() - start)
+                stop_browser(driver)
+        samples.sort()
+        print(f"{name:<40} min={samples[0]:7.3f}s median={samples[len(samples) // 2]:7.3f}s max={samples[-1]:7.3f}s")
+
+    def cold(download_dir):
+        options = Options()
+        options.add_argument("--incognito")
+        if args['headless']:
+            options.add_argument("--headless=new")
+        options.add_experimental_option("prefs", { "download.default_directory": download_dir })
+        return webdriver.Chrome(options=options)
+
+    measure("webdriver.Chrome per browser", cold, lambda driver: driver.quit())
+    factory = BrowserFactory(headless=args['headless'], cache_dir=args['cache_dir'])
+    factory.warm(args['url'], 1)
+    measure("BrowserFactory", factory.create, factory.release)
+    factory.close()
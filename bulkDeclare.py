@@ -10,19 +10,22 @@ declaration, and downloading the resulting PDF.
 """
 
 
-import pytesseract
-from PIL import ImageGrab
-import pyautogui
-import uiautomation as auto
-import time
-import re
-from screeninfo import get_monitors
-import pandas as pd
 import SMSnotificationParser
+import smsSources
+import smsDispatcher
 import gsisDeclaration
+import declarationJobs
+import jobValidation
+import statusJournal
+import declarationIndex
+import browserFactory
+import metrics
+import outputNaming
+import stepTimeouts
 import argparse
 import pathlib
-import itertools
+import queue
+import threading
 from datetime import datetime as dt
 import logger
 from functools import wraps
@@ -31,6 +34,11 @@ from loguru import logger as lg
 
 #%% constands
 
+DESCRIPTION = "Reads data from csv and creates signed declarations through greek goverment portal. Created documents are named by --filename-template. If the file exists, it will receive the next available numeric index e.g. '0_ΔΟΥ_1a2b3c4d (4).pdf'. Every folder holds a manifest.jsonl mapping the documents to their jobs."
+
+# stages that only one session at a time can be in, see gsisGrabber._confirmDeclaration
+SERIALIZED_STAGES = ['sms']
+
 #%% helper
 
 def timing(f):
@@ -40,13 +48,384 @@ def timing(f):
         result = f(*args, **kw)
         te = time()
         lg.debug('runtime %2.4f sec: func:%r args:[%r, %r]' % \
-          (te-ts, f.__name__, args, kw))
+          (te-ts, f.__name__, [logger.redacted(a) for a in args], logger.redacted(kw)))
         return result
     return wrap
 
 
+def stageOccupancy(statuses, wall, sessions, serialized=SERIALIZED_STAGES):
+    """
+    Computes the share of the available capacity each declaration stage was busy.
+
+    Parallel stages can be occupied by all sessions at once, serialized stages only
+    by one. An occupancy of the `sms` stage close to 1.0 means the batch runs at the
+    ceiling given by the SMS channel and more sessions will not increase throughput.
+
+    Only the top level stages are counted, the dotted spans of their steps are
+    part of them.
+
+    Args:
+        statuses (list): The job statuses holding the `<stage>_sec` durations.
+        wall (float): The wall time of the batch in seconds.
+        sessions (int): The number of parallel browser sessions.
+        serialized (list, optional): The stages only one session at a time can be
+            in. Defaults to `SERIALIZED_STAGES`.
+
+    Returns:
+        dict: The occupancy per stage as a value between 0.0 and 1.0.
+
+    """
+    busy = dict()
+    for status in statuses:
+        for key, value in status.items():
+            if key.endswith('_sec') and not value is None and not '.' in key:
+                busy[key[:-4]] = busy.get(key[:-4], 0.0) + value
+    if wall <= 0:
+        return dict()
+    return { stage : duration / (wall * (1 if stage in serialized else sessions)) 
+             for stage, duration in busy.items() }
+
+
+def createSMSSource(args):
+    """
+    Creates the source of the SMS codes selected by `args['sms_source']`.
+
+    With `args['sms_dispatcher']` the source is read by a `smsDispatcher.CodeDispatcher`,
+    so the declarations do not hold the SMS channel while waiting for their code.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+
+    Returns:
+        smsSources.SMSSource: The OCR poller of the notification area ('ocr'), a
+            local webhook receiver ('webhook') or a followed file or named pipe ('file').
+
+    """
+    if args.get('sms_dispatcher', False):
+        return smsDispatcher.CodeDispatcher(  createSMSSource(dict(args, sms_dispatcher=False))
+                                            , path = pathlib.Path(args['download_dir']) / smsDispatcher.DISPATCH_DEFAULTS['filename'] )
+    source = args.get('sms_source', 'ocr')
+    if source == 'webhook':
+        return smsSources.WebhookSMSSource(  host    = args.get('sms_webhook_host', smsSources.SOURCE_DEFAULTS['webhook_host'])
+                                           , port    = args['sms_webhook_port']
+                                           , token   = args['sms_webhook_token']
+                                           , timeout = args['sms_timeout'] )
+    if source == 'file':
+        return smsSources.FileSMSSource(  path    = args['sms_file']
+                                        , timeout = args['sms_timeout'] )
+    return SMSnotificationParser.SMSNotification(  text_pattern             = args['sms_pattern']
+                                                 , tesseract_cmd            = args['tesseract']
+                                                 , timeout                  = args['sms_timeout']
+                                                 , notification_center_name = args['notification_center_name']
+                                                 , clear_button_label       = args['clear_button_label'] 
+                                                 , debug                    = args['debug'] 
+                                                 , ocr_engine               = args.get('ocr_engine', SMSnotificationParser.SMS_DEFAULTS['ocr_engine'])
+                                                 )
+
+
+def createValidator(args):
+    """
+    Creates the validator the declaration jobs are checked with before they are issued.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+
+    Returns:
+        jobValidation.JobValidator: The validator with the rules of `args['validation_rules']`.
+
+    """
+    return jobValidation.JobValidator(  args.get('validation_rules', jobValidation.RULES)
+                                      , max_text = args.get('max_text_length', jobValidation.VALIDATION_DEFAULTS['max_text']) )
+
+
+def latencyHistory(args):
+    """
+    Returns the latency history the timeouts of the portal steps are learned from.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+
+    Returns:
+        stepTimeouts.LatencyHistory: The history in the download directory, shared by
+            all sessions of the process, or None if `args['adaptive_timeouts']` is off.
+
+    """
+    if not args.get('adaptive_timeouts', True):
+        return None
+    return stepTimeouts.history(  pathlib.Path(args['download_dir']) / stepTimeouts.TIMEOUT_DEFAULTS['filename']
+                                , multiplier = args.get('timeout_multiplier', stepTimeouts.TIMEOUT_DEFAULTS['multiplier'])
+                                , floor      = args.get('timeout_floor', stepTimeouts.TIMEOUT_DEFAULTS['floor']) )
+
+
+def createGrabber(args, receiver, text, download_dir, getCode, smsChannel=None, browsers=None, filename=None):
+    """
+    Creates a gsisGrabber for a single declaration based on the command-line arguments.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+        receiver (str): The name of the recipient of the declaration.
+        text (str): The main content of the declaration.
+        download_dir (pathlib.Path): The directory where the final PDF will be saved.
+        getCode (function): A function to retrieve the SMS code.
+        smsChannel (function, optional): Factory of the context manager that grants
+            exclusive access to the SMS channel. Defaults to None.
+        browsers (browserFactory.BrowserFactory, optional): The factory starting the
+            browser. Defaults to None.
+        filename (str, optional): The file name of the PDF. Defaults to None,
+            declaration.pdf.
+
+    Returns:
+        gsisDeclaration.gsisGrabber: The initialized grabber, with the portal already opened.
+
+    """
+    return gsisDeclaration.gsisGrabber(
+              username    = args['user']
+            , password   = args['password']
+            , taxid      = args['taxid']
+            , email      = args['email']
+            , receiver   = receiver
+            , download_dir = download_dir.as_posix()
+            , url        = args['url']
+            , retries    = gsisDeclaration.parseRetries(args.get('retries') or [])
+            , timeout    = args['web_timeout']
+            , getCode    = getCode
+            , smsChannel = smsChannel
+            , filename   = filename or "declaration.pdf"
+            , text       = text
+            , headless   = args.get('headless', False)
+            , fused_actions = args.get('fused_actions', True)
+            , browsers   = browsers
+            , http_engine = args.get('http_engine', False)
+            , latency    = latencyHistory(args)
+            )
+
+
+def retryStatus(gsis):
+    """
+    Returns the status columns of the step retries of a grabber.
+
+    Args:
+        gsis (gsisDeclaration.gsisGrabber): The grabber after its declaration.
+
+    Returns:
+        dict: `retries`, the number of retried steps, and `retry_saved`, the
+              seconds of earlier steps the retries did not repeat.
+
+    """
+    return { 'retries'     : sum(getattr(gsis, 'retried', dict()).values())
+           , 'retry_saved' : round(getattr(gsis, 'saved', 0.0), 3) }
+
+
 #%% logic
 
+@logger.logging
+def processJob(args, job, gsis, getCode, smsChannel, index=None, browsers=None):
+    """
+    Creates and downloads the declaration of a single job.
+
+    The PDF is named by `args['filename_template']` and recorded in the manifest
+    of its folder.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+        job (dict): The job to process, see `automate` for its keys.
+        gsis (gsisDeclaration.gsisGrabber): A logged in grabber to reuse or None.
+        getCode (function): A function to retrieve the SMS code.
+        smsChannel (function): Factory of the context manager that grants exclusive
+            access to the SMS channel.
+        index (declarationIndex.DeclarationIndex, optional): The index to add the 
+            downloaded declaration to. Defaults to None.
+        browsers (browserFactory.BrowserFactory, optional): The factory starting the
+            browsers. Defaults to None.
+
+    Returns:
+        tuple: The status of the job and the grabber to be reused by the next job
+               (None if there is none).
+
+    """
+    url = None
+    declaration = None
+    stages = dict()
+    commands = None
+    document = dict()
+    retries = dict()
+    error = None
+    try:
+        filename = outputNaming.render(  args.get('filename_template', outputNaming.NAMING_DEFAULTS['template'])
+                                       , outputNaming.jobFields(job) )
+        if args.get('reuse_session', False):
+            if gsis is None:
+                gsis = createGrabber(args, job['receiver'], job['text'], job['download_dir'], getCode, smsChannel, browsers, filename)
+            else:
+                gsis.setDeclaration(job['receiver'], job['text'], job['download_dir'].as_posix(), filename)
+            url, declaration = gsis.run()
+            stages = gsis.stages
+            commands = sum(gsis.commands.values())
+            document = { 'size' : gsis.filesize, 'sha256' : gsis.sha256 }
+            retries = retryStatus(gsis)
+            if declaration is None:
+                # a failed step leaves the browser in an unknown state, next job starts with a fresh login
+                gsis.cleanup()
+                gsis = None
+        else:
+            with createGrabber(args, job['receiver'], job['text'], job['download_dir'], getCode, smsChannel, browsers, filename) as gsis:
+                url, declaration = gsis.run()
+                stages = gsis.stages
+                commands = sum(gsis.commands.values())
+                document = { 'size' : gsis.filesize, 'sha256' : gsis.sha256 }
+                retries = retryStatus(gsis)
+            gsis = None
+        lg.success(f"{dt.now()}: declaration {job['idx']}/{job['receiver_index']} for {job['receiver']} created")
+        if not declaration is None:
+            outputNaming.directory(job['download_dir']).record(  declaration, key = job['key'], row = job['idx']
+                                                               , receiver = job['receiver'], url = url, **document )
+        if not index is None and not declaration is None:
+            index.add(job['receiver'], job['text'], args['taxid'], url, declaration)
+
+    except Exception as e:
+        lg.exception(e)
+        error = str(e)
+        if not gsis is None:
+            stages = getattr(gsis, 'stages', stages)
+            commands = sum(getattr(gsis, 'commands', dict()).values())
+            retries = retryStatus(gsis)
+            gsis.cleanup()
+            gsis = None
+    
+    status = { 'idx'      : job['idx']
+             , 'receiver' : job['receiver']
+             , 'url'      : url
+             , 'file'     : declaration
+             , 'key'      : job['key']
+             , 'commands' : commands
+             , **retries }
+    if not declaration is None:
+        status.update(document)
+    if not error is None:
+        status['error'] = error
+    status.update({ f"{name}_sec" : round(duration, 3) for name, duration in stages.items() })
+    return status, gsis
+
+
+def declarationWorker(args, jobs, results, getCode, smsChannel, index=None, browsers=None):
+    """
+    Processes jobs from a shared queue until a None job is received.
+
+    A None result is queued when the worker stops.
+
+    Each worker owns its own browser session, so several workers can fill forms in
+    parallel. Only the SMS part of a declaration is serialized by `smsChannel`.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+        jobs (queue.Queue): The queue to take jobs from.
+        results (queue.Queue): The queue to put the (job, status) tuples into.
+        getCode (function): A function to retrieve the SMS code.
+        smsChannel (function): Factory of the context manager that grants exclusive
+            access to the SMS channel.
+        index (declarationIndex.DeclarationIndex, optional): The index of issued
+            declarations. Defaults to None.
+        browsers (browserFactory.BrowserFactory, optional): The factory starting the
+            browsers, shared by all workers. Defaults to None.
+
+    """
+    gsis = None
+    try:
+        while True:
+            job = jobs.get()
+            if job is None:
+                break
+            status, gsis = processJob(args, job, gsis, getCode, smsChannel, index, browsers)
+            results.put( (job, status) )
+        if not gsis is None:
+            gsis.cleanup()
+    finally:
+        results.put(None) # tells automate that this worker is done
+    return
+
+
+def produceJobs(args, jobs, results, sessions, completed=None, index=None, rejected=None, warm=None):
+    """
+    Streams the jobs of the CSV file into the shared queue.
+
+    The file is read lazily, so the first declaration starts before a large file
+    is fully parsed. Each job gets the `download_dir` of its row, the absolute
+    folder of the row below `args['download_dir']`. Jobs found in
+    `completed` or, unless `args['force_reissue']` is set, in the `index` are not
+    queued, their earlier status is put into `results` directly. So is the status
+    of the jobs `rejected` by the validation. When the file is exhausted one None
+    job per worker is queued to stop them.
+
+    Args:
+        args (dict): A dictionary of command-line arguments.
+        jobs (queue.Queue): The queue to put the jobs into.
+        results (queue.Queue): The queue to put the status of completed jobs into.
+        sessions (int): The number of workers consuming the queue.
+        completed (dict, optional): Earlier status of already downloaded jobs, 
+            indexed by the job key. Defaults to None.
+        index (declarationIndex.DeclarationIndex, optional): The index of issued
+            declarations. Defaults to None.
+        rejected (dict, optional): The records of the jobs rejected by the validation,
+            indexed by `(idx, receiver_index)`, see `jobValidation.validate`. Defaults to None.
+        warm (callable, optional): Called once before the first job is queued, so
+            no browser is started for a run with nothing left to declare. Defaults to None.
+
+    """
+    completed = completed or dict()
+    rejected  = rejected or dict()
+    # absolute, so the paths in the journal and the index do not depend on the working directory
+    download_base_dir = pathlib.Path(args['download_dir']).absolute()
+    try:
+        for job in declarationJobs.readJobs(args['csv'], sep = args['csv_sep']):
+            download_dir = download_base_dir
+            if not job['folder'] is None:
+                download_dir = download_dir / job['folder']
+            rejection = rejected.get( (job['idx'], job['receiver_index']) )
+            if not rejection is None and 'folder' in rejection['rules']:
+                download_dir = download_base_dir # an unsafe folder is never created
+            download_dir.mkdir(exist_ok=True, parents=True)
+            job['download_dir'] = download_dir
+            if not rejection is None:
+                results.put( (job, { 'idx'      : job['idx']
+                                   , 'receiver' : job['receiver']
+                                   , 'url'      : None
+                                   , 'file'     : None
+                                   , 'key'      : job['key']
+                                   , 'rejected' : rejection['reason'] }) )
+                continue
+            if job['key'] in completed:
+                lg.info(f"declaration {job['idx']}/{job['receiver_index']} for {job['receiver']} already downloaded, skipped")
+                previous = completed[job['key']]
+                results.put( (job, { 'idx'      : job['idx']
+                                   , 'receiver' : job['receiver']
+                                   , 'url'      : previous.get('url')
+                                   , 'file'     : previous.get('file')
+                                   , 'key'      : job['key']
+                                   , 'resumed'  : True }) )
+                continue
+            if not index is None and not args.get('force_reissue', False):
+                issued = index.lookup(job['receiver'], job['text'], args['taxid'])
+                if not issued is None:
+                    lg.info(f"declaration {job['idx']}/{job['receiver_index']} for {job['receiver']} already issued as {issued['file']}, skipped")
+                    results.put( (job, { 'idx'       : job['idx']
+                                       , 'receiver'  : job['receiver']
+                                       , 'url'       : issued['url']
+                                       , 'file'      : issued['file']
+                                       , 'key'       : job['key']
+                                       , 'duplicate' : True }) )
+                    continue
+            if not warm is None:
+                warm()
+                warm = None
+            jobs.put(job)
+    except Exception as e:
+        lg.exception(e)
+    finally:
+        for _ in range(sessions):
+            jobs.put(None)
+    return
+
+
 @lg.catch
 @logger.logging
 @timing
@@ -54,16 +433,20 @@ def automate(args):
     """
     Automates the bulk creation of declarations based on the provided arguments.
 
-    This function reads a CSV file, initializes the SMS and GSIS automation tools,
-    and then iterates through the CSV data to create and download a declaration
-    for each entry. It also generates HTML status reports.
+    This function checks the whole CSV file with the validation rules, initializes
+    the SMS and GSIS automation tools and then distributes one job per CSV cell to `args['workers']` parallel browser
+    sessions. Every result is appended to a journal next to the overall HTML status
+    report. The report of a CSV row is rendered as soon as all of its declarations
+    are processed, the overall report every `args['report_interval']` seconds and at
+    the end of the run. Rejected declarations are listed in a report of their own
+    and recorded in the journal without being issued.
 
     Args:
         args (dict): A dictionary of command-line arguments containing credentials,
                      file paths, and other configuration settings.
 
     Raises:
-        Exception: If the specified CSV file is not found.
+        Exception: If the specified CSV file is not found or has no header row.
 
     """
     
@@ -73,20 +456,25 @@ def automate(args):
         raise Exception(f"{csv_file.as_posix()} file not found!")
     
     
-    header = pd.read_csv(csv_file, sep = args['csv_sep'], header=None).iloc[0]
-    receivers = header.to_list()
+    receivers = declarationJobs.readHeader(csv_file, sep = args['csv_sep'])
     if 'folder' in receivers:
         receivers.remove('folder')
-        
-    df = pd.read_csv(csv_file, sep = args['csv_sep'])
     
-    sms_receiver = SMSnotificationParser.SMSNotification(  text_pattern             = args['sms_pattern']
-                                                         , tesseract_cmd            = args['tesseract']
-                                                         , timeout                  = args['sms_timeout']
-                                                         , notification_center_name = args['notification_center_name']
-                                                         , clear_button_label       = args['clear_button_label'] 
-                                                         , debug                    = args['debug'] 
-                                                         )
+    download_base_dir = pathlib.Path(args['download_dir'])
+    download_base_dir.mkdir(parents=True, exist_ok=True)
+    full_status = download_base_dir / f"bulk_declare_{process_start.strftime('%Y%m%dT%H%M')}.html"
+
+    # the whole file is checked before a browser or the SMS source is started
+    count, rejected = jobValidation.validate(csv_file, createValidator(args), sep = args['csv_sep'])
+    if rejected:
+        rejected_report = full_status.with_name(full_status.stem + '_rejected.html')
+        statusJournal.renderHtml(rejected, rejected_report)
+        lg.warning(f"{len(rejected)} of {count} declarations rejected, see {rejected_report}")
+    if args.get('validate_only', False):
+        return
+    rejected = { (record['idx'], record['receiver_index']) : record for record in rejected }
+
+    sms_receiver = createSMSSource(args)
     
     # will be used as function pointer in processing
     def getSMS():
@@ -95,84 +483,142 @@ def automate(args):
         lg.debug('returned from sms_receiver.wait_for_sms_code():', code)
         return code
     
-    status_over_all = list()
-    
-    download_base_dir = pathlib.Path(args['download_dir'])
-    download_base_dir.mkdir(parents=True, exist_ok=True)
-    
-    full_status = download_base_dir / f"bulk_declare_{process_start.strftime('%Y%m%dT%H%M')}.html"
-    pd.DataFrame().to_html(full_status)
+    journal     = statusJournal.StatusJournal(full_status.with_suffix('.jsonl'))
+    statusJournal.renderHtml([], full_status)
+
+    sessions = max(1, args.get('workers', 1))
+    if args.get('pipeline', False):
+        # one session prepares the next form while another one waits for its SMS
+        sessions = max(2, sessions)
 
+    index = declarationIndex.DeclarationIndex(download_base_dir / declarationIndex.INDEX_DEFAULTS['filename'])
+
+    # one resolved chromedriver for all sessions, optionally with a disk cache kept across runs,
+    # warmed only once the first job is queued
+    browsers = browserFactory.BrowserFactory(  headless        = args.get('headless', False)
+                                             , cache_dir       = args.get('browser_cache', None)
+                                             , block_resources = args.get('block_resources', None) )
+
+    jobs    = queue.Queue(maxsize = 2 * sessions) # read the csv only as fast as the jobs are processed
+    results = queue.Queue()
+    workers = [ threading.Thread(  target = declarationWorker
+                                 , args   = (args, jobs, results, getSMS, sms_receiver.exclusive, index, browsers)
+                                 , name   = f"declaration-worker-{n}"
+                                 , daemon = True )
+                for n in range(sessions) ]
+    completed = None
+    if args.get('resume', False):
+        completed = statusJournal.completedJobs(download_base_dir)
     
-    for idx, row in df.iterrows():   
-        download_dir = pathlib.Path('downloads')        
-        if 'folder' in row.index.to_list():
-            download_dir = download_dir / row.folder
-        download_dir.mkdir(exist_ok=True, parents=True)
-
-        processed = list()
-        receiver_list = [ e for e in list(enumerate(header)) if e[1] != 'folder' ]
-        for rec in receiver_list: 
-            receiver_index = rec[0]
-            receiver_name  = rec[1]
-            url = None
-            declaration = None
-            
-            text = row.iloc[receiver_index]
-            
-            try:
-                sms_receiver.click_clear_all_button()
-                with gsisDeclaration.gsisGrabber(
-                          username    = args['user']
-                        , password   = args['password']
-                        , taxid      = args['taxid']
-                        , email      = args['email']
-                        , receiver   = receiver_name
-                        , download_dir = download_dir.as_posix()
-                        , url        = args['url']
-                        #, retries    = args['retries']
-                        , timeout    = args['web_timeout']
-                        , getCode    = getSMS
-                        , filename   = "declaration.pdf"
-                        , text       = text
-                        ) as gsis:
-                    url, declaration = gsis.run()
-                    lg.success(f"{dt.now()}: declaration {idx}/{receiver_index} of {df.shape[0]}/{len(receiver_list)} for {receiver_name} created")
-
-                    
-            except Exception as e:
-                lg.exception(e)
-            finally:
-                sms_receiver.click_clear_all_button()
-
-            
-            currrent_status = { 'idx'   : idx 
-                               , 'receiver' : receiver_name
-                               , 'url'  : url
-                               , 'file' : declaration }
-            processed.append( currrent_status )
+    workers.append( threading.Thread(  target = produceJobs
+                                     , args   = (  args, jobs, results, sessions, completed, index, rejected
+                                                  , lambda: browsers.warm(args['url'], sessions) )
+                                     , name   = "declaration-jobs"
+                                     , daemon = True ) )
+    for worker in workers:
+        worker.start()
+
+    pending  = dict()
+    running  = sessions
+    finished = 0
+    rendered = time()
+    while running > 0:
+        result = results.get()
+        if result is None:
+            running -= 1
+            continue
+        job, currrent_status = result
+        finished += 1
+        journal.append(currrent_status)
+        idx = job['idx']
+        pending.setdefault(idx, list()).append( (job['receiver_index'], currrent_status) )
+        lg.info(f"{dt.now()}: {finished} declarations processed")
         
-        status_over_all.append( processed )
-        done = pd.DataFrame(processed)
-        singel_status = download_dir / f"{idx}_result.html"
-        done.to_html(singel_status)
-        lg.success( f"{singel_status} updated" )
-
-        all_done = pd.DataFrame(list(itertools.chain.from_iterable(status_over_all)))
-        all_done.to_html(full_status)
-        lg.success(f"{full_status} updated" )
+        if len(pending[idx]) == len(receivers):
+            processed = [ status for _, status in sorted(pending.pop(idx), key=lambda e: e[0]) ]
+            singel_status = job['download_dir'] / f"{idx}_result.html"
+            statusJournal.renderHtml(processed, singel_status)
+            lg.success( f"{singel_status} updated" )
+
+        if time() - rendered >= args.get('report_interval', statusJournal.JOURNAL_DEFAULTS['report_interval']):
+            # the journal is the status, the overall report is only refreshed from time to time
+            statusJournal.renderHtml(sorted(statusJournal.StatusJournal.read(journal.path), key=lambda r: r['idx']), full_status)
+            lg.success(f"{full_status} updated" )
+            rendered = time()
+    
+    for worker in workers:
+        worker.join()
+    journal.close()
+    index.close()
+    outputNaming.close()
+    latency = latencyHistory(args)
+    if not latency is None:
+        lg.info(f"learned step timeouts: {latency.timeouts(args['web_timeout'])}")
+    stepTimeouts.close()
+    sms_receiver.close()
+    browsers.close()
+    
+    all_done = sorted(statusJournal.StatusJournal.read(journal.path), key=lambda r: r['idx'])
+    statusJournal.renderHtml(all_done, full_status)
+    lg.success(f"{full_status} updated" )
+    
+    serialized = [] if args.get('sms_dispatcher', False) else SERIALIZED_STAGES
+    occupancy = stageOccupancy(all_done, (dt.now() - process_start).total_seconds(), sessions, serialized)
+    for stage, share in occupancy.items():
+        lg.success(f"stage {stage} occupancy {share:.1%}{' (serialized)' if stage in serialized else ''}")
+
+    summary = metrics.summarize(all_done)
+    metrics.writeJson(summary, full_status.with_suffix('.json'), occupancy=occupancy)
+    metrics.writePrometheus(summary, full_status.with_suffix('.prom'))
     return
 
 
 
+def checkArguments(parser, args):
+    """
+    Checks the combinations of command-line arguments the parser can not check.
 
+    Exits with the usage of the parser if an argument is missing or invalid.
 
-#%%
+    Args:
+        parser (argparse.ArgumentParser): The parser, see `argumentParser`.
+        args (dict): The parsed command-line arguments.
 
-if __name__ == '__main__':
+    """
+    try:
+        gsisDeclaration.parseRetries(args['retries'])
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+    if args['sms_source'] == 'file' and args['sms_file'] is None:
+        parser.error("--sms-source file requires --sms-file")
+    if args['sms_source'] == 'webhook' and args['sms_webhook_token'] is None \
+       and not smsSources.isLoopback(args['sms_webhook_host']):
+        parser.error(f"--sms-webhook-host {args['sms_webhook_host']} is reachable from the network and requires --sms-webhook-token")
+    return
+
+
+def argumentParser(prog='bulkDeclare', description=None, csv=True):
+    """
+    Returns the parser of the command-line arguments of a bulk run.
+
+    The declaration service shares the arguments, it takes its jobs from its
+    API instead of a CSV file.
+
+    Args:
+        prog (str, optional): The program name. Defaults to 'bulkDeclare'.
+        description (str, optional): The description of the program. Defaults to
+            None, the one of bulkDeclare.
+        csv (bool, optional): Whether `--csv` is required. Defaults to True.
+
+    Returns:
+        argparse.ArgumentParser: The parser.
+
+    """
+    if description is None:
+        description = DESCRIPTION
     parser = argparse.ArgumentParser(
-          prog='bulkDeclare'
-        , description="Reads data from csv and creates signed declarations through greek goverment portal. Created documents will be named declaration.pdf. If file exists, it will receive an numeric index e.g. 'declaration (4).pdf'. The used index will be the next available."
+          prog=prog
+        , description=description
         )
     parser.add_argument(  '-u', '--user', dest='user'
                         , default = None, type=str, required=True
@@ -193,33 +639,113 @@ if __name__ == '__main__':
                         , default = gsisDeclaration.GSIS_DEFAULTS['download_dir'], type=str, required=False
                         , help="Folder name to store downloaded file." 
                         )
+    parser.add_argument(  '--filename-template', dest='filename_template'
+                        , default = outputNaming.NAMING_DEFAULTS['template'], type=str, required=False
+                        , help="Name of the downloaded PDF with the fields {row} (CSV row index), {column} (receiver column index), {receiver}, {folder} and {hash} (first 8 hex digits of the SHA-256 of the text)." 
+                        )
     parser.add_argument(  '--url', dest='url'
                         , default = gsisDeclaration.GSIS_DEFAULTS['url'], type=str, required=False
                         , help="url to the Hellenic portal used to create the declaration." 
                         )
+    parser.add_argument(  '--headless', dest='headless'
+                        , default = gsisDeclaration.GSIS_DEFAULTS['headless'], action='store_true', required=False
+                        , help="Run Chrome without a window." 
+                        )
+    parser.add_argument(  '--browser-cache', dest='browser_cache'
+                        , default = browserFactory.BROWSER_DEFAULTS['cache_dir'], type=str, required=False
+                        , help="Directory keeping the browser disk cache across browsers and runs, so the static assets of the portal are not downloaded for every declaration. Empty cache slots are filled before the first declaration." 
+                        )
+    parser.add_argument(  '--block-resources', dest='block_resources'
+                        , default = None, action=argparse.BooleanOptionalAction, required=False
+                        , help="Block images, fonts, media and analytics scripts. By default they are blocked in headless mode only." 
+                        )
+    parser.add_argument(  '--http-engine', dest='http_engine'
+                        , default = gsisDeclaration.GSIS_DEFAULTS['http_engine'], action='store_true', required=False
+                        , help="After the login in the browser, submit the form steps and the SMS code directly over HTTP with the cookies of the browser. Falls back to the browser if the portal answers unexpectedly." 
+                        )
+    parser.add_argument(  '--no-fused-actions', dest='fused_actions'
+                        , default = gsisDeclaration.GSIS_DEFAULTS['fused_actions'], action='store_false', required=False
+                        , help="Locate, scroll and click elements with separate WebDriver commands instead of one injected script." 
+                        )
+    parser.add_argument(  '--retries', dest='retries'
+                        , default = [], nargs='*', required=False
+                        , help="Retries of a failed step, as STEP=N for the steps " + ', '.join(gsisDeclaration.RETRY_DEFAULTS) + " or a bare number for all of them. A retry resumes from the failed step in the logged in browser. Defaults to " + ' '.join(f"{k}={v}" for k, v in gsisDeclaration.RETRY_DEFAULTS.items()) + "."
+                        )
     parser.add_argument(  '--web_timeout', dest='web_timeout'
                         , default = gsisDeclaration.GSIS_DEFAULTS['timeout'], type=int, required=False
                         , help="Timeout in seconds to wait for a web result." 
                         )
+    parser.add_argument(  '--adaptive-timeouts', dest='adaptive_timeouts'
+                        , default = True, action=argparse.BooleanOptionalAction, required=False
+                        , help="Learn the timeout of every portal step from its latency in earlier declarations, kept in " + stepTimeouts.TIMEOUT_DEFAULTS['filename'] + " in the download directory. --web_timeout is the ceiling." 
+                        )
+    parser.add_argument(  '--timeout-multiplier', dest='timeout_multiplier'
+                        , default = stepTimeouts.TIMEOUT_DEFAULTS['multiplier'], type=float, required=False
+                        , help="Learned timeout of a step as multiple of the p99 of its latency." 
+                        )
+    parser.add_argument(  '--timeout-floor', dest='timeout_floor'
+                        , default = stepTimeouts.TIMEOUT_DEFAULTS['floor'], type=float, required=False
+                        , help="Seconds a learned timeout never falls below." 
+                        )
     parser.add_argument(  '--tesseract_cmd',  dest='tesseract'
                         ,   default = SMSnotificationParser.SMS_DEFAULTS['tesseract_cmd'], type=str, required=False
                         , help="Full path to the tesseract.exe binary." )
+    parser.add_argument(  '--ocr-engine', dest='ocr_engine'
+                        , default = SMSnotificationParser.SMS_DEFAULTS['ocr_engine'], choices=['auto', 'tesserocr', 'pytesseract'], required=False
+                        , help="OCR engine of the notification area. 'tesserocr' keeps tesseract loaded in the process, 'pytesseract' starts it for every screenshot, 'auto' uses tesserocr if it is installed." 
+                        )
     parser.add_argument(  '--sms-timeout',    dest='sms_timeout'
                         , default = SMSnotificationParser.SMS_DEFAULTS['timeout'], type=int, required=False
                         , help="Timeout in seconds regarding the SMS reception." 
                         )
     parser.add_argument(  '--sms-pattern',    dest='sms_pattern'
                         , default = SMSnotificationParser.SMS_DEFAULTS['text_pattern'], type=str, required=False
-                        , help="SMS text to search for as reguar expression to extract the code." 
+                        , help="SMS text to search for as reguar expression to extract the code, the code is its first non empty group. By default the built-in extractor is used, which corrects OCR confusions and knows the gov.gr message templates." 
+                        )
+    parser.add_argument(  '--sms-source', dest='sms_source'
+                        , default = 'ocr', choices=['ocr', 'webhook', 'file'], required=False
+                        , help="Where the SMS codes come from. 'ocr' reads the Windows notification area, 'webhook' receives the SMS text POSTed by a forwarding app, 'file' follows a text file or named pipe with one SMS per line." 
+                        )
+    parser.add_argument(  '--sms-webhook-host', dest='sms_webhook_host'
+                        , default = smsSources.SOURCE_DEFAULTS['webhook_host'], type=str, required=False
+                        , help="Interface the SMS webhook listens on, e.g. 0.0.0.0 for a forwarding app on a phone in the local network. Any interface other than loopback requires --sms-webhook-token." 
+                        )
+    parser.add_argument(  '--sms-webhook-port', dest='sms_webhook_port'
+                        , default = smsSources.SOURCE_DEFAULTS['webhook_port'], type=int, required=False
+                        , help="Port of the SMS webhook." 
+                        )
+    parser.add_argument(  '--sms-webhook-token', dest='sms_webhook_token'
+                        , default = None, type=str, required=False
+                        , help="Secret the SMS forwarder has to send as ?token= parameter or X-Token header. Required if the webhook listens on another interface than loopback." 
+                        )
+    parser.add_argument(  '--sms-dispatcher', dest='sms_dispatcher'
+                        , default = False, action='store_true', required=False
+                        , help="Read every SMS once and hand the codes to the waiting declarations in the order they requested them, so parallel sessions wait for their SMS at the same time. Codes are recorded in sms_codes.sqlite in the download folder, shared by all runs using it, and never used twice." 
+                        )
+    parser.add_argument(  '--sms-file', dest='sms_file'
+                        , default = None, type=str, required=False
+                        , help="File or named pipe to follow for --sms-source file." 
                         )
     parser.add_argument(  '--csv', dest='csv'
-                        , default = None, type=str, required=True
+                        , default = None, type=str, required=csv
                         , help="csv input file. Its columns names will be used as receiver of the declaration. If a column named 'folder' is found, the declaration will be stored in the <download-dir>/<folder>." 
                         )
     parser.add_argument(  '--csv-sep', dest='csv_sep'
                         , default = ';', type=str, required=False
                         , help="CSV separator used to read the file." 
                         )
+    parser.add_argument(  '--validation-rules', dest='validation_rules'
+                        , default = list(jobValidation.RULES), nargs='*', choices=jobValidation.RULES, required=False
+                        , help="Rules every declaration is checked against before any browser starts, rejected declarations are reported and not issued. Defaults to all rules." 
+                        )
+    parser.add_argument(  '--max-text-length', dest='max_text_length'
+                        , default = jobValidation.VALIDATION_DEFAULTS['max_text'], type=int, required=False
+                        , help="Characters the text of a declaration may have." 
+                        )
+    parser.add_argument(  '--validate-only', dest='validate_only'
+                        , default = False, action='store_true', required=False
+                        , help="Only check the CSV file and write the report of the rejected declarations." 
+                        )
     parser.add_argument(  '--notification-center-name', dest='notification_center_name'
                         , default = SMSnotificationParser.SMS_DEFAULTS['notification_center_name'], type=str, required=False
                         , help="Language settings dependent name of the notification object"
@@ -232,18 +758,53 @@ if __name__ == '__main__':
                         ,  default = False, type=bool, required=False
                         , help="Togle debug mode. If activated, folder debug will dontain screenshots of notification area."
                         )
+    parser.add_argument(  '--pipeline', dest='pipeline'
+                        ,  default = False, action='store_true', required=False
+                        , help="Prepare the next declaration (login, form, text and recipient) while the current one waits for its SMS code. Uses at least two browser sessions, only the SMS stage is serialized."
+                        )
+    parser.add_argument(  '--reuse-session', dest='reuse_session'
+                        ,  default = False, action='store_true', required=False
+                        , help="Keep one logged in browser session for all declarations. A new login is only done if the portal session expired or a step failed."
+                        )
+    parser.add_argument(  '--workers', dest='workers'
+                        ,  default = 1, type=int, required=False
+                        , help="Number of parallel browser sessions. The SMS step is serialized between the sessions, so codes can not be mixed up."
+                        )
+    parser.add_argument(  '--resume', dest='resume'
+                        ,  default = False, action='store_true', required=False
+                        , help="Skip all declarations whose PDF has been downloaded by an earlier run, according to the journals in the download folder. A job is identified by its row index, receiver and text."
+                        )
+    parser.add_argument(  '--force-reissue', dest='force_reissue'
+                        ,  default = False, action='store_true', required=False
+                        , help="Issue declarations even if the same receiver and text have already been declared with this taxid by an earlier run."
+                        )
+    parser.add_argument(  '--report-interval', dest='report_interval'
+                        ,  default = statusJournal.JOURNAL_DEFAULTS['report_interval'], type=int, required=False
+                        , help="Seconds between refreshes of the overall HTML status report. All results are journaled immediately into the .jsonl file next to it."
+                        )
+    parser.add_argument(  '--trace-sample', dest='trace_sample'
+                        ,  default = logger.TRACE_DEFAULTS['sample'], type=float, required=False
+                        , help="Share of the function calls traced at log level TRACE, between 0.0 and 1.0."
+                        )
+    parser.add_argument(  '--trace-redact', dest='trace_redact'
+                        ,  default = [], nargs='*', required=False
+                        , help=f"Further terms of argument names whose values are never logged, in addition to {', '.join(logger.TRACE_DEFAULTS['redact'])}."
+                        )
     parser.add_argument(  '--log-level', dest='log_level'
                         ,  default = 'SUCCESS', choices=['TRACE', 'DEBUG', 'INFO', 'SUCCESS', 'WARNING', 'ERROR', 'CRITICAL'], required=False
                         , help="level of logging to be used."
                         )
-    
+    return parser
 
 
-                 
-    
+#%%
+
+if __name__ == '__main__':
+    parser = argumentParser()
     args = vars(parser.parse_args())
+    checkArguments(parser, args)
     logger.initLogging(args)
-    lg.debug(f"process started with arguments: {args}")
+    lg.debug(f"process started with arguments: {logger.redacted(args)}")
     
     automate(args)
     
@@ -0,0 +1,195 @@
+# -*- coding: utf-8 -*-
+"""
+This module extracts SMS confirmation codes from OCR or SMS text.
+
+The text is split into tokens once. Tokens that read as a six digit code after
+correcting the usual OCR confusions (e.g. `O` for `0`, `l` for `1`) are
+candidates, tokens that contain a keyword of a gov.gr SMS (e.g. `GOVGR`,
+`ΚΩΔΙΚΟΣ`, `ΕΚΔΟΣΗ`) are anchors. The candidate closest to an anchor wins, so
+several message templates are handled without a regular expression per template
+and the run time is linear in the length of the text. Codes that have already
+been used are skipped.
+
+The regression corpus of OCR transcripts is `corpus/sms_ocr.jsonl`, see
+`python benchmark.py extractor`.
+
+"""
+
+
+import re
+import unicodedata
+import argparse
+import collections
+import logger
+
+#%% defaults
+
+EXTRACTOR_DEFAULTS = {
+          'anchors'        : ['GOVGR', 'ΚΩΔΙΚ', 'ΕΚΔΟΣ', 'ΕΠΙΒΕΒΑΙΩΣ']
+        , 'window'         : 8
+        , 'min_digits'     : 4
+        , 'require_anchor' : True
+        , 'remember'       : 1000
+    }
+
+#%% constants
+
+CODE_LENGTH = 6
+TOKEN_PATTERN = re.compile(r"[^\s;:]+")
+STRIP_CHARS = ".,()[]{}\"'«»<>-_*"
+
+# characters OCR returns for digits, Greek capitals included as tesseract runs with `ell`
+DIGIT_CONFUSIONS = str.maketrans({  'O' : '0', 'o' : '0', 'D' : '0', 'Q' : '0', 'Ο' : '0', 'ο' : '0', 'Θ' : '0'
+                                  , 'I' : '1', 'l' : '1', 'i' : '1', '|' : '1', '!' : '1', 'Ι' : '1', 'ι' : '1'
+                                  , 'Z' : '2', 'z' : '2', 'Ζ' : '2'
+                                  , 'S' : '5', 's' : '5'
+                                  , 'G' : '6', 'b' : '6', 'Β' : '8', 'B' : '8'
+                                  , 'T' : '7', 'Τ' : '7'
+                                  , 'g' : '9', 'q' : '9' })
+
+# Latin and Greek capitals that look the same are mapped onto one letter for the keyword comparison
+LOOKALIKES = str.maketrans({  'Α' : 'A', 'Β' : 'B', 'Ε' : 'E', 'Ζ' : 'Z', 'Η' : 'H', 'Ι' : 'I', 'Κ' : 'K'
+                            , 'Μ' : 'M', 'Ν' : 'N', 'Ο' : 'O', 'Ρ' : 'P', 'Τ' : 'T', 'Υ' : 'Y', 'Χ' : 'X' })
+
+#%% logic
+
+def skeleton(token):
+    """
+    Returns the form of a token used to compare it with the keywords.
+
+    Accents and all characters but letters and digits are removed, the token is
+    upper cased and look-alike Greek and Latin letters are unified.
+
+    Args:
+        token (str): The token.
+
+    Returns:
+        str: The skeleton of the token.
+
+    """
+    decomposed = unicodedata.normalize('NFD', token)
+    return ''.join( c for c in decomposed if c.isalnum() ).upper().translate(LOOKALIKES)
+
+
+class CodeExtractor:
+    """
+    Finds the confirmation code in OCR or SMS text.
+
+    """
+
+    @logger.logging
+    def __init__(  self, anchors=EXTRACTOR_DEFAULTS['anchors'], window=EXTRACTOR_DEFAULTS['window']
+                 , min_digits=EXTRACTOR_DEFAULTS['min_digits'], require_anchor=EXTRACTOR_DEFAULTS['require_anchor']
+                 , remember=EXTRACTOR_DEFAULTS['remember']):
+        """
+        Initializes the CodeExtractor instance.
+
+        Args:
+            anchors (list, optional): Keyword stems of the SMS templates, a token
+                starting with one of them is an anchor.
+            window (int, optional): Maximal distance in tokens between a code and its
+                anchor. Defaults to 8.
+            min_digits (int, optional): Minimal number of real digits of a code, the
+                others may be corrected OCR confusions. Defaults to 4.
+            require_anchor (bool, optional): Only return codes next to an anchor. Set to
+                False for a pure SMS text, where any code is the code. Defaults to True.
+            remember (int, optional): Number of used codes to remember. Defaults to 1000.
+
+        """
+        self.anchors        = tuple( skeleton(a) for a in anchors )
+        self.window         = window
+        self.min_digits     = min_digits
+        self.require_anchor = require_anchor
+        self.used           = collections.OrderedDict()
+        self.remember       = remember
+        return
+
+    @logger.logging
+    def markUsed(self, code):
+        """
+        Remembers a code as used, it will not be returned again.
+
+        Args:
+            code (str): The used code.
+
+        """
+        self.used[code] = True
+        self.used.move_to_end(code)
+        while len(self.used) > self.remember:
+            self.used.popitem(last=False)
+        return
+
+    def _candidate(self, token):
+        """Returns the code a token reads as, or None."""
+        token = token.strip(STRIP_CHARS)
+        if len(token) != CODE_LENGTH:
+            return None
+        if sum( c.isdigit() for c in token ) < self.min_digits:
+            return None
+        code = token.translate(DIGIT_CONFUSIONS)
+        if not (code.isascii() and code.isdigit()):
+            return None
+        return code
+
+    def _isAnchor(self, token):
+        """Tells whether a token contains a keyword of the SMS."""
+        return skeleton(token).startswith(self.anchors)
+
+    @logger.logging
+    def extract(self, text):
+        """
+        Extracts the confirmation code of a text.
+
+        Args:
+            text (str): The OCR or SMS text. Lines may be separated by newlines or `;`.
+
+        Returns:
+            str: The six digit code closest to an anchor that has not been used yet,
+                 or None if there is none.
+
+        """
+        if not isinstance(text, str):
+            return None
+        candidates = list()
+        anchors    = list()
+        for n, match in enumerate(TOKEN_PATTERN.finditer(text)):
+            token = match.group(0)
+            code  = self._candidate(token)
+            if not code is None:
+                if not code in self.used:
+                    candidates.append( (n, code) )
+            elif self._isAnchor(token):
+                anchors.append(n)
+        if not candidates:
+            return None
+        if not anchors:
+            return None if self.require_anchor else candidates[0][1]
+
+        # distance of each candidate to its closest anchor, one pass over both sorted lists
+        best = None
+        a    = 0
+        for n, code in candidates:
+            while a + 1 < len(anchors) and anchors[a + 1] <= n:
+                a += 1
+            distance = min( abs(n - anchors[i]) for i in (a, a + 1) if i < len(anchors) )
+            if distance <= self.window and (best is None or distance < best[0]):
+                best = (distance, code)
+        if best is None:
+            return None if self.require_anchor else candidates[0][1]
+        return best[1]
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='codeExtractor'
+        , description="extracts the confirmation code of an OCR or SMS text"
+        )
+    parser.add_argument('text', help="the text to extract the code from.")
+    parser.add_argument('--no-anchor', dest='require_anchor', default=True, action='store_false'
+                        , help="accept codes without a keyword next to them.")
+    args = vars(parser.parse_args())
+
+    print("code:", CodeExtractor(require_anchor=args['require_anchor']).extract(args['text']))
@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps a persistent index of all issued declarations.
+
+A declaration is identified by the hash of the tax id of the declarant, its
+receiver and its normalized text. The index maps this hash to the downloaded
+PDF and its portal url, so a declaration that has been issued by any earlier
+run is not issued again. The index is a SQLite table with the hash as primary
+key, a lookup stays fast for hundreds of thousands of entries.
+
+"""
+
+
+import sqlite3
+import hashlib
+import unicodedata
+import pathlib
+import argparse
+import threading
+from datetime import datetime as dt
+import logger
+
+#%% defaults
+
+INDEX_DEFAULTS = {
+          'filename' : 'declarations.sqlite'
+    }
+
+#%% logic
+
+def normalize(text):
+    """
+    Normalizes a text for the comparison of declarations.
+
+    The unicode representation is unified (NFC) and all whitespace sequences are
+    collapsed to a single blank, leading and trailing whitespace is removed.
+
+    Args:
+        text (str): The text to normalize.
+
+    Returns:
+        str: The normalized text.
+
+    """
+    return ' '.join(unicodedata.normalize('NFC', str(text)).split())
+
+
+def declarationHash(receiver, text, taxid):
+    """
+    Returns the content hash of a declaration.
+
+    Args:
+        receiver (str): The receiver of the declaration.
+        text (str): The text of the declaration.
+        taxid (str): The tax id of the declarant.
+
+    Returns:
+        str: The hex encoded SHA-256 hash.
+
+    """
+    content = '\x1f'.join( (normalize(taxid), normalize(receiver), normalize(text)) )
+    return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+
+class DeclarationIndex:
+    """
+    A persistent, thread safe index of issued declarations.
+
+    """
+
+    @logger.logging
+    def __init__(self, path):
+        """
+        Opens the index, the database is created if it does not exist.
+
+        Args:
+            path (str): Path to the SQLite database.
+
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS declarations
+                                   ( hash     TEXT PRIMARY KEY
+                                   , receiver TEXT
+                                   , url      TEXT
+                                   , file     TEXT
+                                   , created  TEXT )""")
+        self.connection.commit()
+        return
+
+    @logger.logging
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    @logger.logging
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the runtime context related to this object."""
+        self.close()
+
+    @logger.logging
+    def close(self):
+        """Closes the database connection."""
+        with self.lock:
+            self.connection.close()
+        return
+
+    @logger.logging
+    def lookup(self, receiver, text, taxid):
+        """
+        Looks up an already issued declaration.
+
+        Entries whose PDF does not exist anymore are ignored.
+
+        Args:
+            receiver (str): The receiver of the declaration.
+            text (str): The text of the declaration.
+            taxid (str): The tax id of the declarant.
+
+        Returns:
+            dict: The `url` and `file` of the declaration, or None if it has not
+                  been issued yet.
+
+        """
+        with self.lock:
+            row = self.connection.execute(  "SELECT url, file FROM declarations WHERE hash = ?"
+                                          , (declarationHash(receiver, text, taxid),) ).fetchone()
+        if row is None or row[1] is None or not pathlib.Path(row[1]).exists():
+            return None
+        return { 'url' : row[0], 'file' : row[1] }
+
+    @logger.logging
+    def add(self, receiver, text, taxid, url, file):
+        """
+        Adds an issued declaration, an existing entry is replaced.
+
+        Args:
+            receiver (str): The receiver of the declaration.
+            text (str): The text of the declaration.
+            taxid (str): The tax id of the declarant.
+            url (str): The portal url of the PDF.
+            file (str): The path of the downloaded PDF, stored absolute.
+
+        """
+        with self.lock:
+            self.connection.execute(  "INSERT OR REPLACE INTO declarations VALUES (?, ?, ?, ?, ?)"
+                                    , ( declarationHash(receiver, text, taxid), receiver, url
+                                      , None if file is None else str(pathlib.Path(file).absolute()), dt.now().isoformat() ) )
+            self.connection.commit()
+        return
+
+    @logger.logging
+    def __len__(self):
+        """Returns the number of indexed declarations."""
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM declarations").fetchone()[0]
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='declarationIndex'
+        , description="looks up a declaration in the index of issued declarations"
+        )
+    parser.add_argument('--index', dest='index', default=None, required=True)
+    parser.add_argument('--taxid', dest='taxid', default=None, required=True)
+    parser.add_argument('--receiver', dest='receiver', default=None, required=True)
+    parser.add_argument('--text', dest='text', default=None, required=True)
+    args = vars(parser.parse_args())
+
+    with DeclarationIndex(args['index']) as index:
+        print(index.lookup(args['receiver'], args['text'], args['taxid']))
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+This module turns the CSV input of bulkDeclare into declaration jobs.
+
+The file is parsed once and lazily with the csv module of the standard library,
+so the first declaration can start before a large file is fully read and only
+the current row is kept in memory. Each job describes a single declaration,
+one cell of the CSV.
+
+"""
+
+
+import csv
+import hashlib
+import pathlib
+import argparse
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+JOB_DEFAULTS = {
+          'csv_sep'       : ';'
+        , 'encoding'      : 'utf-8-sig'
+        , 'folder_column' : 'folder'
+    }
+
+#%% logic
+
+def jobKey(idx, receiver, text):
+    """
+    Returns the stable identity of a declaration job.
+
+    The key stays the same as long as the row index, the receiver and the text
+    of the job are unchanged, so it can be used to recognize the job in a later
+    run on the same CSV file.
+
+    Args:
+        idx (int): The row index of the job.
+        receiver (str): The receiver of the declaration.
+        text (str): The text of the declaration.
+
+    Returns:
+        str: The key of the job.
+
+    """
+    text_hash = hashlib.sha256(text.encode('utf-8')).hexdigest()[:16]
+    return f"{idx}:{receiver}:{text_hash}"
+
+
+@logger.logging
+def readHeader(csv_file, sep=JOB_DEFAULTS['csv_sep'], encoding=JOB_DEFAULTS['encoding']):
+    """
+    Reads the header row of the CSV file.
+
+    Args:
+        csv_file (str): Path to the CSV file.
+        sep (str, optional): The CSV separator. Defaults to ';'.
+        encoding (str, optional): The encoding of the file. Defaults to 'utf-8-sig'.
+
+    Returns:
+        list: The column names, an empty list for an empty file.
+
+    """
+    with open(csv_file, newline='', encoding=encoding) as f:
+        for header in csv.reader(f, delimiter=sep):
+            if header:
+                return header
+    return list()
+
+
+def readJobs(csv_file, sep=JOB_DEFAULTS['csv_sep'], encoding=JOB_DEFAULTS['encoding']):
+    """
+    Yields one job per receiver and row of the CSV file.
+
+    The header row holds the receivers, an optional column named `folder` the
+    sub folder to store the declarations of the row in. Rows without any value
+    are skipped and do not count as row, missing cells of short rows are yielded
+    as empty text.
+
+    Args:
+        csv_file (str): Path to the CSV file.
+        sep (str, optional): The CSV separator. Defaults to ';'.
+        encoding (str, optional): The encoding of the file. Defaults to 'utf-8-sig'.
+
+    Yields:
+        dict: The job with the keys `idx` (row index starting with 0 for the first
+              data row), `receiver_index` (column index), `receiver`, `text`,
+              `folder` (None if there is no folder column) and `key` (see `jobKey`).
+
+    """
+    with open(csv_file, newline='', encoding=encoding) as f:
+        reader = csv.reader(f, delimiter=sep)
+        header = None
+        for row in reader:
+            if row:
+                header = row
+                break
+        if header is None:
+            lg.warning(f"{csv_file} is empty")
+            return
+
+        folder_index  = header.index(JOB_DEFAULTS['folder_column']) if JOB_DEFAULTS['folder_column'] in header else None
+        receiver_list = [ e for e in enumerate(header) if e[0] != folder_index ]
+
+        idx = 0
+        for row in reader:
+            if not any(cell.strip() for cell in row):
+                continue
+            folder = None
+            if not folder_index is None:
+                folder = row[folder_index] if folder_index < len(row) else ''
+            for receiver_index, receiver in receiver_list:
+                text = row[receiver_index] if receiver_index < len(row) else ''
+                yield { 'idx'            : idx
+                      , 'receiver_index' : receiver_index
+                      , 'receiver'       : receiver
+                      , 'text'           : text
+                      , 'folder'         : folder
+                      , 'key'            : jobKey(idx, receiver, text) }
+            idx += 1
+    return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='declarationJobs'
+        , description="lists the declaration jobs found in a bulkDeclare csv file"
+        )
+    parser.add_argument('--csv', dest='csv', default=None, required=True)
+    parser.add_argument('--csv-sep', dest='csv_sep', default=JOB_DEFAULTS['csv_sep'], required=False)
+    args = vars(parser.parse_args())
+
+    for job in readJobs(pathlib.Path(args['csv']), sep=args['csv_sep']):
+        print(job)
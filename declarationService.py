@@ -0,0 +1,526 @@
+# -*- coding: utf-8 -*-
+"""
+This module runs the declaration automation as a long-running service.
+
+A bulk run of bulkDeclare starts its browsers, its SMS source and the imports
+of all its modules for every CSV file. The service starts them once and keeps
+them alive: its workers hold logged in browser sessions and take the jobs
+from a durable queue, a SQLite table in the download folder. Jobs are
+submitted over a local HTTP API, on a TCP port or a Unix socket:
+
+    POST /jobs          {"receiver": ..., "text": ..., "folder": ...} or a list of them,
+                        answers 201 with the `id` (or `ids`) of the queued jobs, or 400
+                        with the reasons if a job breaks the validation rules
+    GET  /jobs/<id>     the job with its `state` (queued, running, done, failed),
+                        the portal `url` and the `file` of the PDF
+    GET  /jobs?state=   the jobs of a state, at most `limit` (default 100)
+    GET  /stats         the number of jobs per state and the learned step timeouts
+
+Jobs still running when the service stopped are queued again at the next
+start. Every result is journaled to `service.jsonl`, which `metrics.py`
+summarizes like the journal of a bulk run. The command-line arguments are
+those of bulkDeclare, without `--csv`.
+
+`python benchmark.py service` measures the throughput under sustained
+submission against the mock portal.
+
+"""
+
+
+import json
+import time
+import sqlite3
+import pathlib
+import threading
+import socketserver
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from datetime import datetime as dt
+from loguru import logger as lg
+import logger
+import bulkDeclare
+import browserFactory
+import declarationIndex
+import declarationJobs
+import outputNaming
+import statusJournal
+import stepTimeouts
+import smsSources
+
+#%% defaults
+
+SERVICE_DEFAULTS = {
+          'host'     : '127.0.0.1'
+        , 'port'     : 8790
+        , 'queue'    : 'service.sqlite'
+        , 'journal'  : 'service.jsonl'
+        , 'limit'    : 100
+        , 'poll'     : 1.0 # seconds a idle worker waits before checking for a stop
+    }
+
+#%% constants
+
+STATES = ('queued', 'running', 'done', 'failed')
+
+#%% logic
+
+class JobQueue:
+    """
+    A durable, thread safe FIFO queue of declaration jobs.
+
+    The jobs are rows of a SQLite table and keep their result after they are
+    processed. The queue is meant to be used by a single process.
+
+    """
+
+    @logger.logging
+    def __init__(self, path):
+        """
+        Opens the queue, the database is created if it does not exist. Jobs left
+        running by an earlier process are queued again.
+
+        Args:
+            path (str): Path to the SQLite database.
+
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock      = threading.Lock()
+        self.available = threading.Condition(self.lock)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs
+                                   ( id        INTEGER PRIMARY KEY AUTOINCREMENT
+                                   , receiver  TEXT
+                                   , text      TEXT
+                                   , folder    TEXT
+                                   , state     TEXT
+                                   , url       TEXT
+                                   , file      TEXT
+                                   , status    TEXT
+                                   , submitted TEXT
+                                   , started   TEXT
+                                   , finished  TEXT )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, id)")
+        recovered = self.connection.execute("UPDATE jobs SET state = 'queued', started = NULL WHERE state = 'running'").rowcount
+        self.connection.commit()
+        if recovered:
+            lg.warning(f"{recovered} interrupted jobs queued again")
+        return
+
+    @logger.logging
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    @logger.logging
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the runtime context related to this object."""
+        self.close()
+
+    @logger.logging
+    def close(self):
+        """Closes the database connection and wakes up all waiting workers."""
+        with self.available:
+            self.connection.close()
+            self.connection = None
+            self.available.notify_all()
+        return
+
+    @staticmethod
+    def _job(row):
+        """Returns a job row as dict with its decoded status."""
+        job = dict(row)
+        if not job.get('status') is None:
+            job['status'] = json.loads(job['status'])
+        return job
+
+    @logger.logging
+    def submit(self, jobs):
+        """
+        Queues jobs.
+
+        Args:
+            jobs (list): The jobs, dicts with `receiver`, `text` and optionally `folder`.
+
+        Returns:
+            list: The ids of the queued jobs.
+
+        """
+        now = dt.now().isoformat()
+        with self.available:
+            ids = [ self.connection.execute(  "INSERT INTO jobs (receiver, text, folder, state, submitted) VALUES (?, ?, ?, 'queued', ?)"
+                                            , (job['receiver'], job['text'], job.get('folder'), now) ).lastrowid
+                    for job in jobs ]
+            self.connection.commit()
+            self.available.notify(len(ids))
+        return ids
+
+    @logger.logging
+    def take(self, timeout=None):
+        """
+        Takes the oldest queued job and marks it running.
+
+        Args:
+            timeout (float, optional): Seconds to wait for a job. Defaults to None,
+                waiting until a job is submitted or the queue is closed.
+
+        Returns:
+            dict: The job, None if there was none within the timeout.
+
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self.available:
+            while not self.connection is None:
+                row = self.connection.execute("SELECT * FROM jobs WHERE state = 'queued' ORDER BY id LIMIT 1").fetchone()
+                if not row is None:
+                    self.connection.execute("UPDATE jobs SET state = 'running', started = ? WHERE id = ?", (dt.now().isoformat(), row['id']))
+                    self.connection.commit()
+                    return { **self._job(row), 'state' : 'running' }
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if not remaining is None and remaining <= 0:
+                    break
+                self.available.wait(remaining)
+        return None
+
+    @logger.logging
+    def finish(self, id, status):
+        """
+        Stores the result of a job.
+
+        Args:
+            id (int): The id of the job.
+            status (dict): The status of the job, see `bulkDeclare.processJob`. The
+                job is done if it holds a `file`, otherwise it failed.
+
+        """
+        with self.lock:
+            self.connection.execute(  "UPDATE jobs SET state = ?, url = ?, file = ?, status = ?, finished = ? WHERE id = ?"
+                                    , ( 'done' if status.get('file') else 'failed', status.get('url')
+                                      , None if status.get('file') is None else str(status['file'])
+                                      , json.dumps(status, default=str, ensure_ascii=False), dt.now().isoformat(), id ) )
+            self.connection.commit()
+        return
+
+    @logger.logging
+    def get(self, id):
+        """Returns the job of an id, None if there is none."""
+        with self.lock:
+            row = self.connection.execute("SELECT * FROM jobs WHERE id = ?", (id,)).fetchone()
+        return None if row is None else self._job(row)
+
+    @logger.logging
+    def jobs(self, state=None, limit=SERVICE_DEFAULTS['limit']):
+        """Returns the oldest `limit` jobs, of one state if `state` is given."""
+        with self.lock:
+            if state is None:
+                rows = self.connection.execute("SELECT * FROM jobs ORDER BY id LIMIT ?", (limit,)).fetchall()
+            else:
+                rows = self.connection.execute("SELECT * FROM jobs WHERE state = ? ORDER BY id LIMIT ?", (state, limit)).fetchall()
+        return [ self._job(row) for row in rows ]
+
+    @logger.logging
+    def counts(self):
+        """Returns the number of jobs per state."""
+        with self.lock:
+            rows = self.connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall()
+        return { **{ state : 0 for state in STATES }, **{ row[0] : row[1] for row in rows } }
+
+
+class _ServiceHandler(BaseHTTPRequestHandler):
+    """Serves the job API of the `DeclarationService` of the server."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def _send(self, code, payload=None):
+        body = b'' if payload is None else json.dumps(payload, default=str, ensure_ascii=False).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        token = self.server.service.token
+        if token is None or parse_qs(urlparse(self.path).query).get('token', [None])[0] == token \
+           or self.headers.get('X-Token') == token:
+            return True
+        self._send(403, { 'error' : "invalid token" })
+        return False
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            if length < 0:
+                raise ValueError(f"invalid Content-Length {length}")
+        except ValueError as e:
+            self.close_connection = True # the body cannot be skipped
+            self._send(400, { 'error' : str(e) })
+            return
+        body = self.rfile.read(length)
+        if not self._authorized():
+            return
+        if urlparse(self.path).path.rstrip('/') != '/jobs':
+            self._send(404, { 'error' : "not found" })
+            return
+        try:
+            payload = json.loads(body.decode('utf-8'))
+            jobs    = payload if isinstance(payload, list) else [ payload ]
+            if not jobs or not all( isinstance(j, dict) and isinstance(j.get('receiver'), str) and isinstance(j.get('text'), str)
+                                    and isinstance(j.get('folder', ''), (str, type(None))) for j in jobs ):
+                raise ValueError("every job needs a receiver and a text")
+        except (ValueError, UnicodeDecodeError) as e:
+            self._send(400, { 'error' : str(e) })
+            return
+        validator = self.server.service.validator
+        rejected  = [ { 'job' : n, 'reason' : '; '.join( reason for _, reason in problems ) }
+                      for n, problems in enumerate( validator.check(job) for job in jobs ) if problems ]
+        if rejected:
+            self._send(400, { 'error' : "jobs rejected by the validation, none queued", 'rejected' : rejected })
+            return
+        ids = self.server.service.queue.submit(jobs)
+        self._send(201, { 'ids' : ids } if isinstance(payload, list) else { 'id' : ids[0] })
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        url   = urlparse(self.path)
+        path  = url.path.rstrip('/')
+        query = parse_qs(url.query)
+        queue = self.server.service.queue
+        if path == '/stats':
+            service = self.server.service
+            latency = bulkDeclare.latencyHistory(service.args)
+            self._send(200, { **queue.counts(), 'workers' : len(service.workers)
+                            , 'timeouts' : dict() if latency is None else latency.timeouts(service.args['web_timeout']) })
+        elif path == '/jobs':
+            try:
+                state = query.get('state', [None])[0]
+                if not state is None and not state in STATES:
+                    raise ValueError(f"state must be one of {', '.join(STATES)}")
+                limit = int(query.get('limit', [SERVICE_DEFAULTS['limit']])[0])
+                if limit < 1:
+                    raise ValueError("limit must be a positive number")
+            except ValueError as e:
+                self._send(400, { 'error' : str(e) })
+                return
+            self._send(200, queue.jobs(state, limit))
+        elif path.startswith('/jobs/') and path[len('/jobs/'):].isdigit():
+            job = queue.get(int(path[len('/jobs/'):]))
+            if job is None:
+                self._send(404, { 'error' : "unknown job" })
+            else:
+                self._send(200, job)
+        else:
+            self._send(404, { 'error' : "not found" })
+
+    def log_message(self, format, *args):
+        lg.debug("service: " + format % args)
+
+
+if hasattr(socketserver, 'ThreadingUnixStreamServer'):
+    class _UnixHTTPServer(socketserver.ThreadingUnixStreamServer):
+        """Serves the job API on a Unix socket."""
+        daemon_threads = True
+else:
+    _UnixHTTPServer = None
+
+
+class DeclarationService:
+    """
+    Keeps browser sessions and the SMS source alive and processes the jobs
+    submitted to its API.
+
+    """
+
+    @logger.logging
+    def __init__(  self, args, host=SERVICE_DEFAULTS['host'], port=SERVICE_DEFAULTS['port']
+                 , socket=None, token=None):
+        """
+        Initializes the DeclarationService instance, starts the workers and the API.
+
+        Args:
+            args (dict): The command-line arguments of bulkDeclare. Sessions are
+                always reused, `args['workers']` sessions are started.
+            host (str, optional): The interface the API listens on. Defaults to '127.0.0.1'.
+            port (int, optional): The port the API listens on, 0 for a free one.
+                Defaults to 8790.
+            socket (str, optional): Path of a Unix socket to serve the API on instead
+                of the port. Defaults to None.
+            token (str, optional): Secret clients have to send as `?token=` parameter
+                or `X-Token` header. Defaults to None, only allowed on a loopback
+                interface or a Unix socket.
+
+        Raises:
+            ValueError: If the API listens on another interface than loopback
+                without a token.
+            Exception: If a Unix socket is requested on a platform without them.
+
+        """
+        # the API issues declarations in the name of the user, the network must not reach it unguarded
+        if socket is None and token is None and not smsSources.isLoopback(host):
+            raise ValueError(f"the service API on {host} is reachable from the network and needs a token")
+        self.args     = dict(args, reuse_session=True)
+        self.token    = token
+        self.stopped  = threading.Event()
+        download_dir  = pathlib.Path(self.args['download_dir']).absolute()
+        download_dir.mkdir(parents=True, exist_ok=True)
+        self.download_dir = download_dir
+        self.validator    = bulkDeclare.createValidator(self.args)
+
+        self.queue    = JobQueue(download_dir / SERVICE_DEFAULTS['queue'])
+        self.journal  = statusJournal.StatusJournal(download_dir / SERVICE_DEFAULTS['journal'])
+        self.index    = declarationIndex.DeclarationIndex(download_dir / declarationIndex.INDEX_DEFAULTS['filename'])
+        self.sms      = bulkDeclare.createSMSSource(self.args)
+        self.browsers = browserFactory.BrowserFactory(  headless        = self.args.get('headless', False)
+                                                      , cache_dir       = self.args.get('browser_cache', None)
+                                                      , block_resources = self.args.get('block_resources', None) )
+        sessions = max(1, self.args.get('workers', 1))
+        self.browsers.warm(self.args['url'], sessions)
+        self.workers = [ threading.Thread(target=self._work, name=f"service-worker-{n}", daemon=True) for n in range(sessions) ]
+        for worker in self.workers:
+            worker.start()
+
+        if socket is None:
+            self.server = ThreadingHTTPServer((host, port), _ServiceHandler)
+            self.address = f"http://{host}:{self.server.server_address[1]}/"
+        else:
+            if _UnixHTTPServer is None:
+                raise Exception("Unix sockets are not supported on this platform, use a port")
+            pathlib.Path(socket).unlink(missing_ok=True)
+            self.server = _UnixHTTPServer(socket, _ServiceHandler)
+            self.address = f"unix:{socket}"
+        self.server.service = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="service-api", daemon=True)
+        self.thread.start()
+        lg.success(f"declaration service with {sessions} sessions listening on {self.address}")
+        return
+
+    @logger.logging
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    @logger.logging
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the runtime context related to this object."""
+        self.close()
+
+    def job(self, queued):
+        """
+        Turns a job of the queue into a job of `bulkDeclare.processJob`.
+
+        The id of the job is its row index, the folder is made safe as
+        directory name below the download folder.
+
+        """
+        download_dir = self.download_dir
+        if queued.get('folder'):
+            download_dir = download_dir / outputNaming.safeName(queued['folder'])
+        download_dir.mkdir(exist_ok=True, parents=True)
+        return { 'idx'            : queued['id']
+               , 'receiver_index' : 0
+               , 'receiver'       : queued['receiver']
+               , 'text'           : queued['text']
+               , 'folder'         : queued.get('folder')
+               , 'key'            : declarationJobs.jobKey(queued['id'], queued['receiver'], queued['text'])
+               , 'download_dir'   : download_dir }
+
+    def _work(self):
+        """
+        Processes queued jobs in one browser session until the service stops.
+
+        A job whose processing fails, e.g. on a locked index, is finished as
+        failed with the error and the worker goes on with the next job.
+
+        """
+        gsis = None
+        try:
+            while not self.stopped.is_set():
+                queued = self.queue.take(timeout=SERVICE_DEFAULTS['poll'])
+                if queued is None:
+                    continue
+                try:
+                    job = self.job(queued)
+                    issued = None
+                    if not self.args.get('force_reissue', False):
+                        issued = self.index.lookup(job['receiver'], job['text'], self.args['taxid'])
+                    if not issued is None:
+                        lg.info(f"job {job['idx']} for {job['receiver']} already issued as {issued['file']}, skipped")
+                        status = { 'idx' : job['idx'], 'receiver' : job['receiver'], 'url' : issued['url']
+                                 , 'file' : issued['file'], 'key' : job['key'], 'duplicate' : True }
+                    else:
+                        status, gsis = bulkDeclare.processJob(  self.args, job, gsis, self.sms.wait_for_sms_code
+                                                              , self.sms.exclusive, self.index, self.browsers )
+                    self.journal.append(status)
+                    self.queue.finish(job['idx'], status)
+                except Exception as e:
+                    lg.exception(e)
+                    try:
+                        self.queue.finish(  queued['id'], { 'idx' : queued['id'], 'receiver' : queued['receiver']
+                                                          , 'url' : None, 'file' : None, 'error' : str(e) } )
+                    except Exception as e:
+                        lg.exception(e)
+        finally:
+            if not gsis is None:
+                gsis.cleanup()
+        return
+
+    @logger.logging
+    def close(self):
+        """Stops the API, lets the workers finish their current job and releases everything."""
+        self.server.shutdown()
+        self.server.server_close()
+        self.stopped.set()
+        for worker in self.workers:
+            worker.join()
+        self.queue.close()
+        self.journal.close()
+        self.index.close()
+        outputNaming.close()
+        stepTimeouts.close()
+        self.sms.close()
+        self.browsers.close()
+        return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = bulkDeclare.argumentParser(  prog='declarationService', csv=False
+                                        , description="Runs the declaration automation as a service. Jobs are submitted to a local HTTP API and kept in a durable queue in the download folder.")
+    parser.add_argument(  '--service-host', dest='service_host'
+                        , default = SERVICE_DEFAULTS['host'], type=str, required=False
+                        , help="Interface the API listens on. Any interface other than loopback requires --service-token."
+                        )
+    parser.add_argument(  '--service-port', dest='service_port'
+                        , default = SERVICE_DEFAULTS['port'], type=int, required=False
+                        , help="Port the API listens on."
+                        )
+    parser.add_argument(  '--service-socket', dest='service_socket'
+                        , default = None, type=str, required=False
+                        , help="Unix socket to serve the API on instead of the port."
+                        )
+    parser.add_argument(  '--service-token', dest='service_token'
+                        , default = None, type=str, required=False
+                        , help="Secret clients have to send as ?token= parameter or X-Token header."
+                        )
+    args = vars(parser.parse_args())
+    bulkDeclare.checkArguments(parser, args)
+    if args['service_socket'] is None and args['service_token'] is None and not smsSources.isLoopback(args['service_host']):
+        parser.error(f"--service-host {args['service_host']} is reachable from the network and requires --service-token")
+    logger.initLogging(args)
+    lg.debug(f"service started with arguments: {logger.redacted(args)}")
+
+    service = DeclarationService(  args, host=args['service_host'], port=args['service_port']
+                                 , socket=args['service_socket'], token=args['service_token'] )
+    try:
+        while not service.stopped.wait(1): # a timeout keeps Ctrl+C responsive on Windows
+            pass
+    except KeyboardInterrupt:
+        lg.info("stopping")
+    finally:
+        service.close()
+    lg.info("service stopped")
@@ -0,0 +1,211 @@
+# -*- coding: utf-8 -*-
+"""
+This module downloads the issued declaration documents.
+
+The document is streamed in chunks into a partial file next to its
+destination, so it never passes through memory as a whole and the final
+rename is atomic on the same volume, readers see either no file or the
+complete one. Size and SHA-256 are computed while streaming. An interrupted
+transfer is resumed with a `Range` request for the missing bytes, a server
+that ignores the range sends the whole file again. A partial file the answer
+does not continue exactly, by its `Content-Range` start and total size, is
+discarded, so a mismatched or truncated file never becomes the document.
+Next to the partial file its origin, the URL and ETag of the document, is
+kept. A partial file is only resumed for the same URL, with `If-Range` if the
+server sent an ETag; a partial file of another document, e.g. left behind by a
+failed job whose name the next job got, is discarded.
+
+"""
+
+
+import os
+import json
+import hashlib
+import pathlib
+import argparse
+import requests
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+DOWNLOAD_DEFAULTS = {
+          'chunk_size' : 64 * 1024
+        , 'retries'    : 3
+        , 'timeout'    : 60
+    }
+
+#%% constants
+
+PART_SUFFIX   = '.part'
+ORIGIN_SUFFIX = '.origin'
+
+#%% logic
+
+def partPath(dest):
+    """Returns the partial file of a destination, in the same directory."""
+    dest = pathlib.Path(dest)
+    return dest.with_name(dest.name + PART_SUFFIX)
+
+
+def originPath(dest):
+    """Returns the file holding the origin of the partial file of a destination."""
+    dest = pathlib.Path(dest)
+    return dest.with_name(dest.name + PART_SUFFIX + ORIGIN_SUFFIX)
+
+
+def readOrigin(dest):
+    """Returns the `url` and `etag` the partial file of a destination was downloaded from, an empty dict if unknown."""
+    try:
+        origin = json.loads(originPath(dest).read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return dict()
+    return origin if isinstance(origin, dict) else dict()
+
+
+def writeOrigin(dest, url, etag):
+    """Records the `url` and `etag` the partial file of a destination is downloaded from."""
+    originPath(dest).write_text(json.dumps({ 'url' : url, 'etag' : etag }), encoding='utf-8')
+    return
+
+
+def contentRange(response):
+    """
+    Returns the first byte and the total size of a `Content-Range` header.
+
+    Args:
+        response (requests.Response): A 206 or 416 response.
+
+    Returns:
+        tuple: The first byte and the total size, each None if not given.
+
+    """
+    unit, _, spec = response.headers.get('Content-Range', '').partition(' ')
+    span, _, total = spec.partition('/')
+    start = span.partition('-')[0]
+    return ( int(start) if unit == 'bytes' and start.isdigit() else None
+           , int(total) if unit == 'bytes' and total.isdigit() else None )
+
+
+@logger.logging
+def download(  session, url, dest, chunk_size=DOWNLOAD_DEFAULTS['chunk_size']
+             , retries=DOWNLOAD_DEFAULTS['retries'], timeout=DOWNLOAD_DEFAULTS['timeout']):
+    """
+    Streams a document to `dest` and renames it into place when complete.
+
+    A partial file left by an earlier attempt for the same URL is resumed, a
+    partial file of another or an unknown URL is discarded first. It is also
+    discarded and the document downloaded again if the server does not continue
+    it exactly, i.e. a partial answer does not start at its end, a refused range
+    does not report its size as total or the ETag of the document changed.
+
+    Args:
+        session (requests.Session): The session carrying the cookies of the portal.
+        url (str): The URL of the document.
+        dest (str): The final path of the document.
+        chunk_size (int, optional): Bytes read and written at once. Defaults to 64 KiB.
+        retries (int, optional): Attempts to resume an interrupted transfer. Defaults to 3.
+        timeout (int, optional): The timeout in seconds of connect and each read. Defaults to 60.
+
+    Returns:
+        dict: The `file` path, its `size` in bytes, its `sha256` and the number of
+              `resumed` transfers.
+
+    Raises:
+        Exception: If the document can not be downloaded completely.
+
+    """
+    dest = pathlib.Path(dest)
+    part = partPath(dest)
+    sha  = hashlib.sha256()
+    have = 0
+    etag = None
+    if part.exists():
+        origin = readOrigin(dest)
+        if origin.get('url') != url:
+            lg.warning(f"{part} was not downloaded from {url}, discarded")
+            part.unlink()
+        else:
+            etag = origin.get('etag')
+    if part.exists():
+        with open(part, 'rb') as f:
+            for chunk in iter(lambda: f.read(chunk_size), b''):
+                sha.update(chunk)
+                have += len(chunk)
+
+    resumed = 0
+    for attempt in range(retries + 1):
+        headers = { 'Range' : f"bytes={have}-" } if have else dict()
+        if have and etag and not etag.startswith('W/'): # a changed document is sent whole
+            headers['If-Range'] = etag
+        try:
+            with session.get(url, headers=headers, stream=True, timeout=timeout) as response:
+                if have and response.status_code in (206, 416):
+                    start, total = contentRange(response)
+                    if response.status_code == 416 and total == have: # the part is already complete
+                        break
+                    if response.status_code == 416 or start != have:
+                        lg.warning(f"{url} does not continue the partial file of {have} bytes, restarting download")
+                        part.unlink(missing_ok=True)
+                        sha, have = hashlib.sha256(), 0
+                        continue
+                    if total is None and 'Content-Length' in response.headers:
+                        total = have + int(response.headers['Content-Length'])
+                elif response.status_code != 200:
+                    raise Exception(f"failed downloading file from {url}: {response.status_code}")
+                else:
+                    if have:
+                        lg.debug(f"{url} does not support ranges, restarting download")
+                        sha, have = hashlib.sha256(), 0
+                    total = response.headers.get('Content-Length')
+                    total = None if total is None else int(total)
+                if not have:
+                    etag = response.headers.get('ETag')
+                    writeOrigin(dest, url, etag)
+                with open(part, 'ab' if have else 'wb') as f:
+                    for chunk in response.iter_content(chunk_size):
+                        f.write(chunk)
+                        sha.update(chunk)
+                        have += len(chunk)
+                if not total is None and have < total:
+                    raise requests.exceptions.ChunkedEncodingError(f"{have} of {total} bytes received")
+                if not total is None and have > total:
+                    part.unlink()
+                    raise Exception(f"failed downloading file from {url}: {have} of {total} bytes received")
+            break
+        except (requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError, requests.exceptions.Timeout) as e:
+            if attempt == retries:
+                raise Exception(f"failed downloading file from {url} after {retries} resumes") from e
+            resumed += 1
+            lg.warning(f"download of {url} interrupted at {have} bytes, resuming: {e}")
+    else:
+        raise Exception(f"failed downloading file from {url}: the server does not continue the partial file")
+
+    os.replace(part, dest)
+    originPath(dest).unlink(missing_ok=True)
+    return { 'file' : dest, 'size' : have, 'sha256' : sha.hexdigest(), 'resumed' : resumed }
+
+
+def sha256sum(path, chunk_size=DOWNLOAD_DEFAULTS['chunk_size']):
+    """Returns the SHA-256 of a file."""
+    sha = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='documentDownload'
+        , description="streams a document to a file, resuming interrupted transfers"
+        )
+    parser.add_argument('url')
+    parser.add_argument('dest')
+    args = vars(parser.parse_args())
+
+    with requests.Session() as session:
+        print(download(session, args['url'], args['dest']))
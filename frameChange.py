@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+This module detects whether a screenshot differs from the previous one.
+
+The OCR of a screenshot of the notification area is expensive, while most of
+the screenshots taken while waiting for an SMS are identical. The detector
+compares a small grayscale version of each frame with the previous one, so
+the OCR only has to run on frames that actually changed.
+
+It only depends on Pillow and can be replayed offline on a sequence of saved
+screenshots, e.g. the ones stored by SMSNotification in debug mode:
+
+    python frameChange.py debug/*.png
+
+"""
+
+
+import argparse
+import pathlib
+from PIL import Image, ImageChops
+import logger
+
+#%% defaults
+
+FRAME_DEFAULTS = {
+          'width'     : 64
+        , 'threshold' : 8
+    }
+
+#%% logic
+
+class FrameChangeDetector:
+    """
+    Compares each frame with the previous one on a downsampled grayscale copy.
+
+    A frame counts as changed if any downsampled pixel differs by more than
+    `threshold` gray levels from the previous frame, so a new notification is
+    detected while noise of the screen capture is ignored.
+
+    """
+
+    @logger.logging
+    def __init__(self, width=FRAME_DEFAULTS['width'], threshold=FRAME_DEFAULTS['threshold']):
+        """
+        Initializes the FrameChangeDetector instance.
+
+        Args:
+            width (int, optional): Width in pixels of the downsampled copy, the
+                height keeps the aspect ratio. Defaults to 64.
+            threshold (int, optional): Difference in gray levels a pixel needs to
+                count as changed. Defaults to 8.
+
+        """
+        self.width     = width
+        self.threshold = threshold
+        self.reset()
+        return
+
+    @logger.logging
+    def reset(self):
+        """Forgets the previous frame and the counters, the next frame counts as changed."""
+        self.previous = None
+        self.captured = 0
+        self.changes  = 0
+        return
+
+    @logger.logging
+    def _downsample(self, image):
+        """
+        Returns the small grayscale copy a frame is compared on.
+
+        Args:
+            image (PIL.Image.Image): The frame.
+
+        Returns:
+            PIL.Image.Image: The downsampled copy.
+
+        """
+        height = max(1, round(image.height * self.width / max(1, image.width)))
+        return image.convert('L').resize((self.width, height), Image.Resampling.BOX)
+
+    @logger.logging
+    def changed(self, image):
+        """
+        Tells whether a frame differs from the previous one and remembers it.
+
+        Args:
+            image (PIL.Image.Image): The frame.
+
+        Returns:
+            bool: True if the frame changed, or if it is the first one.
+
+        """
+        self.captured += 1
+        current  = self._downsample(image)
+        previous = self.previous
+        self.previous = current
+        if previous is None or previous.size != current.size \
+           or ImageChops.difference(previous, current).getextrema()[1] > self.threshold:
+            self.changes += 1
+            return True
+        return False
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='frameChange'
+        , description="replays saved screenshots through the frame change detector"
+        )
+    parser.add_argument('frames', nargs='+', help="screenshots in capture order.")
+    parser.add_argument('--width', dest='width', default=FRAME_DEFAULTS['width'], type=int)
+    parser.add_argument('--threshold', dest='threshold', default=FRAME_DEFAULTS['threshold'], type=int)
+    args = vars(parser.parse_args())
+
+    detector = FrameChangeDetector(width=args['width'], threshold=args['threshold'])
+    for frame in args['frames']:
+        with Image.open(frame) as image:
+            print(f"{'changed  ' if detector.changed(image) else 'unchanged'} {pathlib.Path(frame).name}")
+    print(f"{detector.captured} frames captured, {detector.changes} would be OCR'd")
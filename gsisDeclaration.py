@@ -7,37 +7,127 @@ It uses Selenium to navigate the website, log in with user credentials, fill out
 declaration form, and handle the SMS verification process. The final declaration
 is downloaded as a PDF file.
 
+The WebDriver, its waits and the HTTP modules are imported on first use, so
+importing the module for its defaults does not load them.
+
 """
 
 
-from selenium import webdriver
 from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException
+from selenium.common.exceptions import TimeoutException, JavascriptException
 from selenium.webdriver.chrome.options import Options
 import pathlib
 import argparse
 import tempfile
-import shutil
-import requests
+import contextlib
+import collections
+import time
+from functools import wraps
 from datetime import datetime as dt
 from loguru import logger as lg
 import logger
+import outputNaming
 
 #%% defaults
 
+# retries of each step after its first attempt, a retry keeps the steps before it
+RETRY_DEFAULTS = {
+        'login'       : 1 # the login again from the create url
+      , 'form'        : 2 # the form again in the authenticated session
+      , 'sms_request' : 2 # the form again and a new SMS, after no or a rejected code
+      , 'sms_code'    : 2 # the same code again, after it could not be entered
+      , 'download'    : 3 # the PDF again, a partial file is resumed
+    }
+
 GSIS_DEFAULTS = {
         'download_dir' : pathlib.Path('./downloads').absolute()
       , 'url'          : "https://dilosi.services.gov.gr/templates/YPDIL/create"
       , 'timeout'      : 60
-      #, 'retries'      : 3
+      , 'headless'     : False
+      , 'fused_actions': True
+      , 'http_engine'  : False
+      , 'optional_timeout' : 3 # seconds an element that may be missing, e.g. the cookie banner, is waited for
     }
  
 #%% constants 
 
+# the stages a retry of a step does not repeat
+RETRY_KEEPS = {
+        'login'       : ('browser',)
+      , 'form'        : ('browser', 'login')
+      , 'sms_request' : ('browser', 'login')
+      , 'sms_code'    : ('browser', 'login', 'form')
+      , 'download'    : ('browser', 'login', 'form', 'sms')
+    }
+
 DEBUG_DIR = pathlib.Path('./debug')
 
+# locates an element, scrolls it instantly into view and checks that it can be
+# used, all in one WebDriver command. Returns the element or false.
+FUSED_LOCATE = """
+    const [by, locator] = arguments;
+    const el = by === 'id'          ? document.getElementById(locator)
+             : by === 'css selector' ? document.querySelector(locator)
+             : document.evaluate(locator, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    if (!el || el.disabled || !el.getClientRects().length) return false;
+    const style = window.getComputedStyle(el);
+    if (style.visibility === 'hidden' || style.display === 'none') return false;
+    el.scrollIntoView({behavior: 'instant', block: 'center'});
+    const rect = el.getBoundingClientRect();
+    if (rect.bottom < 0 || rect.top > (window.innerHeight || document.documentElement.clientHeight)) return false;
+"""
+FUSED_CLICK = FUSED_LOCATE + "el.click(); return true;"
+FUSED_CLEAR = FUSED_LOCATE + "el.value = ''; el.dispatchEvent(new Event('input', {bubbles: true})); return el;"
+
+#%% helper
+
+def span(name):
+    """
+    Records the wall time of the decorated method as span `name` of the declaration.
+
+    Spans of steps are named `<stage>.<step>`, they are summed up like the stages
+    in `self.stages`.
+
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrap(self, *args, **kw):
+            with self._stage(name):
+                return f(self, *args, **kw)
+        return wrap
+    return decorator
+
+def parseRetries(values):
+    """
+    Parses `STEP=N` command line values into a retry policy.
+
+    Args:
+        values (list): The values, a bare number applies to all steps.
+
+    Returns:
+        dict: The retries of the steps given, see `RETRY_DEFAULTS`.
+
+    Raises:
+        argparse.ArgumentTypeError: If a value is malformed or its step unknown.
+
+    """
+    retries = dict()
+    for value in values or []:
+        step, _, number = value.rpartition('=')
+        if not number.isdigit():
+            raise argparse.ArgumentTypeError(f"--retries: {value} is not STEP=N or N")
+        if not step:
+            retries.update({ s : int(number) for s in RETRY_DEFAULTS })
+        elif step in RETRY_DEFAULTS:
+            retries[step] = int(number)
+        else:
+            raise argparse.ArgumentTypeError(f"--retries: unknown step {step}, one of {', '.join(RETRY_DEFAULTS)}")
+    return retries
+
+
+class CodeNotSubmitted(Exception):
+    """The SMS code could not be entered, it has not been rejected by the portal."""
+
 #%% 
 
 
@@ -55,8 +145,11 @@ class gsisGrabber:
     @lg.catch
     def __init__(  self, username, password, taxid, email, receiver, text, download_dir
                  , url, timeout
-                 #, retries
-                 , getCode=None, filename=None
+                 , retries=None
+                 , getCode=None, filename=None, smsChannel=None
+                 , headless=GSIS_DEFAULTS['headless'], fused_actions=GSIS_DEFAULTS['fused_actions']
+                 , browsers=None, http_engine=GSIS_DEFAULTS['http_engine']
+                 , latency=None
                  ) :
         """
         Initializes the gsisGrabber instance.
@@ -70,9 +163,27 @@ class gsisGrabber:
             text (str): The main content of the declaration.
             download_dir (str): The directory where the final PDF will be saved.
             url (str): The URL of the declaration creation page.
-            timeout (int): The timeout in seconds for web driver waits.
+            timeout (int): The timeout in seconds for web driver waits, the ceiling of the
+                learned timeouts if `latency` is given.
+            retries (dict, optional): Retries per step overriding `RETRY_DEFAULTS`, e.g.
+                `{'download': 5}`. Defaults to None.
             getCode (function, optional): A function to retrieve the SMS code. Defaults to None.
             filename (str, optional): The desired filename for the downloaded PDF. Defaults to None.
+            smsChannel (function, optional): Factory of a context manager granting exclusive
+                access to the SMS channel while a code is requested and submitted. Needed if
+                several instances run in parallel. Defaults to None.
+            headless (bool, optional): Run Chrome without a window. Defaults to False.
+            fused_actions (bool, optional): Locate, scroll and click an element with a single
+                injected script instead of several WebDriver commands. Defaults to True.
+            browsers (browserFactory.BrowserFactory, optional): The factory to start the
+                browser with, shared by parallel instances. Defaults to None, starting an
+                incognito Chrome with `headless` on its own.
+            http_engine (bool, optional): Submit the form steps and the confirmation code
+                over HTTP with the cookies of the browser, falling back to the browser if
+                the portal answers unexpectedly. Defaults to False.
+            latency (stepTimeouts.LatencyHistory, optional): The latency history the
+                timeout of every wait is learned from and recorded into, shared by parallel
+                instances. Defaults to None, waiting `timeout` seconds everywhere.
 
         """
         self.username = username
@@ -85,17 +196,34 @@ class gsisGrabber:
         self.url      = url
         self.filename = filename
         self.timeout  = timeout
-        #self.retries  = int(retries)
+        self.latency  = latency
+        self.running  = list() # the stages entered, the innermost is the step of a wait
+        self.fused_actions = fused_actions
+        self.http_engine = http_engine
+        self.http     = None
+        self.overHttp = False
+        self.downloads = None
+        self.filesize = None
+        self.sha256   = None
+        self.commands = collections.Counter()
+        self.retries  = { **RETRY_DEFAULTS, **(retries or dict()) }
+        self.retried  = collections.Counter() # retries per step of the current declaration
+        self.saved    = 0.0 # seconds of earlier steps the retries did not repeat
+        self.smsCode  = None
+        self.debug_dir = DEBUG_DIR
         
         if not DEBUG_DIR.exists():
             DEBUG_DIR.mkdir(parents=True, exist_ok=False)
 
         
+        self.browsers = browsers
         self.chrome_options = Options()
         self.chrome_options.add_argument("--incognito") # private mode
         self.chrome_options.add_argument("--disable-popup-blocking")
         self.chrome_options.add_argument("--no-sandbox")
         self.chrome_options.add_argument("--disable-dev-shm-usage")
+        if headless:
+            self.chrome_options.add_argument("--headless=new")
         self.tmpdir = tempfile.TemporaryDirectory()
         pathlib.Path(self.tmpdir.name).mkdir(parents=True, exist_ok=True)
         self.chrome_options.add_experimental_option("prefs", {
@@ -109,14 +237,23 @@ class gsisGrabber:
         
         self.download_dir.mkdir(exist_ok=True, parents=True)
 
-        self.driver = webdriver.Chrome(options=self.chrome_options)
-        self.driver.get(self.url)
-        self.wait = WebDriverWait(self.driver, self.timeout)
-        self._acceptCoockies()
+        self.stages = dict()
+        with self._stage('browser'):
+            with self._stage('browser.driver'):
+                if self.browsers is None:
+                    from selenium import webdriver
+                    self.driver = webdriver.Chrome(options=self.chrome_options)
+                else:
+                    self.driver = self.browsers.create(self.tmpdir.name)
+                self._countCommands()
+                self.driver.get(self.url)
+            self._acceptCoockies()
         
         self.getCode = getCode
+        self.smsChannel = smsChannel
         self.filepath = None
         self.fileurl  = None
+        self.issued   = 0
         return
     
     @logger.logging     
@@ -148,30 +285,100 @@ class gsisGrabber:
 
         """
         if not self.driver is None:
-            self.driver.quit()
+            if self.browsers is None:
+                self.driver.quit()
+            else:
+                self.browsers.release(self.driver)
+            self.driver = None
+        if not self.http is None:
+            self.http.close()
+            self.http = None
+        if not self.downloads is None:
+            self.downloads.close()
+            self.downloads = None
         if not self.tmpdir is None:
             self.tmpdir.cleanup()
         return
         
     @logger.logging     
     @lg.catch
+    @span('browser.accept_cookies')
     def _acceptCoockies(self):
         """
         Accepts the cookie consent banner on the website.
 
         This method waits for the cookie button to be clickable and then clicks it.
-        It will pass silently if the button is not found.
+        It will pass silently if the button is not found. The banner is optional,
+        so it is waited for a short fixed time that is neither learned nor doubled
+        when it runs out.
 
         """
         try:
-            cookie_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Ενημερώθηκα')]")))
-            self._scroll_and_click(cookie_button)
+            self._click(By.XPATH, "//button[contains(text(), 'Ενημερώθηκα')]", timeout=GSIS_DEFAULTS['optional_timeout'])
         except:
             pass
         return
     
     @logger.logging     
     @lg.catch
+    def setDeclaration(self, receiver, text, download_dir=None, filename=None):
+        """
+        Rebinds the grabber to the next declaration of a reused browser session.
+
+        The authenticated browser is kept, only the declaration specific data is
+        replaced. The next call of `run` returns to the create form instead of
+        starting a new login.
+
+        Args:
+            receiver (str): The name of the recipient of the declaration.
+            text (str): The main content of the declaration.
+            download_dir (str, optional): The directory where the final PDF will be saved.
+                Defaults to None, keeping the current directory.
+            filename (str, optional): The desired filename for the downloaded PDF.
+                Defaults to None, keeping the current filename.
+
+        """
+        self.receiver = receiver
+        self.declarationText = text
+        if not download_dir is None:
+            self.download_dir = pathlib.Path(download_dir)
+            self.download_dir.mkdir(exist_ok=True, parents=True)
+        if not filename is None:
+            self.filename = filename
+        self.filepath = None
+        self.fileurl  = None
+        return
+    
+    @logger.logging     
+    @lg.catch
+    @span('login.return_to_form')
+    def _returnToForm(self):
+        """
+        Navigates an already authenticated session back to the create form.
+
+        After a saved document the portal session usually stays valid, so the
+        create url directly shows the email field of the form. If the portal
+        shows the login button instead, the session has expired.
+
+        Returns:
+            bool: True if the form is reachable without a new login, False otherwise.
+
+        """
+        from selenium.webdriver.support import expected_conditions as EC
+        self.driver.get(self.url)
+        try:
+            element = self._until(EC.any_of(
+                  EC.presence_of_element_located((By.ID, "solemn:email"))
+                , EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Σύνδεση')]"))
+                ))
+        except TimeoutException:
+            return False
+        authenticated = element.get_attribute("id") == "solemn:email"
+        if not authenticated:
+            lg.info("portal session expired, login required")
+        return authenticated
+    
+    @logger.logging     
     def _login(self):
         """
         Handles the login process on the gov.gr portal.
@@ -183,39 +390,33 @@ class gsisGrabber:
             Exception: If any step of the login process fails.
 
         """
-        try:
-            login_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Σύνδεση')]")))
-            self._scroll_and_click(login_button)
+        with self._stage('login.credentials'):
+            try:
+                self._click(By.XPATH, "//button[contains(text(), 'Σύνδεση')]")
 
-        except Exception as e:
-            raise Exception("Login button not found.") from e
+            except Exception as e:
+                raise Exception("Login button not found.") from e
          
-        try:
-            auth_selector = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'ΓΓΠΣΨΔ')]")))
-            self._scroll_and_click(auth_selector)
-        except Exception as e: 
-            raise Exception("Taxisnet authentification not found.") from e
+            try:
+                self._click(By.XPATH, "//button[contains(text(), 'ΓΓΠΣΨΔ')]")
+            except Exception as e: 
+                raise Exception("Taxisnet authentification not found.") from e
             
-        try:
-            username_field = self.wait.until(EC.presence_of_element_located((By.ID, "j_username")))
-            password_field =self. wait.until(EC.presence_of_element_located((By.ID, "j_password")))
-            username_field.clear()
-            username_field.send_keys(self.username)
-            password_field.clear()
-            password_field.send_keys(self.password)
+            try:
+                self._fill(By.ID, "j_username", self.username)
+                self._fill(By.ID, "j_password", self.password)
             
-            login_button = self.wait.until(EC.element_to_be_clickable((By.ID, "btn-login-submit")))
-            self._scroll_and_click(login_button)
+                self._click(By.ID, "btn-login-submit")
 
 
-        except:
-            raise Exception("login failed")
+            except:
+                raise Exception("login failed")
         
         self._authentificate()
         return
             
     @logger.logging     
-    @lg.catch
+    @span('login.authentificate')
     def _authentificate(self) :
         """
         Authenticates the user after login.
@@ -227,15 +428,14 @@ class gsisGrabber:
             Exception: If the Tax ID does not match or if authentication fails.
 
         """
+        from selenium.webdriver.support import expected_conditions as EC
         try:    
-            begin_label = self.wait.until(EC.presence_of_element_located((By.XPATH, "//span[contains(text(), 'Συνέχεια')]")))
-            self._scroll_and_click(begin_label)
+            self._click(By.XPATH, "//span[contains(text(), 'Συνέχεια')]")
 
-            begin_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Αποστολή']")))
-            self._scroll_and_click(begin_button)
+            self._click(By.XPATH, "//button[text()='Αποστολή']")
 
 
-            afm_element = self.wait.until(EC.presence_of_element_located(
+            afm_element = self._until(EC.presence_of_element_located(
                 (By.XPATH, "//div[@data-testid='user'][.//dt[span[text()='Α.Φ.Μ.']]]//dd")
             ))
             afm_value   = afm_element.text.strip()
@@ -243,8 +443,7 @@ class gsisGrabber:
             if afm_value != str(self.taxID):
                 raise Exception(f"TaxID received {afm_value} differs from {self.taxID}")
                 
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Συνέχεια']")))
-            self._scroll_and_click(submit_button)
+            self._click(By.XPATH, "//button[text()='Συνέχεια']")
 
             
 
@@ -254,7 +453,7 @@ class gsisGrabber:
         return
     
     @logger.logging     
-    @lg.catch
+    @span('form.email')
     def _initForm(self):
         """
         Initializes the declaration form.
@@ -267,15 +466,12 @@ class gsisGrabber:
         """
         
         try:
-            email_input = self.wait.until(EC.presence_of_element_located((By.ID, "solemn:email")))
-            email_input.clear()
-            email_input.send_keys(self.email)
+            self._fill(By.ID, "solemn:email", self.email)
         except Exception as e:
             raise Exception("can't find email field") from e
         
         try:
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Συνέχεια']")))
-            self._scroll_and_click(submit_button)
+            self._click(By.XPATH, "//button[text()='Συνέχεια']")
 
         except Exception as e:
             raise e
@@ -283,100 +479,147 @@ class gsisGrabber:
         return
     
     @logger.logging     
-    @lg.catch
-    def _declare(self) :
+    def _fillDeclaration(self) :
         """
-        Fills out and submits the declaration form.
+        Fills out the declaration form up to the request of its export.
 
-        This method enters the declaration text, specifies the recipient, and handles
-        the SMS verification process to finalize and issue the declaration.
+        This method enters the declaration text and specifies the recipient. Nothing
+        in here depends on the SMS channel, so it can run while another session
+        waits for its code.
 
         Raises:
             Exception: If any step of filling or submitting the form fails.
 
         """
                 
-        try:
-            textarea = self.wait.until(EC.presence_of_element_located((By.XPATH, "//textarea[@name='free_text']")))
-            self._scroll_to(textarea)
-            textarea.clear()
-            textarea.send_keys(self.declarationText)
-        except Exception as e:
-            self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_free_text.png").as_posix() ) 
-            raise Exception("failed on providing declaration text") from e
+        with self._stage('form.free_text'):
+            try:
+                self._fill(By.XPATH, "//textarea[@name='free_text']", self.declarationText)
+            except Exception as e:
+                self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_free_text.png").as_posix() ) 
+                raise Exception("failed on providing declaration text") from e
 
-        try:
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Συνέχεια']")))
-            self._scroll_and_click(submit_button)
-        except Exception as e:
-            self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_declaration_text.png").as_posix() )
+        with self._stage('form.text_submit'):
+            try:
+                self._click(By.XPATH, "//button[text()='Συνέχεια']")
+            except Exception as e:
+                self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_declaration_text.png").as_posix() )
 
-            raise Exception("failed on submit declaration text") from e
+                raise Exception("failed on submit declaration text") from e
         
-        try:
-            receiver_area = self.wait.until(EC.presence_of_element_located((By.ID, "solemn:recipient")))
-            self.driver.execute_script("arguments[0].scrollIntoView(true);", receiver_area)
-            WebDriverWait(self.driver, 5).until(EC.visibility_of(receiver_area)) # Warten, bis das Element sichtbar ist
-
-            receiver_area.clear()
-            receiver_area.send_keys(self.receiver)
-            
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Συνέχεια']")))
-            self._scroll_and_click(submit_button)
-        except Exception as e:
-            self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_receipient_definition.png").as_posix() )
-            raise Exception("failed on defining the receipient") from e
+        with self._stage('form.recipient'):
+            try:
+                self._fill(By.ID, "solemn:recipient", self.receiver)
             
-        try:
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[contains(text(), 'Έκδοση')]")))
-            self._scroll_and_click(submit_button)
-        except Exception as e:
-            self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_declaration_export.png").as_posix() )
-            raise Exception("failed to request the declaration export") from e
+                self._click(By.XPATH, "//button[text()='Συνέχεια']")
+            except Exception as e:
+                self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_receipient_definition.png").as_posix() )
+                raise Exception("failed on defining the receipient") from e
             
-        try:
-            radio_input = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//label[contains(., 'Με αποστολή SMS')]/input[@type='radio']")))
-            #radio_input = self.driver.find_element(By.XPATH, "//label[contains(., 'Με αποστολή SMS')]/input[@type='radio']")
-            self._scroll_and_click(radio_input)
+        with self._stage('form.export'):
+            try:
+                self._click(By.XPATH, "//button[contains(text(), 'Έκδοση')]")
+            except Exception as e:
+                self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_declaration_export.png").as_posix() )
+                raise Exception("failed to request the declaration export") from e
+        return
+    
+    @logger.logging     
+    def _confirmDeclaration(self) :
+        """
+        Requests the SMS code and confirms the declaration with it.
 
+        The SMS channel is shared with other sessions, it is held from the request
+        until the code is accepted. The time spent waiting for the channel and
+        holding it is recorded as the stages `sms_wait` and `sms`. If no code
+        arrives or the portal rejects it, the form is filled again in the same
+        session and a new SMS is requested, see `RETRY_DEFAULTS['sms_request']`.
 
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Συνέχεια']")))
-            self._scroll_and_click(submit_button)
+        Raises:
+            Exception: If the SMS code can not be requested or submitted.
 
-        except Exception as e:
-            self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_SMS_request.png").as_posix() )
-            raise Exception("failed to requeest SMS code") from e
-            
+        """
+        self.smsCode = None
+        self._step('sms_request', self._holdSMSChannel, recover=self._refillForm)
+        return
 
-        local_retry = 3
-        while(True): 
+    def _holdSMSChannel(self):
+        """Requests and submits the SMS code while the SMS channel is held."""
+        requested = time.perf_counter()
+        with self._smsChannel():
+            self.stages['sms_wait'] = self.stages.get('sms_wait', 0.0) + time.perf_counter() - requested
+            with self._stage('sms'):
+                self._requestAndSendCode()
+        return
+    
+    @logger.logging     
+    def _requestAndSendCode(self) :
+        """
+        Requests the SMS code and submits it, while the SMS channel is held.
+
+        A declaration prepared over HTTP is confirmed over HTTP. If that fails the
+        form is filled again in the browser and confirmed there.
+
+        Raises:
+            Exception: If the SMS code can not be requested or submitted.
+
+        """
+        if self.overHttp:
+            import requests
+            import httpDeclaration
             try:
-                code = self._getSMSCode()
-                if code is None:
-                    continue
-            except Exception as e:
-                raise Exception("no SMS code received") from e
-                
+                self._httpRequestAndSendCode()
+                return
+            except (httpDeclaration.UnexpectedResponse, requests.RequestException) as e:
+                lg.warning(f"HTTP engine failed, falling back to the browser: {e}")
+                self.overHttp = False
+                self.driver.get(self.url)
+                self._initForm()
+                self._fillDeclaration()
+
+        with self._stage('sms.request'):
             try:
-                self._sendCode(code)
-                break
+                self._click(By.XPATH, "//label[contains(., 'Με αποστολή SMS')]/input[@type='radio']")
+
+
+                self._click(By.XPATH, "//button[text()='Συνέχεια']")
+
             except Exception as e:
-                #self.retries -= 1 
-                local_retry -= 1
-                if local_retry == 0:
-                    raise Exception("unable too send the SMS code, retries exceeded") from e
-                    
-            break            
-        
-        #if self.retries == 0:
-        #    raise Exception("too many failing attempts to provide the right code")
-        
-        self._saveDocument()
+                self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_SMS_request.png").as_posix() )
+                raise Exception("failed to requeest SMS code") from e
 
+        self._step('sms_code', self._receiveAndSendCode, retry_on=CodeNotSubmitted)
+        return
+
+    def _receiveAndSendCode(self):
+        """
+        Waits for the SMS code, unless one is pending, and submits it.
+
+        A code that could not be entered stays pending for the next attempt, a
+        rejected code is dropped.
+
+        Raises:
+            CodeNotSubmitted: If the code could not be entered.
+            Exception: If no code is received or the portal rejects it.
+
+        """
+        if self.smsCode is None:
+            self.smsCode = self._getSMSCode()
+            if self.smsCode is None:
+                raise Exception("no SMS code received")
+        code = self.smsCode
+        try:
+            self._sendCode(code)
+        except CodeNotSubmitted:
+            raise
+        except Exception:
+            self.smsCode = None
+            raise
+        self.smsCode = None
         return
     
     @logger.logging     
-    @lg.catch
+    @span('sms.send')
     def _sendCode(self, code):
         """
         Submits the SMS verification code.
@@ -385,40 +628,119 @@ class gsisGrabber:
             code (str): The verification code received via SMS.
 
         Raises:
-            Exception: If the code cannot be submitted or is incorrect.
+            CodeNotSubmitted: If the code cannot be entered.
+            Exception: If the portal rejects the code.
 
         """
         try:
-            code_input = self.driver.find_element(By.ID, "confirmation_code")
-            self.driver.execute_script("arguments[0].scrollIntoView(true);", code_input)
-            WebDriverWait(self.driver, 5).until(EC.visibility_of(code_input)) # Warten, bis das Element sichtbar ist
-            code_input.clear()
-            code_input.send_keys(code)
+            self._fill(By.ID, "confirmation_code", code)
             
-            submit_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//button[text()='Επιβεβαίωση']")))
-            self._scroll_and_click(submit_button)
+            self._click(By.XPATH, "//button[text()='Επιβεβαίωση']")
 
         except Exception as e:
             self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_confirmation_code_entry.png").as_posix() )
-            raise Exception("failed sending confirmation code") from e
+            raise CodeNotSubmitted("failed sending confirmation code") from e
             
-        
+        from selenium.webdriver.support import expected_conditions as EC
+        # the portal answers with the download link or the error, whichever comes first
         try:
-            error_element = WebDriverWait(self.driver, 1).until(
-                EC.presence_of_element_located(
-                    (By.XPATH, "//*[contains(text(), 'Λανθασμένος κωδικός επιβεβαίωσης')]")
-                ))
-            if not error_element is None:
-                raise Exception("wrong SMS code used")
+            verdict = self._until(EC.any_of(
+                  EC.presence_of_element_located((By.XPATH, '//a[contains(@href, "pdf-download")]'))
+                , EC.presence_of_element_located((By.XPATH, "//*[contains(text(), 'Λανθασμένος κωδικός επιβεβαίωσης')]"))
+                ), step='sms.verdict')
         except TimeoutException:
-            pass # timeout while querying for errors, timeout here is good :)
+            return # no error shown, the download waits for the link
         except Exception as e:
             self.driver.save_screenshot( (self.debug_dir / f"{dt.now()}_screenshot_confirmation_code_submission.png").as_posix() )
             raise Exception("failed while providing confirmation code") from e
+        if verdict.tag_name == 'a':
+            return
+        raise Exception("wrong SMS code used")
+    
+    @logger.logging     
+    def _httpFillDeclaration(self):
+        """
+        Fills the declaration form over HTTP, if the HTTP engine is enabled.
+
+        The engine takes over the cookies of the logged in browser. If the portal
+        answers unexpectedly the browser is sent back to the create page, so the
+        form can be filled there.
+
+        Returns:
+            bool: True if the form was filled over HTTP, False if the browser has to fill it.
+
+        """
+        self.overHttp = False
+        if not self.http_engine:
+            return False
+        import requests
+        import httpDeclaration
+        try:
+            with self._stage('form.http'):
+                if self.http is None:
+                    self.http = httpDeclaration.HttpDeclaration(self.url, self.timeout)
+                self.http.adoptBrowser(self.driver)
+                self.http.fillDeclaration(self.email, self.declarationText, self.receiver)
+        except (httpDeclaration.UnexpectedResponse, requests.RequestException) as e:
+            lg.warning(f"HTTP engine failed, falling back to the browser: {e}")
+            self.driver.get(self.url)
+            return False
+        self.overHttp = True
+        return True
+
+    @logger.logging     
+    def _httpRequestAndSendCode(self):
+        """
+        Requests the SMS code and submits it over HTTP.
+
+        Raises:
+            httpDeclaration.UnexpectedResponse: If the portal answers unexpectedly.
+            Exception: If no code is received or the code is rejected.
+
+        """
+        with self._stage('sms.request'):
+            self.http.requestCode()
+        code = self._getSMSCode()
+        if code is None:
+            raise Exception("no SMS code received")
+        with self._stage('sms.send'):
+            self.fileurl = self.http.sendCode(code)
+        self.http.returnCookies(self.driver)
         return
+
+    def _downloadSession(self):
+        """
+        Returns the pooled HTTP session to download documents with.
+
+        Over HTTP it is the session of the HTTP engine, otherwise a session kept for
+        the lifetime of the browser that takes over the browser's current cookies.
+
+        """
+        import requests
+        import httpDeclaration
+        if self.overHttp:
+            return self.http.session
+        if self.downloads is None:
+            self.downloads = requests.Session()
+        httpDeclaration.adoptCookies(self.downloads, self.driver)
+        return self.downloads
+
+    @logger.logging     
+    def _smsChannel(self):
+        """
+        Returns the context manager guarding the SMS channel.
+
+        Returns:
+            contextlib.AbstractContextManager: The guard of the SMS channel, a no-op if
+                no `smsChannel` was provided during initialization.
+
+        """
+        if self.smsChannel is None:
+            return contextlib.nullcontext()
+        return self.smsChannel()
     
     @logger.logging     
-    @lg.catch
+    @span('sms.code')
     def _getSMSCode(self):
         """
         Retrieves the SMS verification code.
@@ -438,109 +760,356 @@ class gsisGrabber:
         return code
     
     @logger.logging     
-    @lg.catch
     def _saveDocument(self):
         """
         Downloads and saves the final declaration PDF.
 
-        This method finds the download link, downloads the file, and saves it to the
-        specified directory, handling potential filename conflicts.
+        This method finds the download link and streams the file into the specified
+        directory with the cookies of the portal session. A taken filename gets the next
+        free numeric index from the name index of the folder. Size and SHA-256 of the
+        file are kept in `filesize` and `sha256`.
 
         Raises:
             Exception: If the download fails or the file cannot be saved.
 
         """
+        from selenium.webdriver.support import expected_conditions as EC
+        import documentDownload
         #download_button = self.wait.until(EC.element_to_be_clickable((By.XPATH, "//a[contains(text(), 'Αποθήκευση')]")))
         #self._scroll_and_click(download_button)
-        link_element  = self.wait.until(EC.element_to_be_clickable((By.XPATH, '//a[contains(@href, "pdf-download")]')))
-        self.fileurl = link_element.get_attribute("href")
+        if not self.overHttp: # over HTTP the link is already known
+            link_element  = self._until(EC.element_to_be_clickable((By.XPATH, '//a[contains(@href, "pdf-download")]')))
+            self.fileurl = link_element.get_attribute("href")
         
-        response = requests.get(self.fileurl, headers={"User-Agent": "Mozilla/5.0"})
-        if response.status_code == 200:
-            (pathlib.Path(self.tmpdir.name)/"declaration.pdf").write_bytes(response.content)
-        else:
-            raise Exception(f"failed downloading file from {self.fileurl}")
-
-        downloaded = list( pathlib.Path(self.tmpdir.name).glob('*') )
-        if len(downloaded) != 1:
-            lg.critical(f'failed downloading file {downloaded}')
-            raise Exception(f"error in processing file download. check download folder {self.tmpdir.name}")
-            
-        base_dest = self.download_dir/self.filename if not self.filename is None else self.download_dir/downloaded[0]
-        dest = base_dest
-        idx = 1
-        while dest.exists():
-            dest = dest.with_stem(base_dest.stem + f' ({idx})')
-            idx += 1
-        shutil.move(downloaded[0], dest)   
-        #downloaded[0].replace(dest)  # cannot  move accross drives :(
+        # parallel sessions may save into the same folder, the index hands out distinct names
+        folder = outputNaming.directory(self.download_dir)
+        dest = folder.allocate(self.filename or "declaration.pdf")
+        try:
+            # streamed next to the destination and renamed into place when complete
+            document = documentDownload.download(self._downloadSession(), self.fileurl, dest, timeout=self.timeout)
+        finally:
+            folder.release(dest)
+        self.filesize = document['size']
+        self.sha256   = document['sha256']
         self.filepath = dest         
         return
     
     
     @logger.logging     
-    @lg.catch
-    def run(self):
+    def prepare(self):
         """
-        Executes the full process of creating and downloading a declaration.
+        Drives the declaration through all steps that do not need the SMS channel.
 
-        This is the main entry point for the class, which orchestrates the login,
-        form filling, and download processes.
+        This covers the login (or the return to the form of a reused session), the
+        form initialization and the free text and recipient steps. Together with
+        `issue` it allows to prepare the next declaration while another session
+        waits for its SMS code.
+
+        """
+        self.stages = { k : v for k, v in self.stages.items() if k.split('.')[0] == 'browser' } if self.issued == 0 else dict()
+        if self.issued > 0:
+            self.commands.clear()
+        self.retried.clear()
+        self.saved = 0.0
+        
+        with self._stage('login'):
+            try:
+                self._step('login', self._enter)
+            except Exception as e:
+                lg.exception('login failed')
+                raise e
+        
+        with self._stage('form'):
+            try:
+                self._step('form', self._form, recover=self._reopenForm)
+            except Exception as e:
+                lg.exception('initialization of declaration failed')
+                raise e
+        return
+
+    def _enter(self):
+        """
+        Logs in, or returns to the create form if the session is already logged in.
+
+        The first attempt of a new browser logs in directly.
+
+        """
+        if self.issued == 0 and self.retried['login'] == 0:
+            self._login()
+        else:
+            self._reopenForm()
+        return
+
+    def _form(self):
+        """Fills the declaration form up to the request of its export, over HTTP if enabled."""
+        if not self._httpFillDeclaration():
+            self._initForm()
+            self._fillDeclaration()
+        return
+
+    def _reopenForm(self):
+        """Returns to an empty create form, logging in again only if the session expired."""
+        if not self._returnToForm():
+            self._login()
+        return
+
+    def _refillForm(self):
+        """Fills a new declaration form in the authenticated session."""
+        self.smsCode = None
+        self._reopenForm()
+        self._form()
+        return
+
+    def _step(self, step, action, recover=None, retry_on=Exception):
+        """
+        Runs a step of the declaration, retrying it by its policy in `self.retries`.
+
+        A retry resumes from the failed step, the state of the steps before it,
+        above all the authenticated browser, is kept. The retries are counted in
+        `self.retried`, the wall time of the stages a restart of the declaration
+        would have repeated is added to `self.saved`.
+
+        Args:
+            step (str): The name of the step, a key of `RETRY_DEFAULTS`.
+            action (function): The step.
+            recover (function, optional): Restores the state the step starts from
+                before a retry, its time is recorded as stage `retry`. Defaults to None.
+            retry_on (type, optional): The exceptions retried. Defaults to Exception.
+
+        Returns:
+            The result of `action`.
+
+        Raises:
+            Exception: The error of the last attempt.
+
+        """
+        attempt = 0
+        while True:
+            try:
+                return action()
+            except retry_on as e:
+                if attempt >= self.retries.get(step, 0):
+                    raise
+                attempt += 1
+                self.retried[step] += 1
+                saved = sum( self.stages.get(stage, 0.0) for stage in RETRY_KEEPS[step] )
+                self.saved += saved
+                lg.warning(f"{step} failed, retry {attempt}/{self.retries[step]} keeping {saved:.1f} sec of earlier steps: {e}")
+                if not recover is None:
+                    with self._stage('retry'):
+                        recover()
+    
+    @logger.logging     
+    def issue(self):
+        """
+        Confirms a prepared declaration with the SMS code and downloads it.
 
         Returns:
             tuple: A tuple containing the file URL and the local file path of the
                    downloaded declaration.
 
         """
-
         try:
-            self._login()
+            self._confirmDeclaration()
         except Exception as e:
-            lg.exception('login failed')
+            lg.exception('declaration failed')
             raise e
         
+        with self._stage('download'):
+            self._step('download', self._saveDocument)
+        return self.fileurl, self.filepath
+    
+    @contextlib.contextmanager
+    def _stage(self, name):
+        """
+        Measures the wall time of a stage of the declaration into `self.stages`.
+
+        Args:
+            name (str): The name of the stage.
+
+        """
+        start = time.perf_counter()
+        self.running.append(name)
         try:
-            self._initForm()
-        except Exception as e:
-            lg.exception('initialization of declaration failed')
-            raise e
-        
+            yield
+        finally:
+            self.running.pop()
+            self.stages[name] = self.stages.get(name, 0.0) + time.perf_counter() - start
+
+    def _until(self, condition, timeout=None, step=None):
+        """
+        Waits for a condition of the page, with the timeout learned for its step.
+
+        The latency of a successful wait is recorded in `self.latency`. A wait
+        that runs out of a learned timeout shorter than `self.timeout` doubles the
+        timeout of its step, so the retry of a slowed down step waits longer.
+
+        Args:
+            condition (function): The condition, called with the driver until it
+                returns a truthy value.
+            timeout (float, optional): A fixed timeout, e.g. for an optional element,
+                its wait is not recorded. Defaults to None, the learned timeout of the step.
+            step (str, optional): The step of the wait. Defaults to None, the
+                innermost stage running.
+
+        Returns:
+            The value of the condition.
+
+        Raises:
+            TimeoutException: If the condition is not met within the timeout.
+
+        """
+        from selenium.webdriver.support.wait import WebDriverWait
+        learned = timeout is None and not self.latency is None
+        if learned:
+            step = step or (self.running[-1] if self.running else 'wait')
+            timeout = self.latency.timeout(step, self.timeout)
+        elif timeout is None:
+            timeout = self.timeout
+        start = time.perf_counter()
         try:
-            self._declare()
-        except Exception as e:
-            lg.exception('declaration failed')
-            raise e
-            
+            result = WebDriverWait(self.driver, timeout).until(condition)
+        except TimeoutException:
+            if learned and timeout < self.timeout:
+                self.latency.observe(step, timeout, expired=True)
+            raise
+        if learned:
+            self.latency.observe(step, time.perf_counter() - start)
+        return result
+
+    @logger.logging     
+    def run(self):
+        """
+        Executes the full process of creating and downloading a declaration.
+
+        This is the main entry point for the class, which orchestrates the login,
+        form filling, and download processes. If the instance already issued a
+        declaration, the existing portal session is reused and the login is only
+        repeated if the session has expired. The wall time of each stage is
+        available in `self.stages` afterwards, the WebDriver commands sent in
+        `self.commands`, the retries of failed steps in `self.retried` and the
+        time they saved in `self.saved`.
+
+        Returns:
+            tuple: A tuple containing the file URL and the local file path of the
+                   downloaded declaration.
+
+        Raises:
+            Exception: The error of a step that failed after its retries.
+
+        """
+
+        self.prepare()
+        self.issue()
+        self.issued += 1
+        lg.debug(f"{sum(self.commands.values())} WebDriver commands: {dict(self.commands)}")
         return self.fileurl, self.filepath                  
 
+    def _countCommands(self):
+        """
+        Counts every command sent to the WebDriver in `self.commands`, by command name.
+
+        All element and driver calls of Selenium end up in `driver.execute`, so the
+        counter shows the round-trips to chromedriver of a declaration.
+
+        """
+        execute = self.driver.execute
+        def counted(driver_command, params=None):
+            self.commands[driver_command] += 1
+            return execute(driver_command, params)
+        self.driver.execute = counted
+        return
+
+    def _click(self, by, locator, timeout=None):
+        """
+        Waits for an element to be clickable, scrolls it into view and clicks it.
+
+        With `fused_actions` the element is located, scrolled instantly into view,
+        checked and clicked by one injected script per poll. Otherwise, or if the
+        script fails, the element is waited for and clicked with `_scroll_and_click`.
+
+        Args:
+            by (str): The locator strategy, `By.XPATH`, `By.ID` or `By.CSS_SELECTOR`.
+            locator (str): The locator of the element.
+            timeout (int, optional): The time to wait for the element. Defaults to None,
+                using the timeout learned for the step, see `_until`.
+
+        Raises:
+            TimeoutException: If the element is not clickable within the timeout.
+
+        """
+        from selenium.webdriver.support import expected_conditions as EC
+        if self.fused_actions:
+            try:
+                self._until(lambda d: d.execute_script(FUSED_CLICK, by, locator), timeout)
+                return
+            except JavascriptException as e:
+                lg.debug(f"fused click on {locator} failed, falling back: {e.msg}")
+        element = self._until(EC.element_to_be_clickable((by, locator)), timeout)
+        self._scroll_and_click(element)
+        return
+
+    def _fill(self, by, locator, value, timeout=None):
+        """
+        Waits for an input element, scrolls it into view, clears it and types a value.
+
+        With `fused_actions` locating, scrolling and clearing is one injected script
+        per poll, only the typing is a further WebDriver command.
+
+        Args:
+            by (str): The locator strategy, `By.XPATH`, `By.ID` or `By.CSS_SELECTOR`.
+            locator (str): The locator of the element.
+            value (str): The text to type.
+            timeout (int, optional): The time to wait for the element. Defaults to None,
+                using the timeout learned for the step, see `_until`.
+
+        Raises:
+            TimeoutException: If the element is not present within the timeout.
+
+        """
+        from selenium.webdriver.support import expected_conditions as EC
+        element = None
+        if self.fused_actions:
+            try:
+                element = self._until(lambda d: d.execute_script(FUSED_CLEAR, by, locator), timeout)
+            except JavascriptException as e:
+                lg.debug(f"fused fill of {locator} failed, falling back: {e.msg}")
+        if element is None:
+            element = self._until(EC.presence_of_element_located((by, locator)), timeout)
+            self._scroll_to(element)
+            element.clear()
+        element.send_keys(value)
+        return
+
     @logger.logging     
     @lg.catch
-    def _scroll_to(self, element, timeout=5):
+    def _scroll_to(self, element, timeout=None):
         """
         Scrolls the page to bring a specified element into view.
 
         Args:
             element (WebElement): The Selenium WebElement to scroll to.
-            timeout (int, optional): The time to wait for the scroll to complete. Defaults to 5.
+            timeout (int, optional): The time to wait for the scroll to complete. Defaults
+                to None, the timeout learned for scrolling, see `_until`.
 
         """
         # Scrollen
         self.driver.execute_script("arguments[0].scrollIntoView({behavior: 'smooth', block: 'center'});", element)
     
         # Warten, bis das Element vollständig im Viewport ist
-        WebDriverWait(self.driver, timeout).until(lambda d: d.execute_script("""
+        self._until(lambda d: d.execute_script("""
             const rect = arguments[0].getBoundingClientRect();
             return (
                 rect.top >= 0 &&
                 rect.bottom <= (window.innerHeight || document.documentElement.clientHeight)
             );
-        """, element))
+        """, element), timeout, step='scroll')
 
         return
     
     @logger.logging     
     @lg.catch
-    def _scroll_and_click(self, element, timeout=5):
+    def _scroll_and_click(self, element, timeout=None):
         """
         Scrolls to an element and securely clicks it.
 
@@ -549,7 +1118,8 @@ class gsisGrabber:
 
         Args:
             element (WebElement): The Selenium WebElement to click.
-            timeout (int, optional): The time to wait for the element to be visible. Defaults to 5.
+            timeout (int, optional): The time to wait for the element to be visible. Defaults
+                to None, the timeout learned for scrolling.
 
         """
         self._scroll_to(element, timeout)
@@ -574,6 +1144,10 @@ if __name__ == '__main__':
     parser.add_argument('--url', dest='url', default=GSIS_DEFAULTS['url'], required=False)
     parser.add_argument('--timeout', dest='timeout', default=GSIS_DEFAULTS['timeout'], type=int, required=False)
     parser.add_argument('--filename', dest='filename', default=None, required=False)
+    parser.add_argument('--headless', dest='headless', default=GSIS_DEFAULTS['headless'], action='store_true', required=False)
+    parser.add_argument('--no-fused-actions', dest='fused_actions', default=GSIS_DEFAULTS['fused_actions'], action='store_false', required=False)
+    parser.add_argument('--http-engine', dest='http_engine', default=GSIS_DEFAULTS['http_engine'], action='store_true', required=False)
+    parser.add_argument('--retries', dest='retries', default=[], nargs='*', required=False, help="STEP=N retries of a step, a bare number for all steps.")
     
         
     args = vars(parser.parse_args())
@@ -587,10 +1161,13 @@ if __name__ == '__main__':
                            , text       = args['text']
                            , download_dir = args['download_dir']
                            , url        = args['url']
-                           #, retries    = args['retries']
+                           , retries    = parseRetries(args['retries'])
                            , timeout    = args['timeout']
                            , getCode    = None
                            , filename   = args['filename']
+                           , headless   = args['headless']
+                           , fused_actions = args['fused_actions']
+                           , http_engine = args['http_engine']
                            ) as gsis:
             url, declaration = gsis.run()
             print(url, declaration)
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+"""
+This module issues declarations over plain HTTP once the browser is logged in.
+
+The login stays with Selenium. After it, the form steps of the portal are form
+posts that do not need a browser: `HttpDeclaration` takes over the cookies of
+the Selenium session into a pooled `requests.Session`, reads the forms of each
+page and submits the email, the free text, the recipient, the SMS channel
+choice and the confirmation code directly. Every page is checked for the
+elements gsisGrabber waits for, if one is missing `UnexpectedResponse` is
+raised and gsisGrabber falls back to the browser.
+
+The engine is developed against `mockPortal.py`, see `python benchmark.py portal --http-engine`.
+
+"""
+
+
+import argparse
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+import requests
+from requests.adapters import HTTPAdapter
+import logger
+
+#%% defaults
+
+HTTP_DEFAULTS = {
+          'timeout'   : 60
+        , 'pool_size' : 4
+    }
+
+#%% constants
+
+WRONG_CODE = 'Λανθασμένος κωδικός επιβεβαίωσης'
+
+#%% logic
+
+def adoptCookies(session, driver):
+    """
+    Copies the cookies and the user agent of a Selenium session into a requests session.
+
+    Args:
+        session (requests.Session): The session to update.
+        driver (WebDriver): The browser.
+
+    """
+    session.headers['User-Agent'] = driver.execute_script("return navigator.userAgent")
+    session.cookies.clear()
+    for cookie in driver.get_cookies():
+        session.cookies.set(cookie['name'], cookie['value'], domain=cookie.get('domain'), path=cookie.get('path', '/'))
+    return
+
+
+class UnexpectedResponse(Exception):
+    """The portal answered with a page the HTTP engine does not know."""
+
+
+class _Form:
+    """A form of a page with its fields, buttons and radio labels."""
+
+    def __init__(self, action, method):
+        self.action  = action
+        self.method  = method.lower()
+        self.fields  = list() # (name, id, type, value, checked)
+        self.buttons = list() # button texts
+        self.labels  = dict() # radio value -> label text
+
+    def has(self, id=None, name=None):
+        """Tells whether the form holds a field of the given id or name."""
+        return any( (not id is None and f[1] == id) or (not name is None and f[0] == name) for f in self.fields )
+
+    def button(self, text):
+        """Tells whether the form has a button containing `text`."""
+        return any( text in b for b in self.buttons )
+
+    def data(self, **values):
+        """Returns the form data, the defaults of the page updated by `values`."""
+        data = dict()
+        for name, _, kind, value, checked in self.fields:
+            if not name or (kind in ('radio', 'checkbox') and not checked):
+                continue
+            data[name] = value
+        data.update(values)
+        return data
+
+
+class _PageParser(HTMLParser):
+    """Collects the forms, links and text of a page."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms  = list()
+        self.links  = list()
+        self.text   = list()
+        self._form   = None
+        self._button = None
+        self._label  = None # [text, radio values]
+
+    def handle_starttag(self, tag, attrs):
+        attrs = dict(attrs)
+        if tag == 'form':
+            self._form = _Form(attrs.get('action', ''), attrs.get('method', 'get'))
+            self.forms.append(self._form)
+        elif tag == 'a' and 'href' in attrs:
+            self.links.append(attrs['href'])
+        elif tag == 'label':
+            self._label = ['', list()]
+        elif tag == 'button':
+            self._button = ''
+        elif tag in ('input', 'textarea', 'select') and not self._form is None:
+            kind = attrs.get('type', 'text' if tag == 'input' else tag).lower()
+            self._form.fields.append( (attrs.get('name'), attrs.get('id'), kind, attrs.get('value', '' if kind != 'checkbox' else 'on'), 'checked' in attrs) )
+            if kind == 'radio' and not self._label is None:
+                self._label[1].append(attrs.get('value', 'on'))
+
+    def handle_endtag(self, tag):
+        if tag == 'form':
+            self._form = None
+        elif tag == 'button' and not self._button is None:
+            if not self._form is None:
+                self._form.buttons.append(self._button.strip())
+            self._button = None
+        elif tag == 'label' and not self._label is None:
+            if not self._form is None:
+                for value in self._label[1]:
+                    self._form.labels[value] = self._label[0].strip()
+            self._label = None
+
+    def handle_data(self, data):
+        self.text.append(data)
+        if not self._button is None:
+            self._button += data
+        if not self._label is None:
+            self._label[0] += data
+
+
+class HttpDeclaration:
+    """
+    Drives the form steps of a logged in portal session over HTTP.
+
+    """
+
+    @logger.logging
+    def __init__(self, url, timeout=HTTP_DEFAULTS['timeout'], pool_size=HTTP_DEFAULTS['pool_size']):
+        """
+        Initializes the HttpDeclaration instance.
+
+        Args:
+            url (str): The URL of the declaration creation page.
+            timeout (int, optional): The timeout in seconds of each request. Defaults to 60.
+            pool_size (int, optional): Connections kept open to the portal. Defaults to 4.
+
+        """
+        self.url     = url
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.page    = None
+        self.fileurl = None
+        return
+
+    @logger.logging
+    def adoptBrowser(self, driver):
+        """
+        Takes over the cookies and the user agent of a logged in Selenium session.
+
+        Args:
+            driver (WebDriver): The browser.
+
+        """
+        adoptCookies(self.session, driver)
+        return
+
+    @logger.logging
+    def returnCookies(self, driver):
+        """
+        Hands cookies renewed by the portal back to the Selenium session.
+
+        The browser has to show a page of the portal domain.
+
+        Args:
+            driver (WebDriver): The browser.
+
+        """
+        browser = { c['name'] : c['value'] for c in driver.get_cookies() }
+        for cookie in self.session.cookies:
+            if browser.get(cookie.name) != cookie.value:
+                driver.add_cookie({ 'name' : cookie.name, 'value' : cookie.value, 'path' : cookie.path or '/' })
+        return
+
+    def _load(self, response):
+        """Parses a response into `self.page`."""
+        if response.status_code != 200:
+            raise UnexpectedResponse(f"{response.request.method} {response.url} answered {response.status_code}")
+        parser = _PageParser()
+        parser.feed(response.text)
+        parser.url = response.url
+        parser.text = ' '.join(parser.text)
+        self.page = parser
+        return parser
+
+    def _form(self, description, predicate):
+        """Returns the first form of the page matching `predicate`."""
+        for form in self.page.forms:
+            if predicate(form):
+                return form
+        raise UnexpectedResponse(f"{description} not found on {self.page.url}")
+
+    def _submit(self, form, **values):
+        """Submits a form of the current page and loads the answer."""
+        action = urljoin(self.page.url, form.action or self.page.url)
+        if form.method == 'post':
+            response = self.session.post(action, data=form.data(**values), timeout=self.timeout)
+        else:
+            response = self.session.get(action, params=form.data(**values), timeout=self.timeout)
+        return self._load(response)
+
+    @logger.logging
+    def fillDeclaration(self, email, text, receiver):
+        """
+        Submits email, free text and recipient and requests the export.
+
+        Args:
+            email (str): The user's email address.
+            text (str): The main content of the declaration.
+            receiver (str): The name of the recipient of the declaration.
+
+        Raises:
+            UnexpectedResponse: If a page does not hold the expected form.
+
+        """
+        self.fileurl = None
+        self._load(self.session.get(self.url, timeout=self.timeout))
+        form = self._form("email field", lambda f: f.has(id='solemn:email'))
+        self._submit(form, **{ next( fl[0] for fl in form.fields if fl[1] == 'solemn:email' ) : email })
+        form = self._form("free text", lambda f: f.has(name='free_text'))
+        self._submit(form, free_text=text)
+        form = self._form("recipient field", lambda f: f.has(id='solemn:recipient'))
+        self._submit(form, **{ next( fl[0] for fl in form.fields if fl[1] == 'solemn:recipient' ) : receiver })
+        form = self._form("export button", lambda f: f.button('Έκδοση'))
+        self._submit(form)
+        return
+
+    @logger.logging
+    def requestCode(self):
+        """
+        Chooses the SMS channel, the portal sends the confirmation code.
+
+        Raises:
+            UnexpectedResponse: If the page does not offer the SMS channel.
+
+        """
+        form  = self._form("SMS channel", lambda f: any( 'Με αποστολή SMS' in label for label in f.labels.values() ))
+        value = next( v for v, label in form.labels.items() if 'Με αποστολή SMS' in label )
+        name  = next( fl[0] for fl in form.fields if fl[2] == 'radio' and fl[3] == value )
+        self._submit(form, **{ name : value })
+        self._form("confirmation code field", lambda f: f.has(id='confirmation_code'))
+        return
+
+    @logger.logging
+    def sendCode(self, code):
+        """
+        Submits the confirmation code and finds the link of the document.
+
+        Args:
+            code (str): The verification code received via SMS.
+
+        Returns:
+            str: The URL of the PDF document.
+
+        Raises:
+            Exception: If the portal rejects the code.
+            UnexpectedResponse: If the page holds neither an error nor the document link.
+
+        """
+        form = self._form("confirmation code field", lambda f: f.has(id='confirmation_code'))
+        name = next( fl[0] for fl in form.fields if fl[1] == 'confirmation_code' )
+        self._submit(form, **{ name : code })
+        if WRONG_CODE in self.page.text:
+            raise Exception("wrong SMS code used")
+        link = next( (l for l in self.page.links if 'pdf-download' in l), None )
+        if link is None:
+            raise UnexpectedResponse(f"document link not found on {self.page.url}")
+        self.fileurl = urljoin(self.page.url, link)
+        return self.fileurl
+
+    @logger.logging
+    def close(self):
+        """Closes the pooled connections."""
+        self.session.close()
+        return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    import mockPortal
+    import smsSources
+
+    parser = argparse.ArgumentParser(
+          prog='httpDeclaration'
+        , description="issues declarations over HTTP against the local mock portal"
+        )
+    parser.add_argument('-n', dest='n', default=3, type=int, help="number of declarations.")
+    args = vars(parser.parse_args())
+
+    source = smsSources.PushSMSSource(timeout=10)
+    with mockPortal.MockPortal(source.push, port=0, sms_delay=0.05) as portal:
+        engine = HttpDeclaration(portal.url)
+        # log in like the browser does, the engine only takes over the session
+        engine._load(engine.session.get(portal.url))
+        engine._submit(engine._form("login", lambda f: f.button('Σύνδεση')))
+        engine._submit(engine._form("taxisnet", lambda f: f.button('ΓΓΠΣΨΔ')))
+        engine._submit(engine._form("credentials", lambda f: f.has(id='j_username')), j_username='user', j_password='secret')
+        engine._submit(engine._form("consent", lambda f: f.button('Αποστολή')), consent='on')
+        engine._submit(engine._form("tax id", lambda f: f.button('Συνέχεια')))
+        for n in range(args['n']):
+            engine.fillDeclaration('me@example.com', f"declaration {n}", 'ΔΟΥ')
+            with source.exclusive():
+                engine.requestCode()
+                url = engine.sendCode(source.wait_for_sms_code())
+            print(n, url, len(engine.session.get(url).content), "bytes")
+        engine.close()
+        print(portal.stats())
+    source.close()
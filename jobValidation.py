@@ -0,0 +1,232 @@
+# -*- coding: utf-8 -*-
+"""
+This module checks the declaration jobs before any browser is started.
+
+A job the portal will refuse, e.g. an empty cell, a text over the length limit
+or a folder name the file system does not accept, would otherwise only fail
+after a browser start, a login and maybe an SMS request have been spent on it.
+A `JobValidator` applies a set of rules to every job of the CSV file in one
+pass over the file. Receivers and folders are checked once per column and
+once per distinct name, the texts with precompiled patterns, so a file of
+100k cells is checked in about a second.
+
+The rules are:
+
+- `text_empty`: the text is empty or blank,
+- `text_length`: the text is longer than the portal accepts,
+- `text_characters`: the text holds control characters or the replacement
+  character of a broken encoding,
+- `receiver`: the receiver is blank, too long, has no letter, holds control
+  characters or names more than one column,
+- `folder`: the folder is not a safe directory name.
+
+"""
+
+
+import re
+import pathlib
+import argparse
+from loguru import logger as lg
+import logger
+import declarationJobs
+import outputNaming
+import statusJournal
+
+#%% defaults
+
+VALIDATION_DEFAULTS = {
+          'max_text'     : 4000 # characters of the free text of a declaration
+        , 'max_receiver' : 200
+        , 'max_folder'   : 100
+    }
+
+#%% constants
+
+RULES = ( 'text_empty', 'text_length', 'text_characters', 'receiver', 'folder' )
+CONTROL  = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f\x7f\ufffd]')
+LETTER   = re.compile(r'[^\W\d_]')
+RESERVED = re.compile(r'(con|prn|aux|nul|com\d|lpt\d)(\..*)?', re.IGNORECASE) # device names on Windows
+
+#%% logic
+
+class JobValidator:
+    """
+    Checks declaration jobs against a set of rules.
+
+    """
+
+    @logger.logging
+    def __init__(  self, rules=RULES, max_text=VALIDATION_DEFAULTS['max_text']
+                 , max_receiver=VALIDATION_DEFAULTS['max_receiver'], max_folder=VALIDATION_DEFAULTS['max_folder']):
+        """
+        Initializes the JobValidator instance.
+
+        Args:
+            rules (iterable, optional): The names of the rules to apply, see `RULES`.
+                Defaults to all rules.
+            max_text (int, optional): Characters a text may have. Defaults to 4000.
+            max_receiver (int, optional): Characters a receiver may have. Defaults to 200.
+            max_folder (int, optional): Characters a folder name may have. Defaults to 100.
+
+        Raises:
+            ValueError: If a rule is unknown.
+
+        """
+        unknown = set(rules) - set(RULES)
+        if unknown:
+            raise ValueError(f"unknown validation rules {', '.join(sorted(unknown))}, known are {', '.join(RULES)}")
+        self.rules        = set(rules)
+        self.max_text     = max_text
+        self.max_receiver = max_receiver
+        self.max_folder   = max_folder
+        self.receivers    = dict() # receiver -> problem or None
+        self.duplicates   = dict() # column index -> receiver named by an earlier column
+        self.folders      = dict() # folder -> problem or None
+        return
+
+    @logger.logging
+    def header(self, header):
+        """
+        Checks the header row of the CSV file and the receivers it names.
+
+        Args:
+            header (list): The column names.
+
+        Raises:
+            Exception: If the header is missing or names no receiver.
+
+        """
+        receivers = [ (i, name) for i, name in enumerate(header) if name != declarationJobs.JOB_DEFAULTS['folder_column'] ]
+        if not receivers:
+            raise Exception("the csv file has no header row with receivers")
+        seen = set()
+        for receiver_index, receiver in receivers:
+            if receiver in seen:
+                self.duplicates[receiver_index] = receiver
+            seen.add(receiver)
+        return
+
+    def _receiver(self, receiver):
+        """Returns why a receiver is refused, None if it is valid."""
+        if not receiver in self.receivers:
+            self.receivers[receiver] = self._checkReceiver(receiver)
+        return self.receivers[receiver]
+
+    def _checkReceiver(self, receiver):
+        """Checks a receiver name, see `_receiver`."""
+        if not receiver.strip():
+            return "the receiver is blank"
+        if len(receiver) > self.max_receiver:
+            return f"the receiver has {len(receiver)} characters, at most {self.max_receiver} are allowed"
+        if LETTER.search(receiver) is None:
+            return f"the receiver {receiver!r} has no letter"
+        if not CONTROL.search(receiver) is None:
+            return f"the receiver {receiver!r} holds control characters"
+        return None
+
+    def _folder(self, folder):
+        """Returns why a folder is refused, None if it is valid."""
+        if folder in self.folders:
+            return self.folders[folder]
+        problem = None
+        if not outputNaming.UNSAFE.search(folder) is None or folder != folder.strip(' .'):
+            problem = f"the folder {folder!r} is no safe directory name"
+        elif len(folder) > self.max_folder:
+            problem = f"the folder has {len(folder)} characters, at most {self.max_folder} are allowed"
+        elif not RESERVED.fullmatch(folder) is None:
+            problem = f"the folder {folder!r} is a reserved device name"
+        self.folders[folder] = problem
+        return problem
+
+    def check(self, job):
+        """
+        Checks a job.
+
+        Args:
+            job (dict): The job, see `declarationJobs.readJobs`. Only `text` and
+                `receiver` are required.
+
+        Returns:
+            list: The `(rule, reason)` of every rule the job breaks, empty if it is valid.
+
+        """
+        problems = list()
+        text = job['text']
+        if 'text_empty' in self.rules and not text.strip():
+            problems.append( ('text_empty', "the text is empty") )
+        if 'text_length' in self.rules and len(text) > self.max_text:
+            problems.append( ('text_length', f"the text has {len(text)} characters, at most {self.max_text} are allowed") )
+        if 'text_characters' in self.rules and not CONTROL.search(text) is None:
+            problems.append( ('text_characters', "the text holds control characters or a broken encoding") )
+        if 'receiver' in self.rules:
+            problem = self._receiver(job['receiver'])
+            if problem is None and job.get('receiver_index') in self.duplicates:
+                problem = f"the receiver {job['receiver']!r} names more than one column"
+            if not problem is None:
+                problems.append( ('receiver', problem) )
+        if 'folder' in self.rules and job.get('folder'):
+            problem = self._folder(job['folder'])
+            if not problem is None:
+                problems.append( ('folder', problem) )
+        return problems
+
+
+@logger.logging
+def validate(csv_file, validator, sep=declarationJobs.JOB_DEFAULTS['csv_sep']):
+    """
+    Checks all jobs of a CSV file.
+
+    Args:
+        csv_file (str): Path to the CSV file.
+        validator (JobValidator): The rules.
+        sep (str, optional): The CSV separator. Defaults to ';'.
+
+    Returns:
+        tuple: The number of jobs and the rejected jobs, a list of records with
+               `idx`, `receiver_index`, `receiver`, `key`, `rules` and `reason`.
+
+    Raises:
+        Exception: If the header is missing or names no receiver.
+
+    """
+    validator.header(declarationJobs.readHeader(csv_file, sep=sep))
+    count    = 0
+    rejected = list()
+    for job in declarationJobs.readJobs(csv_file, sep=sep):
+        count += 1
+        problems = validator.check(job)
+        if problems:
+            rejected.append({ 'idx'            : job['idx']
+                            , 'receiver_index' : job['receiver_index']
+                            , 'receiver'       : job['receiver']
+                            , 'key'            : job['key']
+                            , 'rules'          : ', '.join( rule for rule, _ in problems )
+                            , 'reason'         : '; '.join( reason for _, reason in problems ) })
+    lg.info(f"{csv_file}: {count - len(rejected)} of {count} declarations valid")
+    return count, rejected
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='jobValidation'
+        , description="checks the declarations of a bulkDeclare csv file without starting a browser"
+        )
+    parser.add_argument('--csv', dest='csv', default=None, required=True)
+    parser.add_argument('--csv-sep', dest='csv_sep', default=declarationJobs.JOB_DEFAULTS['csv_sep'], required=False)
+    parser.add_argument('--rules', dest='rules', default=list(RULES), nargs='*', choices=RULES, required=False)
+    parser.add_argument('--max-text-length', dest='max_text', default=VALIDATION_DEFAULTS['max_text'], type=int, required=False)
+    parser.add_argument('--report', dest='report', default=None, required=False, help="HTML file to write the rejected declarations to.")
+    args = vars(parser.parse_args())
+
+    count, rejected = validate(  pathlib.Path(args['csv'])
+                               , JobValidator(args['rules'], max_text=args['max_text'])
+                               , sep=args['csv_sep'] )
+    for record in rejected:
+        print(f"{record['idx']}/{record['receiver_index']} {record['receiver']}: {record['reason']}")
+    print(f"{count - len(rejected)} of {count} declarations valid")
+    if not args['report'] is None:
+        statusJournal.renderHtml(rejected, args['report'])
+    raise SystemExit(1 if rejected else 0)
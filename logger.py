@@ -10,23 +10,124 @@ from loguru import logger
 import pathlib
 from datetime import datetime as dt 
 import sys
+import inspect
+import random
+import reprlib
 
 #%% constants
 LOG_DIR = pathlib.Path('logs')
 LOGFORMAT = "{time} | {level} | {message}"
 
+TRACE_DEFAULTS = {
+          'sample' : 1.0
+        , 'redact' : ['password', 'pwd', 'secret', 'token']
+    }
+
+#%% state
+
+class _Tracing:
+    """
+    The settings of the `logging` decorator, changed by `configureTracing`.
+
+    Tracing is off until `initLogging` enables it for the TRACE level, so a
+    decorated call only costs one attribute lookup and a branch.
+
+    """
+    enabled = False
+    sample  = TRACE_DEFAULTS['sample']
+    redact  = frozenset(TRACE_DEFAULTS['redact'])
+    repr    = reprlib.Repr()
+    repr.maxstring = 60
+    repr.maxother  = 60
+
 #%% logic
 
+def configureTracing(enabled, sample=TRACE_DEFAULTS['sample'], redact=TRACE_DEFAULTS['redact']):
+    """
+    Configures the call tracing of the `logging` decorator.
+
+    Args:
+        enabled (bool): Trace the calls of decorated functions.
+        sample (float, optional): Share of the calls to trace, between 0.0 and 1.0.
+            Defaults to 1.0.
+        redact (list, optional): Terms of argument names whose values are never
+            written to the log, e.g. `token` also masks `service_token`. Defaults
+            to password, pwd, secret and token.
+
+    """
+    _Tracing.enabled = bool(enabled) and sample > 0
+    _Tracing.sample  = sample
+    _Tracing.redact  = frozenset( name.lower() for name in redact )
+    return
+
+
+def _secret(name):
+    """Returns True if a name contains a term of the redact list."""
+    name = str(name).lower()
+    return any( term in name for term in _Tracing.redact )
+
+
+def redacted(value):
+    """
+    Returns a value safe to be logged.
+
+    Dictionaries, e.g. the command-line arguments, are copied with the values of
+    all keys containing a term of the redact list masked, other values are
+    returned unchanged.
+
+    Args:
+        value (object): The value to log.
+
+    Returns:
+        object: The redacted value.
+
+    """
+    if isinstance(value, dict):
+        return { k : '***' if _secret(k) else v for k, v in value.items() }
+    return value
+
+
+def _formatArguments(names, args, kw):
+    """
+    Formats the arguments of a traced call, redacted and shortened.
+
+    Args:
+        names (list): The parameter names of the function.
+        args (tuple): The positional arguments.
+        kw (dict): The keyword arguments.
+
+    Returns:
+        str: The formatted arguments.
+
+    """
+    named = [ (names[n] if n < len(names) else f"*{n}", value) for n, value in enumerate(args) ] + list(kw.items())
+    return ', '.join( f"{name}=***" if _secret(name) else f"{name}={_Tracing.repr.repr(redacted(value))}" 
+                      for name, value in named )
+
+
 def logging(f):
+    """
+    Traces entering and leaving of the decorated function at TRACE level.
+
+    The arguments are only formatted if the call is traced, arguments whose name
+    contains a term of the redact list are masked and long values are shortened.
+
+    """
+    try:
+        names = list(inspect.signature(f).parameters)
+    except (TypeError, ValueError):
+        names = list()
+
     @wraps(f)
     def wrap(*args, **kw):
-        logger.trace("enter: %r args[%r, %r]" % \
-          (f.__name__, args, kw))
-            
+        if not _Tracing.enabled or (_Tracing.sample < 1.0 and random.random() >= _Tracing.sample):
+            return f(*args, **kw)
+
+        logger.opt(lazy=True).trace("enter: {} args[{}]", lambda: f.__name__, lambda: _formatArguments(names, args, kw))
+
         result = f(*args, **kw)
 
-        logger.trace("exit: %r" % \
-          (f.__name__))
+        logger.trace("exit: {}", f.__name__)
         return result
     return wrap
 
@@ -44,3 +145,6 @@ def initLogging(args : dict):
     logger.add(sys.stderr, format=LOGFORMAT, level="ERROR", colorize=True)
     logger.add(sys.stdout, format=LOGFORMAT, level="INFO", colorize=True)
     
+    configureTracing(  enabled = args.get('log_level', 'CRITICAL') == 'TRACE'
+                     , sample  = args.get('trace_sample', TRACE_DEFAULTS['sample'])
+                     , redact  = TRACE_DEFAULTS['redact'] + list(args.get('trace_redact', None) or []) )
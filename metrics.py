@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+This module summarizes the span timings of the declarations of a bulk run.
+
+Every gsisGrabber records the wall time of each step of a declaration in its
+`stages`, bulkDeclare stores them as `<span>_sec` columns of the status
+records. Top level spans (`browser`, `login`, `form`, `sms_wait`, `sms`,
+`download`) cover the whole declaration, dotted spans (e.g. `login.authentificate`)
+are the steps inside them. The summary holds count, sum and p50/p95/p99 per
+span and is exported as JSON and as Prometheus textfile, to be picked up by the
+textfile collector of the node exporter.
+
+"""
+
+
+import os
+import json
+import pathlib
+import argparse
+from loguru import logger as lg
+import logger
+
+#%% constants
+
+SPAN_SUFFIX = '_sec'
+QUANTILES = (50, 95, 99)
+PROMETHEUS_METRIC = 'gsis_declaration_span_seconds'
+
+#%% logic
+
+def percentile(ordered, p):
+    """
+    Returns the nearest-rank percentile of sorted samples.
+
+    Args:
+        ordered (list): The samples in ascending order, not empty.
+        p (float): The percentile between 0 and 100.
+
+    Returns:
+        float: The percentile.
+
+    """
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+
+@logger.logging
+def spans(record):
+    """
+    Returns the span timings of a status record.
+
+    Args:
+        record (dict): The status record with `<span>_sec` columns.
+
+    Returns:
+        dict: The durations in seconds, indexed by the span name.
+
+    """
+    return { key[:-len(SPAN_SUFFIX)] : value for key, value in record.items()
+             if key.endswith(SPAN_SUFFIX) and isinstance(value, (int, float)) }
+
+
+@logger.logging
+def summarize(records):
+    """
+    Summarizes the span timings of status records.
+
+    Args:
+        records (iterable): The status records.
+
+    Returns:
+        dict: Per span name its `count`, `sum` and the quantiles `p50`, `p95` and
+              `p99` in seconds.
+
+    """
+    samples = dict()
+    for record in records:
+        for name, duration in spans(record).items():
+            samples.setdefault(name, list()).append(duration)
+
+    summary = dict()
+    for name, durations in sorted(samples.items()):
+        durations.sort()
+        summary[name] = { 'count' : len(durations), 'sum' : sum(durations) }
+        summary[name].update({ f"p{q}" : percentile(durations, q) for q in QUANTILES })
+    return summary
+
+
+def _replace(dest, content):
+    """Writes a file next to `dest` and renames it, readers never see a partial file."""
+    dest = pathlib.Path(dest)
+    tmp  = dest.with_name(dest.name + '.tmp')
+    tmp.write_text(content, encoding='utf-8')
+    os.replace(tmp, dest)
+    return
+
+
+@logger.logging
+def writeJson(summary, dest, **extra):
+    """
+    Writes the summary as JSON file.
+
+    Args:
+        summary (dict): The summary, see `summarize`.
+        dest (str): Path of the JSON file.
+        **extra: Further top level entries, e.g. the stage occupancy.
+
+    """
+    _replace(dest, json.dumps(dict(extra, spans=summary), indent=2, ensure_ascii=False))
+    lg.success(f"{dest} written")
+    return
+
+
+@logger.logging
+def writePrometheus(summary, dest):
+    """
+    Writes the summary in the Prometheus text exposition format.
+
+    Args:
+        summary (dict): The summary, see `summarize`.
+        dest (str): Path of the textfile, it should end with `.prom`.
+
+    """
+    lines = [ f"# HELP {PROMETHEUS_METRIC} Wall time of the steps of a gov.gr declaration."
+            , f"# TYPE {PROMETHEUS_METRIC} summary" ]
+    for name, s in summary.items():
+        for q in QUANTILES:
+            lines.append(f'{PROMETHEUS_METRIC}{{span="{name}",quantile="{q / 100}"}} {s[f"p{q}"]:.6f}')
+        lines.append(f'{PROMETHEUS_METRIC}_sum{{span="{name}"}} {s["sum"]:.6f}')
+        lines.append(f'{PROMETHEUS_METRIC}_count{{span="{name}"}} {s["count"]}')
+    _replace(dest, '\n'.join(lines) + '\n')
+    lg.success(f"{dest} written")
+    return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    import statusJournal
+
+    parser = argparse.ArgumentParser(
+          prog='metrics'
+        , description="summarizes the span timings of a bulkDeclare journal"
+        )
+    parser.add_argument('--journal', dest='journal', default=None, required=True)
+    parser.add_argument('--json', dest='json', default=None, required=False)
+    parser.add_argument('--prom', dest='prom', default=None, required=False)
+    args = vars(parser.parse_args())
+
+    summary = summarize(statusJournal.StatusJournal.read(args['journal']))
+    for name, s in summary.items():
+        print(f"{name:<28} n={s['count']:<6} p50={s['p50']:8.3f}s p95={s['p95']:8.3f}s p99={s['p99']:8.3f}s")
+    if not args['json'] is None:
+        writeJson(summary, args['json'])
+    if not args['prom'] is None:
+        writePrometheus(summary, args['prom'])
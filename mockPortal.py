@@ -0,0 +1,594 @@
+# -*- coding: utf-8 -*-
+"""
+This module runs a local stand-in of the gov.gr declaration portal.
+
+It serves the page flow and the elements gsisGrabber relies on, the cookie
+banner, the Taxisnet login, the confirmation of the tax id, the form steps
+(email, free text, recipient, export), the SMS confirmation and the PDF
+download. Every step can be slowed down by a latency and fail with a given
+probability, so the bulk declaration can be exercised and benchmarked without
+the real portal and without a phone:
+
+    python mockPortal.py --port 8780 --sms-webhook http://127.0.0.1:8765/
+    python bulkDeclare.py ... --url http://127.0.0.1:8780/templates/YPDIL/create --sms-source webhook
+
+The SMS with the confirmation code is handed to a sender, a function taking the
+SMS text. `webhookSender` POSTs it to the webhook of a `WebhookSMSSource`,
+`fileSender` appends it to the file of a `FileSMSSource` and in-process the
+`push` of any `smsSources.PushSMSSource` can be used directly.
+
+Steps are named after the page they serve: `create`, `login`, `taxisnet`,
+`consent`, `profile`, `email`, `text`, `recipient`, `export`, `sms`, `confirm`
+and `pdf`, `sms_delivery` is the delivery of the SMS and `pdf_transfer` the
+body of the PDF. A failing step answers with an error page, a failing `confirm`
+rejects the code, a failing `sms_delivery` drops the SMS and a failing
+`pdf_transfer` breaks the connection in the middle of the PDF. The PDF is served
+with support for `Range` requests.
+
+"""
+
+
+import re
+import html
+import json
+import time
+import random
+import secrets
+import argparse
+import threading
+import urllib.request
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+PORTAL_DEFAULTS = {
+          'host'        : '127.0.0.1'
+        , 'port'        : 8780
+        , 'taxid'       : '123456789'
+        , 'latency'     : 0.0
+        , 'sms_delay'   : 0.5
+        , 'session_ttl' : None
+        , 'pdf_size'    : 20000
+    }
+
+#%% constants
+
+BASE = '/templates/YPDIL/create'
+SESSION_COOKIE = 'mock_session'
+STEPS = ( 'create', 'login', 'taxisnet', 'consent', 'profile', 'email', 'text', 'recipient'
+        , 'export', 'sms', 'confirm', 'pdf', 'sms_delivery', 'pdf_transfer' )
+SMS_TEMPLATE = "GOVGR\n{code} ΚΩΔΙΚΟΣ ΓΙΑ ΕΚΔΟΣΗ ΥΠΕΥΘΥΝΗΣ ΔΗΛΩΣΗΣ\nΜη τον κοινοποιήσετε"
+
+PAGE = """<!DOCTYPE html>
+<html lang="el"><head><meta charset="utf-8"><title>{title}</title></head>
+<body>{banner}<main><h1>{title}</h1>{body}</main></body></html>"""
+
+COOKIE_BANNER = """<div id="cookies"><p>Χρησιμοποιούμε cookies.</p>
+<button type="button" onclick="document.cookie='cookies_accepted=1; path=/'; document.getElementById('cookies').remove();">Ενημερώθηκα</button></div>"""
+
+#%% logic
+
+def webhookSender(url, token=None):
+    """
+    Returns a sender that POSTs the SMS text to the webhook of a WebhookSMSSource.
+
+    Args:
+        url (str): The URL of the webhook.
+        token (str, optional): The shared secret of the webhook. Defaults to None.
+
+    Returns:
+        function: The sender, taking the SMS text.
+
+    """
+    def send(text):
+        request = urllib.request.Request(  url, data=text.encode('utf-8'), method='POST'
+                                         , headers={ 'Content-Type' : 'text/plain; charset=utf-8'
+                                                   , **({ 'X-Token' : token } if token else {}) })
+        try:
+            urllib.request.urlopen(request, timeout=5).close()
+        except Exception as e:
+            lg.warning(f"SMS not delivered to {url}: {e}")
+    return send
+
+
+def fileSender(path):
+    """
+    Returns a sender that appends the SMS text as one line to a file or named pipe.
+
+    Args:
+        path (str): The file followed by a FileSMSSource.
+
+    Returns:
+        function: The sender, taking the SMS text.
+
+    """
+    lock = threading.Lock()
+    def send(text):
+        with lock, open(path, 'a', encoding='utf-8') as f:
+            f.write(text.replace('\n', ' ') + '\n')
+    return send
+
+
+def minimalPdf(title, size=PORTAL_DEFAULTS['pdf_size']):
+    """
+    Returns a valid one page PDF, padded with comments to about `size` bytes.
+
+    Args:
+        title (str): The text of the page, only ASCII characters are shown.
+        size (int, optional): The approximate size of the file in bytes.
+
+    Returns:
+        bytes: The PDF document.
+
+    """
+    text    = title.encode('ascii', errors='replace').decode('ascii').replace('\\', '').replace('(', '').replace(')', '')
+    stream  = f"BT /F1 12 Tf 72 720 Td ({text}) Tj ET".encode('ascii')
+    objects = [ b"<< /Type /Catalog /Pages 2 0 R >>"
+              , b"<< /Type /Pages /Kids [3 0 R] /Count 1 >>"
+              , b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 792] /Contents 4 0 R /Resources << /Font << /F1 5 0 R >> >> >>"
+              , b"<< /Length %d >>\nstream\n" % len(stream) + stream + b"\nendstream"
+              , b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>" ]
+    out     = bytearray(b"%PDF-1.4\n")
+    padding = max(0, size - 700)
+    while padding > 0:
+        line = b"%" + b"x" * min(78, padding) + b"\n"
+        out += line
+        padding -= len(line)
+    offsets = list()
+    for n, obj in enumerate(objects, 1):
+        offsets.append(len(out))
+        out += b"%d 0 obj\n" % n + obj + b"\nendobj\n"
+    xref = len(out)
+    out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    out += b"".join( b"%010d 00000 n \n" % o for o in offsets )
+    out += b"trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (len(objects) + 1, xref)
+    return bytes(out)
+
+
+class _PortalHandler(BaseHTTPRequestHandler):
+    """Serves the pages of the `MockPortal` of the server."""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True # headers and body are written separately
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        portal  = self.server.portal
+        path    = urlparse(self.path).path.rstrip('/') or '/'
+        form    = dict()
+        if method == 'POST':
+            body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+            form = { k : v[0] for k, v in parse_qs(body, keep_blank_values=True).items() }
+
+        if path == '/_stats':
+            return self._send(200, json.dumps(portal.stats()), content_type='application/json')
+        if path.startswith('/pdf-download/'):
+            step = 'pdf'
+        else:
+            step = portal.ROUTES.get( (method, path), (None, None) )[0]
+        if step is None:
+            return self._send(404, portal.page("Δεν βρέθηκε", "<p>Η σελίδα δεν υπάρχει.</p>"))
+
+        portal.count(step)
+        portal.delay(step)
+        if step != 'confirm' and portal.fails(step):
+            return self._send(503, portal.page("Σφάλμα", "<p>Η υπηρεσία δεν είναι προσωρινά διαθέσιμη.</p>"))
+
+        if step == 'pdf':
+            return self._pdf(path.rsplit('/', 1)[-1])
+        session = self._session()
+        handler = getattr(portal, portal.ROUTES[(method, path)][1])
+        status, content, location = handler(session, form, self._cookies())
+        if not location is None:
+            self.send_response(303)
+            self.send_header('Location', location)
+            self.send_header('Content-Length', '0')
+            self._setCookie(session)
+            self.end_headers()
+            return
+        return self._send(status, content, session)
+
+    def _pdf(self, token):
+        document = self.server.portal.documents.get(token)
+        if document is None:
+            return self._send(404, self.server.portal.page("Δεν βρέθηκε", "<p>Το έγγραφο δεν υπάρχει.</p>"))
+        start = 0
+        match = re.fullmatch(r"bytes=(\d+)-", self.headers.get('Range', ''))
+        if not match is None:
+            start = int(match.group(1))
+            if start >= len(document):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(document)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return
+        body = document[start:]
+        self.send_response(200 if match is None else 206)
+        self.send_header('Content-Type', 'application/pdf')
+        self.send_header('Accept-Ranges', 'bytes')
+        self.send_header('Content-Length', str(len(body)))
+        if not match is None:
+            self.send_header('Content-Range', f"bytes {start}-{len(document) - 1}/{len(document)}")
+        self.end_headers()
+        if self.server.portal.fails('pdf_transfer'):
+            self.server.portal.count('pdf_transfer')
+            self.wfile.write(body[:len(body) // 2])
+            self.close_connection = True
+            return
+        self.wfile.write(body)
+        return
+
+    def _cookies(self):
+        cookies = dict()
+        for part in self.headers.get('Cookie', '').split(';'):
+            name, _, value = part.strip().partition('=')
+            if name:
+                cookies[name] = value
+        return cookies
+
+    def _session(self):
+        return self.server.portal.session(self._cookies().get(SESSION_COOKIE))
+
+    def _setCookie(self, session):
+        if not session is None:
+            self.send_header('Set-Cookie', f"{SESSION_COOKIE}={session['id']}; Path=/; HttpOnly")
+
+    def _send(self, status, content, session=None, content_type='text/html; charset=utf-8'):
+        body = content.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self._setCookie(session)
+        self.end_headers()
+        self.wfile.write(body)
+        return
+
+    def log_message(self, format, *args):
+        lg.trace("mock portal: " + format % args)
+
+
+class MockPortal:
+    """
+    A local stand-in of the gov.gr declaration portal.
+
+    The portal runs in a background thread. Sessions are kept in memory and
+    identified by a cookie, a session is authenticated after the Taxisnet login
+    and the confirmation of the tax id. Issued documents are downloadable
+    without a session by their token, like the links of the real portal.
+
+    """
+
+    # (method, path) -> (step, handler)
+    ROUTES = { ('GET',  BASE)                  : ('create',    '_create')
+             , ('GET',  '/login')              : ('login',     '_loginPage')
+             , ('GET',  '/oauth/login')        : ('taxisnet',  '_taxisnetPage')
+             , ('POST', '/oauth/login')        : ('taxisnet',  '_taxisnet')
+             , ('GET',  '/oauth/consent')      : ('consent',   '_consentPage')
+             , ('POST', '/oauth/consent')      : ('consent',   '_consent')
+             , ('GET',  '/profile')            : ('profile',   '_profilePage')
+             , ('POST', '/profile')            : ('profile',   '_profile')
+             , ('POST', BASE + '/email')       : ('email',     '_email')
+             , ('GET',  BASE + '/text')        : ('text',      '_textPage')
+             , ('POST', BASE + '/text')        : ('text',      '_text')
+             , ('GET',  BASE + '/recipient')   : ('recipient', '_recipientPage')
+             , ('POST', BASE + '/recipient')   : ('recipient', '_recipient')
+             , ('GET',  BASE + '/preview')     : ('export',    '_previewPage')
+             , ('POST', BASE + '/preview')     : ('export',    '_export')
+             , ('GET',  BASE + '/sms')         : ('sms',       '_smsPage')
+             , ('POST', BASE + '/sms')         : ('sms',       '_sms')
+             , ('GET',  BASE + '/confirm')     : ('confirm',   '_confirmPage')
+             , ('POST', BASE + '/confirm')     : ('confirm',   '_confirm')
+             , ('GET',  BASE + '/document')    : ('confirm',   '_documentPage') }
+
+    @logger.logging
+    def __init__(  self, sms, host=PORTAL_DEFAULTS['host'], port=PORTAL_DEFAULTS['port']
+                 , taxid=PORTAL_DEFAULTS['taxid'], latency=None, failures=None
+                 , sms_delay=PORTAL_DEFAULTS['sms_delay'], session_ttl=PORTAL_DEFAULTS['session_ttl']
+                 , pdf_size=PORTAL_DEFAULTS['pdf_size'], seed=None):
+        """
+        Initializes the MockPortal instance and starts serving.
+
+        Args:
+            sms (function): The sender of the SMS text, see `webhookSender`.
+            host (str, optional): The interface to listen on. Defaults to '127.0.0.1'.
+            port (int, optional): The port to listen on, 0 picks a free one. Defaults to 8780.
+            taxid (str, optional): The tax id shown after the login. Defaults to '123456789'.
+            latency (dict, optional): Seconds to wait before answering, per step. The
+                key '*' is the default of all steps. Defaults to None, no latency.
+            failures (dict, optional): Probability between 0.0 and 1.0 that a step
+                fails, per step, the key '*' is the default. Defaults to None.
+            sms_delay (float, optional): Seconds between the request of the SMS and its
+                delivery. Defaults to 0.5.
+            session_ttl (float, optional): Seconds an authenticated session stays valid.
+                Defaults to None, forever.
+            pdf_size (int, optional): Size of the issued PDF documents in bytes.
+                Defaults to 20000.
+            seed (int, optional): Seed of the failure injection. Defaults to None.
+
+        """
+        self.sms         = sms
+        self.taxid       = str(taxid)
+        self.latency     = dict(latency or {})
+        self.failures    = dict(failures or {})
+        self.sms_delay   = sms_delay
+        self.session_ttl = session_ttl
+        self.pdf_size    = pdf_size
+        self.random      = random.Random(seed)
+        self.lock        = threading.Lock()
+        self.sessions    = dict()
+        self.documents   = dict()
+        self.requests    = { step : 0 for step in STEPS }
+        self.issued      = 0
+        self.server = ThreadingHTTPServer((host, port), _PortalHandler)
+        self.server.daemon_threads = True
+        self.server.portal = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="mock-portal", daemon=True)
+        self.thread.start()
+        lg.info(f"mock portal listening on {self.url}")
+        return
+
+    @property
+    def url(self):
+        """The URL of the create page, to be passed as `url` to gsisGrabber."""
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}{BASE}"
+
+    @logger.logging
+    def close(self):
+        """Stops serving."""
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    #%% injection
+
+    def count(self, step):
+        """Counts a request of a step."""
+        with self.lock:
+            self.requests[step] = self.requests.get(step, 0) + 1
+
+    def delay(self, step):
+        """Waits the latency configured for a step."""
+        seconds = self.latency.get(step, self.latency.get('*', PORTAL_DEFAULTS['latency']))
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def fails(self, step):
+        """Tells whether the step fails this time."""
+        probability = self.failures.get(step, self.failures.get('*', 0.0))
+        if probability <= 0:
+            return False
+        with self.lock:
+            return self.random.random() < probability
+
+    #%% sessions
+
+    def session(self, sid):
+        """Returns the session of a session id, a new one if it is unknown."""
+        with self.lock:
+            session = self.sessions.get(sid)
+            if session is None:
+                sid = secrets.token_hex(16)
+                session = self.sessions[sid] = { 'id' : sid, 'authenticated' : None, 'declaration' : dict() }
+            if not session['authenticated'] is None and not self.session_ttl is None \
+               and time.monotonic() - session['authenticated'] > self.session_ttl:
+                session['authenticated'] = None
+            return session
+
+    def page(self, title, body, banner=''):
+        """Renders a page."""
+        return PAGE.format(title=html.escape(title), body=body, banner=banner)
+
+    def _form(self, action, fields, button, method='post'):
+        return f'<form method="{method}" action="{action}">{fields}<button type="submit">{button}</button></form>'
+
+    def _guard(self, session):
+        """Redirects sessions that are not logged in back to the start page."""
+        return None if session['authenticated'] else (200, None, BASE)
+
+    #%% login
+
+    def _create(self, session, form, cookies):
+        if session['authenticated']:
+            session['declaration'] = dict()
+            fields = '<label for="solemn:email">Email</label><input id="solemn:email" name="email" type="email">'
+            return 200, self.page("Υπεύθυνη δήλωση", self._form(BASE + '/email', fields, 'Συνέχεια')), None
+        banner = '' if cookies.get('cookies_accepted') else COOKIE_BANNER
+        return 200, self.page("Υπεύθυνη δήλωση", self._form('/login', '', 'Σύνδεση', 'get'), banner), None
+
+    def _loginPage(self, session, form, cookies):
+        return 200, self.page("Σύνδεση", self._form('/oauth/login', '', 'Σύνδεση μέσω ΓΓΠΣΨΔ', 'get')), None
+
+    def _taxisnetPage(self, session, form, cookies):
+        fields = ( '<input id="j_username" name="j_username">'
+                   '<input id="j_password" name="j_password" type="password">' )
+        body = f'<form method="post" action="/oauth/login">{fields}<button id="btn-login-submit" type="submit">Σύνδεση</button></form>'
+        return 200, self.page("Taxisnet", body), None
+
+    def _taxisnet(self, session, form, cookies):
+        if not form.get('j_username') or not form.get('j_password'):
+            return 200, None, '/oauth/login'
+        return 200, None, '/oauth/consent'
+
+    def _consentPage(self, session, form, cookies):
+        fields = '<label><input type="checkbox" name="consent" required><span>Συνέχεια με τα στοιχεία Taxisnet</span></label>'
+        return 200, self.page("Εξουσιοδότηση", self._form('/oauth/consent', fields, 'Αποστολή')), None
+
+    def _consent(self, session, form, cookies):
+        return 200, None, '/profile'
+
+    def _profilePage(self, session, form, cookies):
+        user = f'<div data-testid="user"><dl><dt><span>Α.Φ.Μ.</span></dt><dd>{html.escape(self.taxid)}</dd></dl></div>'
+        return 200, self.page("Τα στοιχεία σας", user + self._form('/profile', '', 'Συνέχεια')), None
+
+    def _profile(self, session, form, cookies):
+        session['authenticated'] = time.monotonic()
+        return 200, None, BASE
+
+    #%% declaration
+
+    def _email(self, session, form, cookies):
+        session['declaration']['email'] = form.get('email', '')
+        return self._guard(session) or (200, None, BASE + '/text')
+
+    def _textPage(self, session, form, cookies):
+        fields = '<textarea name="free_text" rows="10" cols="80"></textarea>'
+        return self._guard(session) or (200, self.page("Κείμενο δήλωσης", self._form(BASE + '/text', fields, 'Συνέχεια')), None)
+
+    def _text(self, session, form, cookies):
+        session['declaration']['text'] = form.get('free_text', '')
+        return self._guard(session) or (200, None, BASE + '/recipient')
+
+    def _recipientPage(self, session, form, cookies):
+        fields = '<label for="solemn:recipient">Προς</label><input id="solemn:recipient" name="recipient">'
+        return self._guard(session) or (200, self.page("Αποδέκτης", self._form(BASE + '/recipient', fields, 'Συνέχεια')), None)
+
+    def _recipient(self, session, form, cookies):
+        session['declaration']['recipient'] = form.get('recipient', '')
+        return self._guard(session) or (200, None, BASE + '/preview')
+
+    def _previewPage(self, session, form, cookies):
+        declaration = session['declaration']
+        summary = ( f"<p>Προς: {html.escape(declaration.get('recipient', ''))}</p>"
+                    f"<p>{html.escape(declaration.get('text', ''))}</p>" )
+        return self._guard(session) or (200, self.page("Προεπισκόπηση", summary + self._form(BASE + '/preview', '', 'Έκδοση')), None)
+
+    def _export(self, session, form, cookies):
+        return self._guard(session) or (200, None, BASE + '/sms')
+
+    def _smsPage(self, session, form, cookies):
+        fields = ( '<label><input type="radio" name="method" value="sms">Με αποστολή SMS</label>'
+                   '<label><input type="radio" name="method" value="app">Με την εφαρμογή</label>' )
+        return self._guard(session) or (200, self.page("Επιβεβαίωση", self._form(BASE + '/sms', fields, 'Συνέχεια')), None)
+
+    def _sms(self, session, form, cookies):
+        if self._guard(session):
+            return self._guard(session)
+        code = f"{secrets.randbelow(1000000):06d}"
+        session['declaration']['code'] = code
+        if not self.fails('sms_delivery'):
+            self.count('sms_delivery')
+            timer = threading.Timer(self.sms_delay, self.sms, args=(SMS_TEMPLATE.format(code=code),))
+            timer.daemon = True
+            timer.start()
+        return 200, None, BASE + '/confirm'
+
+    def _confirmPage(self, session, form, cookies, error=''):
+        fields = f'{error}<input id="confirmation_code" name="confirmation_code" inputmode="numeric">'
+        return self._guard(session) or (200, self.page("Κωδικός επιβεβαίωσης", self._form(BASE + '/confirm', fields, 'Επιβεβαίωση')), None)
+
+    def _confirm(self, session, form, cookies):
+        if self._guard(session):
+            return self._guard(session)
+        declaration = session['declaration']
+        if self.fails('confirm') or form.get('confirmation_code') != declaration.get('code'):
+            return self._confirmPage(session, form, cookies, '<p class="error">Λανθασμένος κωδικός επιβεβαίωσης</p>')
+        token = secrets.token_hex(12)
+        with self.lock:
+            self.documents[token] = minimalPdf(f"declaration {token}", self.pdf_size)
+            self.issued += 1
+        declaration['document'] = token
+        return 200, None, BASE + '/document'
+
+    def _documentPage(self, session, form, cookies):
+        token = session['declaration'].get('document')
+        if token is None:
+            return 200, None, BASE
+        link = f'<a href="/pdf-download/{token}">Αποθήκευση</a>'
+        return 200, self.page("Η δήλωση εκδόθηκε", link), None
+
+    def stats(self):
+        """Returns the number of issued documents, sessions and requests per step, also served as `/_stats`."""
+        with self.lock:
+            return { 'issued' : self.issued, 'sessions' : len(self.sessions), 'requests' : dict(self.requests) }
+
+
+def parseSteps(values, name):
+    """
+    Parses `STEP=VALUE` command line values into a dict.
+
+    Args:
+        values (list): The values, a bare number is the default of all steps.
+        name (str): The name of the option for error messages.
+
+    Returns:
+        dict: The float values indexed by the step, '*' is the default.
+
+    Raises:
+        argparse.ArgumentTypeError: If a value is malformed or its step unknown.
+
+    """
+    parsed = dict()
+    for value in values or []:
+        step, _, number = value.rpartition('=')
+        step = step or '*'
+        if step != '*' and not step in STEPS:
+            raise argparse.ArgumentTypeError(f"{name}: unknown step {step}, one of {', '.join(STEPS)}")
+        try:
+            parsed[step] = float(number)
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"{name}: {value} is not STEP=NUMBER or NUMBER") from None
+    return parsed
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='mockPortal'
+        , description="serves a local stand-in of the gov.gr declaration portal"
+        )
+    parser.add_argument('--host', dest='host', default=PORTAL_DEFAULTS['host'])
+    parser.add_argument('--port', dest='port', default=PORTAL_DEFAULTS['port'], type=int)
+    parser.add_argument('--taxid', dest='taxid', default=PORTAL_DEFAULTS['taxid'])
+    parser.add_argument('--latency', dest='latency', nargs='*', default=[]
+                        , help="seconds to wait per step as STEP=SECONDS, a bare number applies to all steps.")
+    parser.add_argument('--fail', dest='fail', nargs='*', default=[]
+                        , help="failure probability per step as STEP=P, a bare number applies to all steps.")
+    parser.add_argument('--sms-delay', dest='sms_delay', default=PORTAL_DEFAULTS['sms_delay'], type=float)
+    parser.add_argument('--session-ttl', dest='session_ttl', default=PORTAL_DEFAULTS['session_ttl'], type=float)
+    parser.add_argument('--pdf-size', dest='pdf_size', default=PORTAL_DEFAULTS['pdf_size'], type=int)
+    parser.add_argument('--seed', dest='seed', default=None, type=int)
+    parser.add_argument('--sms-webhook', dest='sms_webhook', default=None
+                        , help="URL of the SMS webhook to deliver the codes to.")
+    parser.add_argument('--sms-webhook-token', dest='sms_webhook_token', default=None)
+    parser.add_argument('--sms-file', dest='sms_file', default=None
+                        , help="file or named pipe to append the SMS texts to.")
+    args = vars(parser.parse_args())
+    try:
+        latency  = parseSteps(args['latency'], '--latency')
+        failures = parseSteps(args['fail'], '--fail')
+    except argparse.ArgumentTypeError as e:
+        parser.error(str(e))
+
+    if not args['sms_webhook'] is None:
+        sms = webhookSender(args['sms_webhook'], args['sms_webhook_token'])
+    elif not args['sms_file'] is None:
+        sms = fileSender(args['sms_file'])
+    else:
+        sms = lambda text: print(text.replace('\n', ' '), flush=True)
+
+    portal = MockPortal(  sms, host=args['host'], port=args['port'], taxid=args['taxid']
+                        , latency=latency, failures=failures
+                        , sms_delay=args['sms_delay'], session_ttl=args['session_ttl']
+                        , pdf_size=args['pdf_size'], seed=args['seed'] )
+    print("portal:", portal.url)
+    try:
+        portal.thread.join()
+    except KeyboardInterrupt:
+        portal.close()
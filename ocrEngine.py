@@ -0,0 +1,153 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the OCR engines used to read the notification area.
+
+`pytesseract` starts a new tesseract process for every image, writes the image
+to a temporary file and loads the language models again, which costs hundreds
+of milliseconds per screenshot. If the optional `tesserocr` binding is
+installed, `TesserocrEngine` keeps one tesseract instance with its models
+loaded in memory for its whole lifetime and reads images without any process
+start or temporary file. Both bindings are only imported when their engine is
+created, pytesseract loads pandas and numpy if they are installed.
+
+"""
+
+
+import pathlib
+import threading
+import importlib.util
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+OCR_DEFAULTS = {
+          'lang'   : 'ell+deu+eng'
+        , 'engine' : 'auto'
+    }
+
+#%% logic
+
+class PytesseractEngine:
+    """
+    Runs the tesseract binary through pytesseract, one process per image.
+
+    """
+
+    @logger.logging
+    def __init__(self, tesseract_cmd, lang=OCR_DEFAULTS['lang']):
+        """
+        Initializes the PytesseractEngine instance.
+
+        Args:
+            tesseract_cmd (str): The file path to the Tesseract OCR executable.
+            lang (str, optional): The tesseract languages. Defaults to 'ell+deu+eng'.
+
+        """
+        import pytesseract
+        pytesseract.pytesseract.tesseract_cmd = tesseract_cmd
+        self.pytesseract = pytesseract
+        self.lang = lang
+        return
+
+    @logger.logging
+    def image_to_string(self, image):
+        """
+        Reads the text of an image.
+
+        Args:
+            image (PIL.Image.Image): The image.
+
+        Returns:
+            str: The recognized text.
+
+        """
+        return self.pytesseract.image_to_string(image, lang=self.lang)
+
+    @logger.logging
+    def close(self):
+        """Nothing to release, each call uses its own process."""
+        return
+
+
+class TesserocrEngine:
+    """
+    Keeps one tesseract instance warm in the process, based on tesserocr.
+
+    The instance is not thread safe, calls are serialized by a lock.
+
+    """
+
+    @logger.logging
+    def __init__(self, tesseract_cmd, lang=OCR_DEFAULTS['lang']):
+        """
+        Initializes the TesserocrEngine instance and loads the language models.
+
+        Args:
+            tesseract_cmd (str): The file path to the Tesseract OCR executable, its
+                `tessdata` folder is used if it exists.
+            lang (str, optional): The tesseract languages. Defaults to 'ell+deu+eng'.
+
+        """
+        import tesserocr
+        tessdata = pathlib.Path(tesseract_cmd).parent / 'tessdata'
+        kwargs   = { 'path' : tessdata.as_posix() } if tessdata.exists() else dict()
+        self.api  = tesserocr.PyTessBaseAPI(lang=lang, **kwargs)
+        self.lock = threading.Lock()
+        return
+
+    @logger.logging
+    def image_to_string(self, image):
+        """
+        Reads the text of an image.
+
+        Args:
+            image (PIL.Image.Image): The image.
+
+        Returns:
+            str: The recognized text.
+
+        """
+        with self.lock:
+            self.api.SetImage(image)
+            return self.api.GetUTF8Text()
+
+    @logger.logging
+    def close(self):
+        """Releases the tesseract instance."""
+        with self.lock:
+            self.api.End()
+        return
+
+
+def tesserocrInstalled():
+    """Tells if tesserocr is installed, without importing it and loading tesseract."""
+    return not importlib.util.find_spec('tesserocr') is None
+
+
+@logger.logging
+def createEngine(tesseract_cmd, lang=OCR_DEFAULTS['lang'], engine=OCR_DEFAULTS['engine']):
+    """
+    Creates an OCR engine.
+
+    Args:
+        tesseract_cmd (str): The file path to the Tesseract OCR executable.
+        lang (str, optional): The tesseract languages. Defaults to 'ell+deu+eng'.
+        engine (str, optional): 'tesserocr', 'pytesseract' or 'auto', which uses
+            tesserocr if it is installed. Defaults to 'auto'.
+
+    Returns:
+        PytesseractEngine | TesserocrEngine: The engine.
+
+    Raises:
+        Exception: If tesserocr is requested but not installed.
+
+    """
+    installed = tesserocrInstalled()
+    if engine == 'tesserocr' or (engine == 'auto' and installed):
+        if not installed:
+            raise Exception("OCR engine tesserocr requested, but the tesserocr package is not installed")
+        lg.info("using in-process OCR engine tesserocr")
+        return TesserocrEngine(tesseract_cmd, lang)
+    lg.info("using OCR engine pytesseract")
+    return PytesseractEngine(tesseract_cmd, lang)
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+This module names the downloaded declarations and keeps a manifest per folder.
+
+The file name of a declaration is rendered from a template with the fields
+of its job, e.g. `{row}_{receiver}_{hash}.pdf`, so a PDF can be traced back to
+its CSV row and receiver by its name. Names are allocated by an `OutputDirectory`,
+which lists its folder once and then keeps the taken names in memory: a free
+name is found in constant time however many files the folder holds, and
+parallel sessions of one run never get the same name. A name that is taken
+already gets a numeric index, e.g. `declaration (4).pdf`.
+
+Next to the documents each folder holds `manifest.jsonl`, one JSON line per
+saved document with its job, portal url, size and SHA-256.
+
+"""
+
+
+import os
+import re
+import hashlib
+import pathlib
+import argparse
+import threading
+from datetime import datetime as dt
+import logger
+import statusJournal
+
+#%% defaults
+
+NAMING_DEFAULTS = {
+          'template' : '{row}_{receiver}_{hash}.pdf'
+        , 'manifest' : 'manifest.jsonl'
+        , 'max_name' : 120 # characters of a name before its index and suffix
+    }
+
+#%% constants
+
+UNSAFE = re.compile(r'[<>:"/\\|?*\x00-\x1f]+')
+LOCK = threading.Lock()
+DIRECTORIES = dict() # resolved folder -> OutputDirectory, guarded by LOCK
+
+#%% logic
+
+def safeName(name):
+    """
+    Replaces the characters not allowed in file names.
+
+    Args:
+        name (str): The name to clean.
+
+    Returns:
+        str: The name with unsafe characters replaced by `_`, without leading or
+             trailing blanks and dots.
+
+    """
+    return UNSAFE.sub('_', ' '.join(str(name).split())).strip(' .') or '_'
+
+
+def jobFields(job):
+    """
+    Returns the template fields of a declaration job.
+
+    Args:
+        job (dict): The job, see `declarationJobs.readJobs`.
+
+    Returns:
+        dict: `row` (row index), `column` (receiver index), `receiver`, `folder`
+              and `hash` (the first 8 hex digits of the SHA-256 of the text).
+
+    """
+    return { 'row'      : job['idx']
+           , 'column'   : job['receiver_index']
+           , 'receiver' : job['receiver']
+           , 'folder'   : job.get('folder') or ''
+           , 'hash'     : hashlib.sha256(job['text'].encode('utf-8')).hexdigest()[:8] }
+
+
+def render(template, fields):
+    """
+    Renders a file name template.
+
+    Each field is made safe for file names before it is inserted, the rendered
+    name is cut to `NAMING_DEFAULTS['max_name']` characters, keeping its suffix.
+
+    Args:
+        template (str): The template, e.g. `{row}_{receiver}_{hash}.pdf`.
+        fields (dict): The values of the template fields.
+
+    Returns:
+        str: The file name.
+
+    Raises:
+        KeyError: If the template uses an unknown field.
+
+    """
+    name = pathlib.PurePath(safeName(template.format(**{ k : safeName(v) for k, v in fields.items() })))
+    stem = name.stem[:NAMING_DEFAULTS['max_name']]
+    return stem + name.suffix
+
+
+class OutputDirectory:
+    """
+    Allocates free file names in a folder and appends to its manifest.
+
+    The folder is listed once, later allocations only look at the names in
+    memory. Allocation is thread safe.
+
+    """
+
+    @logger.logging
+    def __init__(self, path):
+        """
+        Initializes the OutputDirectory instance and lists the folder.
+
+        Args:
+            path (str): The folder.
+
+        """
+        self.path     = pathlib.Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock     = threading.Lock()
+        with os.scandir(self.path) as entries:
+            self.taken = { entry.name for entry in entries }
+        self.next     = dict() # name -> next index to try
+        self.manifest = None
+        return
+
+    @logger.logging
+    def allocate(self, name):
+        """
+        Reserves a free file name in the folder.
+
+        Args:
+            name (str): The wanted name. If it is taken, the first free
+                `<stem> (<n>)<suffix>` is used instead.
+
+        Returns:
+            pathlib.Path: The reserved path. Hand it back with `release` if no
+                          file is written to it.
+
+        """
+        with self.lock:
+            if name in self.taken:
+                stem, suffix = os.path.splitext(name)
+                n = self.next.get(name, 1)
+                while f"{stem} ({n}){suffix}" in self.taken:
+                    n += 1
+                self.next[name] = n + 1
+                name = f"{stem} ({n}){suffix}"
+            self.taken.add(name)
+        return self.path / name
+
+    @logger.logging
+    def release(self, path):
+        """
+        Frees a name reserved by `allocate` that has not been written.
+
+        Args:
+            path (pathlib.Path): The reserved path.
+
+        """
+        path = pathlib.Path(path)
+        if path.exists():
+            return
+        with self.lock:
+            self.taken.discard(path.name)
+        return
+
+    @logger.logging
+    def record(self, path, **entry):
+        """
+        Appends a saved document to the manifest of the folder.
+
+        Args:
+            path (pathlib.Path): The document.
+            **entry: Further values of the manifest line, e.g. `key`, `url`,
+                `size` and `sha256`.
+
+        """
+        with self.lock:
+            if self.manifest is None:
+                self.manifest = statusJournal.StatusJournal(self.path / NAMING_DEFAULTS['manifest'])
+        self.manifest.append({ 'file' : pathlib.Path(path).name, **entry, 'created' : dt.now().isoformat() })
+        return
+
+    @logger.logging
+    def close(self):
+        """Closes the manifest."""
+        with self.lock:
+            if not self.manifest is None:
+                self.manifest.close()
+                self.manifest = None
+        return
+
+
+def directory(path):
+    """
+    Returns the OutputDirectory of a folder, shared by all sessions of the process.
+
+    Args:
+        path (str): The folder.
+
+    Returns:
+        OutputDirectory: The folder's name index and manifest.
+
+    """
+    path = pathlib.Path(path).resolve()
+    with LOCK:
+        if not path in DIRECTORIES:
+            DIRECTORIES[path] = OutputDirectory(path)
+        return DIRECTORIES[path]
+
+
+@logger.logging
+def close():
+    """Closes the manifests of all folders and forgets their names."""
+    with LOCK:
+        for folder in DIRECTORIES.values():
+            folder.close()
+        DIRECTORIES.clear()
+    return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='outputNaming'
+        , description="prints the manifest entry of a downloaded declaration"
+        )
+    parser.add_argument('file', help="the downloaded PDF")
+    args = vars(parser.parse_args())
+
+    file = pathlib.Path(args['file'])
+    for entry in statusJournal.StatusJournal.read(file.parent / NAMING_DEFAULTS['manifest']):
+        if entry.get('file') == file.name:
+            print(entry)
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+"""
+This module hands the SMS codes of one reader to many waiting declarations.
+
+All declarations receive their codes on the same phone and an SMS does not
+tell which declaration it belongs to. The sources of smsSources therefore
+serialize the declarations: one holds the channel from requesting its SMS
+until its code is accepted and the channel is cleared before and after.
+
+A `CodeDispatcher` lets the declarations overlap instead. A reader thread
+takes every code of the wrapped source exactly once and stores it with its
+arrival time. Each declaration draws a ticket right before it requests its
+SMS, the tickets are served in the order they were drawn, each with the
+oldest unassigned code that arrived after the ticket was drawn. As the portal
+sends the SMS in the order they are requested, the codes reach the right
+declarations; codes that arrived before any open ticket are stale and never
+handed out. Only the short moment from drawing a ticket to the SMS request
+is serialized between the declarations, for the processes sharing a database
+by a lock on a file next to it.
+
+Codes and tickets are kept in a SQLite database. A code read again within a
+short window is the same SMS read twice and stored once, a later SMS with the
+same code is a new one. Every stored code is handed to one ticket only,
+neither after a restart nor when several processes share the database: they
+all draw their tickets from and read their codes into the same tables.
+
+"""
+
+
+import time
+import sqlite3
+import pathlib
+import argparse
+import threading
+import contextlib
+from loguru import logger as lg
+import logger
+import smsSources
+
+#%% defaults
+
+DISPATCH_DEFAULTS = {
+          'filename'      : 'sms_codes.sqlite'
+        , 'poll_interval' : 0.05  # seconds between checks for codes read by other processes
+        , 'retention'     : 86400 # seconds codes and tickets are kept
+        , 'duplicate_window' : 120 # seconds a code read again is taken for the same SMS
+    }
+
+#%% logic
+
+class CodeDispatcher(smsSources.SMSSource):
+    """
+    Reads the codes of a source once and serves them to the declarations in
+    the order they requested them.
+
+    Offers the interface of an `smsSources.SMSSource`: a declaration holds
+    `exclusive` while it requests and submits its code, `wait_for_sms_code`
+    returns the code of its ticket. Unlike the other sources `exclusive`
+    does not exclude the other declarations once the code is requested.
+
+    """
+
+    @logger.logging
+    def __init__(  self, source, path=None, timeout=None
+                 , poll_interval=DISPATCH_DEFAULTS['poll_interval'], retention=DISPATCH_DEFAULTS['retention']
+                 , duplicate_window=DISPATCH_DEFAULTS['duplicate_window']):
+        """
+        Initializes the CodeDispatcher instance and starts reading the source.
+
+        Args:
+            source (smsSources.SMSSource): The source the codes are read from. The
+                dispatcher owns it, it holds its `exclusive` while reading and closes it.
+            path (str, optional): The SQLite database of codes and tickets, shared by
+                all processes using the same phone. Defaults to None, in memory for
+                this process only.
+            timeout (int, optional): The maximum time in seconds a declaration waits
+                for its code. Defaults to None, the timeout of the source.
+            poll_interval (float, optional): Seconds between checks for codes read by
+                other processes. Defaults to 0.05.
+            retention (int, optional): Seconds codes and tickets are kept. Defaults
+                to one day.
+            duplicate_window (int, optional): Seconds within which a code received
+                again is the same SMS read twice and ignored. Defaults to 120.
+
+        """
+        super().__init__(source.timeout if timeout is None else timeout)
+        self.source        = source
+        self.poll_interval = poll_interval
+        self.duplicate_window = duplicate_window
+        self.path          = None if path is None else pathlib.Path(path)
+        self.available     = threading.Condition(threading.Lock()) # guards the connection
+        self.requesting    = threading.Lock() # held from drawing a ticket until the SMS is requested
+        self.lock          = None # the same between the processes sharing the database
+        self.local         = threading.local()
+        self.open          = 0 # tickets of this process not closed yet
+        self.stopped       = threading.Event()
+
+        if not self.path is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        # transactions are explicit, codes are assigned in an immediate transaction
+        self.connection = sqlite3.connect(':memory:' if self.path is None else self.path, timeout=30
+                                          , isolation_level=None, check_same_thread=False)
+        if not self.path is None:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            # a reserved lock on a database of its own, released by the system if the process dies
+            self.lock = sqlite3.connect(  self.path.with_name(self.path.name + '.lock'), timeout=poll_interval
+                                        , isolation_level=None, check_same_thread=False)
+        if 'id' not in [ column[1] for column in self.connection.execute("PRAGMA table_info(codes)").fetchall() ]:
+            # codes were once unique for the retention, their arrival protects the tickets just as well
+            self.connection.execute("DROP TABLE IF EXISTS codes")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS codes
+                                   ( id       INTEGER PRIMARY KEY AUTOINCREMENT
+                                   , code     TEXT
+                                   , received REAL
+                                   , ticket   INTEGER )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS codes_code ON codes (code, received)")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS tickets
+                                   ( id        INTEGER PRIMARY KEY AUTOINCREMENT
+                                   , requested REAL
+                                   , closed    REAL
+                                   , code      TEXT )""")
+        expired = time.time() - retention
+        self.connection.execute("DELETE FROM codes WHERE received < ?", (expired,))
+        self.connection.execute("DELETE FROM tickets WHERE requested < ?", (expired,))
+
+        self.thread = threading.Thread(target=self._read, name="sms-dispatcher", daemon=True)
+        self.thread.start()
+        return
+
+    def _read(self):
+        """
+        Stores every code of the source while tickets of this process are open.
+
+        The source is entered anew whenever a ticket is drawn after a pause, it
+        drops the codes that arrived while no declaration was waiting.
+
+        """
+        while not self.stopped.is_set():
+            if self.open == 0:
+                self.stopped.wait(self.poll_interval)
+                continue
+            with self.source.exclusive():
+                while not self.stopped.is_set() and self.open > 0:
+                    code = self.source.wait_for_sms_code()
+                    if code:
+                        self.deliver(code)
+        return
+
+    @logger.logging
+    def deliver(self, code, received=None):
+        """
+        Stores a received code and wakes up the waiting declarations.
+
+        Args:
+            code (str): The code.
+            received (float, optional): The arrival time as UNIX timestamp.
+                Defaults to None, now.
+
+        Returns:
+            bool: False if the code has been received within the duplicate window
+                and is ignored.
+
+        """
+        received = time.time() if received is None else received
+        with self.available:
+            if self.stopped.is_set():
+                return False
+            # checked and stored in one transaction, the same SMS may be read by several processes
+            self.connection.execute("BEGIN IMMEDIATE")
+            try:
+                new = self._value(  "SELECT id FROM codes WHERE code = ? AND received > ? AND received < ?"
+                                  , (code, received - self.duplicate_window, received + self.duplicate_window) ) is None
+                if new:
+                    self.connection.execute("INSERT INTO codes (code, received) VALUES (?, ?)", (code, received))
+                self.connection.execute("COMMIT")
+            except Exception:
+                self.connection.execute("ROLLBACK")
+                raise
+            self.available.notify_all()
+        if not new:
+            lg.warning(f"code {code} has been received within {self.duplicate_window} sec before, ignored")
+        return new
+
+    def _value(self, sql, parameters):
+        """
+        Returns the first value of a query, None if it has no rows.
+
+        All rows are fetched, an unfinished statement would keep the connection
+        reading an old snapshot of a database shared with other processes.
+
+        """
+        rows = self.connection.execute(sql, parameters).fetchall()
+        return rows[0][0] if rows else None
+
+    def _assign(self):
+        """
+        Assigns the unassigned codes to the open tickets in the order of both.
+
+        Must be called holding `available`.
+
+        """
+        self.connection.execute("BEGIN IMMEDIATE")
+        try:
+            for ticket, requested in self.connection.execute(  "SELECT id, requested FROM tickets WHERE closed IS NULL AND code IS NULL ORDER BY id"
+                                                             ).fetchall():
+                row = self.connection.execute(  "SELECT id, code FROM codes WHERE ticket IS NULL AND received >= ? ORDER BY received, id LIMIT 1"
+                                              , (requested,) ).fetchall()
+                if not row:
+                    break # later tickets were drawn later, there is no code for them either
+                codeId, code = row[0]
+                self.connection.execute("UPDATE codes SET ticket = ? WHERE id = ?", (ticket, codeId))
+                self.connection.execute("UPDATE tickets SET code = ? WHERE id = ?", (code, ticket))
+            self.connection.execute("COMMIT")
+        except Exception:
+            self.connection.execute("ROLLBACK")
+            raise
+        return
+
+    def _acquire(self):
+        """Takes the right to draw a ticket and request the SMS from all declarations."""
+        self.requesting.acquire()
+        while not self.lock is None:
+            try:
+                self.lock.execute("BEGIN IMMEDIATE")
+                break
+            except sqlite3.OperationalError:
+                continue # another process is still requesting its SMS
+        self.local.requesting = True
+        return
+
+    def _release(self):
+        """Lets the next declaration draw its ticket, once per `_acquire`."""
+        if getattr(self.local, 'requesting', False):
+            self.local.requesting = False
+            if not self.lock is None:
+                self.lock.execute("COMMIT")
+            self.requesting.release()
+        return
+
+    def _draw(self):
+        """Draws a ticket for the next SMS, returns its id."""
+        with self.available:
+            ticket = self.connection.execute("INSERT INTO tickets (requested) VALUES (?)", (time.time(),)).lastrowid
+            self.open += 1
+        return ticket
+
+    def _close(self, ticket):
+        """Closes a ticket, a code assigned to it stays consumed."""
+        with self.available:
+            self.connection.execute("UPDATE tickets SET closed = ? WHERE id = ?", (time.time(), ticket))
+            self.open -= 1
+            self.available.notify_all()
+        return
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Draws a ticket for the SMS the calling declaration is about to request.
+
+        Drawing the ticket and requesting the SMS are serialized between the
+        declarations of all processes sharing the database, the channel is
+        released for the others when the declaration starts waiting for its code.
+
+        Yields:
+            CodeDispatcher: This instance.
+
+        """
+        self._acquire()
+        try:
+            self.local.ticket = self._draw()
+        except Exception:
+            self._release()
+            raise
+        try:
+            yield self
+        finally:
+            self._release()
+            self._close(self.local.ticket)
+            self.local.ticket = None
+
+    @logger.logging
+    def wait_for_sms_code(self):
+        """
+        Waits for the code of the ticket of the calling declaration.
+
+        Called again, e.g. after a rejected code, it waits for the next code that
+        arrives from now on. Called outside `exclusive`, a ticket is drawn now.
+
+        Returns:
+            str: The SMS code, or None if the timeout is reached.
+
+        """
+        self._release()
+        ticket = getattr(self.local, 'ticket', None)
+        owned  = ticket is None
+        if owned:
+            ticket = self._draw()
+        try:
+            deadline = time.monotonic() + self.timeout
+            with self.available:
+                if self._value("SELECT code FROM tickets WHERE id = ?", (ticket,)):
+                    # the code of the ticket has been used, wait for the next one
+                    self.connection.execute("UPDATE tickets SET closed = ? WHERE id = ?", (time.time(), ticket))
+                    ticket = self.connection.execute("INSERT INTO tickets (requested) VALUES (?)", (time.time(),)).lastrowid
+                    self.local.ticket = ticket if not owned else None
+                while True:
+                    self._assign()
+                    code = self._value("SELECT code FROM tickets WHERE id = ?", (ticket,))
+                    if code:
+                        received = self._value("SELECT received FROM codes WHERE ticket = ?", (ticket,))
+                        lg.debug(f"code {code} handed to ticket {ticket} {time.time() - received:.3f} sec after arrival")
+                        return code
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    # codes read in this process notify, those of other processes are polled
+                    self.available.wait(remaining if self.path is None else min(remaining, self.poll_interval))
+        finally:
+            if owned:
+                self._close(ticket)
+        lg.error("SMS code receiver timeout.")
+        return None
+
+    @logger.logging
+    def close(self):
+        """Stops reading, closes the source and the database."""
+        self.stopped.set()
+        self.source.close()
+        self.thread.join(self.poll_interval * 4)
+        with self.available:
+            self.connection.close()
+        if not self.lock is None:
+            self.lock.close()
+        return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='smsDispatcher'
+        , description="lists the codes and tickets of an SMS code database"
+        )
+    parser.add_argument('--db', dest='db', default=DISPATCH_DEFAULTS['filename'])
+    parser.add_argument('--last', dest='last', default=20, type=int)
+    args = vars(parser.parse_args())
+
+    with contextlib.closing(sqlite3.connect(args['db'])) as connection:
+        for code, received, ticket in connection.execute(  "SELECT code, received, ticket FROM codes ORDER BY received DESC LIMIT ?"
+                                                         , (args['last'],) ).fetchall():
+            print(f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(received))} {code} ticket {ticket}")
@@ -0,0 +1,378 @@
+# -*- coding: utf-8 -*-
+"""
+This module provides the sources a declaration can receive its SMS code from.
+
+A source offers `wait_for_sms_code`, which is bound as `getCode` of a
+gsisGrabber, and `exclusive`, which guards the SMS channel while a declaration
+requests and submits its code. The OCR based `SMSNotification` of
+SMSnotificationParser is one implementation, polling the screen. The push
+sources in here receive the SMS text from the outside, e.g. from an SMS
+forwarding app on the phone, and hand the code to the waiting declaration as
+soon as it arrives:
+
+- `WebhookSMSSource` runs a local HTTP server, the SMS text is POSTed to it.
+- `FileSMSSource` follows a text file or a named pipe, one SMS per line.
+
+"""
+
+
+import re
+import abc
+import json
+import time
+import queue
+import pathlib
+import argparse
+import ipaddress
+import threading
+import contextlib
+from urllib.parse import urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from loguru import logger as lg
+import logger
+import codeExtractor
+
+#%% defaults
+
+SOURCE_DEFAULTS = {
+          'text_pattern'  : None
+        , 'timeout'       : 120
+        , 'webhook_host'  : '127.0.0.1' # other interfaces require a token
+        , 'webhook_port'  : 8765
+        , 'poll_interval' : 0.05
+    }
+
+#%% logic
+
+class SMSSource(abc.ABC):
+    """
+    The interface of all SMS code sources.
+
+    Sub classes implement `wait_for_sms_code`. The default `exclusive` serializes
+    the declarations with a lock, so a code can not be taken by the wrong one.
+
+    """
+
+    def __init__(self, timeout=SOURCE_DEFAULTS['timeout']):
+        """
+        Initializes the SMSSource instance.
+
+        Args:
+            timeout (int, optional): The maximum time in seconds to wait for a code.
+                Defaults to 120.
+
+        """
+        self.timeout = timeout
+        self.lock    = threading.RLock()
+        return
+
+    @abc.abstractmethod
+    def wait_for_sms_code(self):
+        """
+        Waits for the next SMS code.
+
+        Returns:
+            str: The SMS code, or None if the timeout is reached.
+
+        """
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Grants exclusive access to the SMS channel to a single declaration.
+
+        Yields:
+            SMSSource: This instance.
+
+        """
+        with self.lock:
+            yield self
+
+    def close(self):
+        """Releases the resources of the source."""
+        return
+
+
+class PushSMSSource(SMSSource):
+    """
+    The base of all sources that get the SMS text pushed.
+
+    `push` extracts the code of a message and wakes up the waiting declaration
+    immediately. Codes that arrive while no declaration holds the channel are
+    stale and dropped when the next declaration enters `exclusive`.
+
+    """
+
+    @logger.logging
+    def __init__(self, text_pattern=SOURCE_DEFAULTS['text_pattern'], timeout=SOURCE_DEFAULTS['timeout']):
+        """
+        Initializes the PushSMSSource instance.
+
+        Args:
+            text_pattern (str, optional): The regex pattern to find the code in the
+                SMS text, the code is its first non empty group. Defaults to None,
+                using the codeExtractor.
+            timeout (int, optional): The maximum time in seconds to wait for a code.
+                Defaults to 120.
+
+        """
+        super().__init__(timeout)
+        self.text_pattern = None if text_pattern is None else re.compile(text_pattern)
+        # a pushed text is the SMS itself, so a code without keyword is accepted
+        self.extractor    = codeExtractor.CodeExtractor(require_anchor=False)
+        self.codes        = queue.Queue()
+        return
+
+    @logger.logging
+    def push(self, text):
+        """
+        Extracts the code of a received SMS text and hands it to the waiting declaration.
+
+        Args:
+            text (str): The SMS text.
+
+        Returns:
+            str: The extracted code, or None if the text holds no code.
+
+        """
+        if self.text_pattern is None:
+            code = self.extractor.extract(text)
+        else:
+            match = self.text_pattern.search(text)
+            code  = None if match is None else next( (g for g in match.groups() if g), match.group(0) )
+        if code is None or code in self.extractor.used:
+            lg.warning(f"no new code found in pushed SMS {text!r}")
+            return None
+        lg.success(f"code pushed: {code}")
+        self.codes.put( (time.time(), code) )
+        return code
+
+    @logger.logging
+    def wait_for_sms_code(self):
+        """
+        Waits for the next pushed SMS code.
+
+        Returns:
+            str: The SMS code, or None if the timeout is reached.
+
+        """
+        try:
+            received, code = self.codes.get(timeout=self.timeout)
+        except queue.Empty:
+            lg.error("SMS code receiver timeout.")
+            return None
+        lg.debug(f"code {code} handed over {time.time() - received:.3f} sec after arrival")
+        self.extractor.markUsed(code)
+        return code
+
+    @contextlib.contextmanager
+    def exclusive(self):
+        """
+        Grants exclusive access to the SMS channel to a single declaration.
+
+        Codes pushed before are dropped on entering, the same way the OCR source
+        clears the notification area.
+
+        Yields:
+            PushSMSSource: This instance.
+
+        """
+        with self.lock:
+            self._drain()
+            try:
+                yield self
+            finally:
+                self._drain()
+
+    def _drain(self):
+        """Drops all codes not taken yet."""
+        while True:
+            try:
+                self.codes.get_nowait()
+            except queue.Empty:
+                return
+
+
+class _WebhookHandler(BaseHTTPRequestHandler):
+    """Passes the body of POST requests to the `PushSMSSource` of the server."""
+
+    def do_POST(self):
+        source = self.server.source
+        if not source.token is None and parse_qs(urlparse(self.path).query).get('token', [None])[0] != source.token \
+           and self.headers.get('X-Token') != source.token:
+            self.send_response(403)
+            self.end_headers()
+            return
+
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8', errors='replace')
+        text = body
+        if 'json' in self.headers.get('Content-Type', ''):
+            try:
+                payload = json.loads(body)
+                text = next( (str(payload[k]) for k in ('text', 'message', 'body', 'msg') if k in payload), body )
+            except (json.JSONDecodeError, TypeError):
+                pass
+        elif 'x-www-form-urlencoded' in self.headers.get('Content-Type', ''):
+            form = parse_qs(body)
+            text = next( (form[k][0] for k in ('text', 'message', 'body', 'msg') if k in form), body )
+
+        code = source.push(text)
+        self.send_response(200 if code else 422)
+        self.end_headers()
+        return
+
+    def log_message(self, format, *args):
+        lg.debug("webhook: " + format % args)
+
+
+def isLoopback(host):
+    """
+    Returns True if a host name or address is only reachable from this machine.
+
+    Args:
+        host (str): The host name or IP address.
+
+    """
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+class WebhookSMSSource(PushSMSSource):
+    """
+    Receives SMS texts as HTTP POST requests on a local port.
+
+    The body is either the plain SMS text, a JSON object or a form with one of
+    the fields `text`, `message`, `body` or `msg`. If a token is configured it
+    must be given as `?token=` query parameter or `X-Token` header.
+
+    """
+
+    @logger.logging
+    def __init__(  self, host=SOURCE_DEFAULTS['webhook_host'], port=SOURCE_DEFAULTS['webhook_port'], token=None
+                 , text_pattern=SOURCE_DEFAULTS['text_pattern'], timeout=SOURCE_DEFAULTS['timeout']):
+        """
+        Initializes the WebhookSMSSource instance and starts the HTTP server.
+
+        Args:
+            host (str, optional): The interface to listen on, e.g. '0.0.0.0' for a
+                forwarding app in the local network. Defaults to '127.0.0.1'.
+            port (int, optional): The port to listen on. Defaults to 8765.
+            token (str, optional): Shared secret required from the sender. Defaults to None,
+                only allowed on a loopback interface.
+            text_pattern (str, optional): The regex pattern to find the code in the
+                SMS text, the code is its first non empty group. Defaults to None,
+                using the codeExtractor.
+            timeout (int, optional): The maximum time in seconds to wait for a code.
+                Defaults to 120.
+
+        Raises:
+            ValueError: If the host is no loopback interface and no token is given.
+
+        """
+        if token is None and not isLoopback(host):
+            raise ValueError(f"the SMS webhook on {host} is reachable from the network and needs a token")
+        super().__init__(text_pattern, timeout)
+        self.token  = token
+        self.server = ThreadingHTTPServer((host, port), _WebhookHandler)
+        self.server.source = self
+        self.thread = threading.Thread(target=self.server.serve_forever, name="sms-webhook", daemon=True)
+        self.thread.start()
+        lg.info(f"SMS webhook listening on http://{host}:{self.server.server_address[1]}/")
+        return
+
+    @logger.logging
+    def close(self):
+        """Stops the HTTP server."""
+        self.server.shutdown()
+        self.server.server_close()
+        return
+
+
+class FileSMSSource(PushSMSSource):
+    """
+    Follows a text file or a named pipe, each line is one SMS text.
+
+    A regular file is followed from its current end, like `tail -f`. A named
+    pipe is read blocking, so a line written to it is handled immediately.
+
+    """
+
+    @logger.logging
+    def __init__(  self, path, text_pattern=SOURCE_DEFAULTS['text_pattern'], timeout=SOURCE_DEFAULTS['timeout']
+                 , poll_interval=SOURCE_DEFAULTS['poll_interval']):
+        """
+        Initializes the FileSMSSource instance and starts following the file.
+
+        Args:
+            path (str): Path of the file or named pipe.
+            text_pattern (str, optional): The regex pattern to find the code in the SMS text.
+            timeout (int, optional): The maximum time in seconds to wait for a code.
+            poll_interval (float, optional): Seconds between checks of a regular file
+                for new lines. Defaults to 0.05.
+
+        """
+        super().__init__(text_pattern, timeout)
+        self.path          = pathlib.Path(path)
+        self.poll_interval = poll_interval
+        self.stopped       = threading.Event()
+        if not self.path.exists():
+            self.path.touch()
+        self.thread = threading.Thread(target=self._follow, name="sms-file", daemon=True)
+        self.thread.start()
+        return
+
+    def _follow(self):
+        """Pushes every line appended to the file."""
+        is_pipe = self.path.is_fifo()
+        while not self.stopped.is_set():
+            with open(self.path, encoding='utf-8', errors='replace') as f:
+                if not is_pipe:
+                    f.seek(0, 2)
+                partial = ''
+                while not self.stopped.is_set():
+                    line = f.readline()
+                    if not line:
+                        if is_pipe:
+                            break # writer closed the pipe, reopen and wait for the next one
+                        time.sleep(self.poll_interval)
+                        continue
+                    partial += line
+                    if partial.endswith('\n'):
+                        if partial.strip():
+                            self.push(partial.strip())
+                        partial = ''
+        return
+
+    @logger.logging
+    def close(self):
+        """Stops following the file."""
+        self.stopped.set()
+        return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='smsSources'
+        , description="waits for an SMS code pushed to a webhook or written to a file"
+        )
+    parser.add_argument('--webhook-host', dest='host', default=SOURCE_DEFAULTS['webhook_host'], required=False)
+    parser.add_argument('--webhook-port', dest='port', default=None, type=int, required=False)
+    parser.add_argument('--webhook-token', dest='token', default=None, required=False)
+    parser.add_argument('--file', dest='file', default=None, required=False)
+    parser.add_argument('-t', '--timeout', dest='timeout', default=SOURCE_DEFAULTS['timeout'], type=int)
+    args = vars(parser.parse_args())
+
+    if not args['file'] is None:
+        source = FileSMSSource(args['file'], timeout=args['timeout'])
+    else:
+        source = WebhookSMSSource(  host=args['host'], port=args['port'] or SOURCE_DEFAULTS['webhook_port']
+                                  , token=args['token'], timeout=args['timeout'] )
+    print("sms_code:", source.wait_for_sms_code())
+    source.close()
@@ -0,0 +1,207 @@
+# -*- coding: utf-8 -*-
+"""
+This module keeps the status of a bulk run in an append-only journal.
+
+Every processed declaration is appended as one JSON line as soon as it is
+finished, so the cost per declaration stays constant over the whole batch and
+a crashed run leaves a complete record of everything done so far. The HTML
+status reports are rendered from the journal records on demand.
+
+"""
+
+
+import json
+import os
+import html
+import pathlib
+import argparse
+import threading
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+JOURNAL_DEFAULTS = {
+          'report_interval' : 60
+        , 'pattern'         : 'bulk_declare_*.jsonl'
+    }
+
+#%% logic
+
+class StatusJournal:
+    """
+    An append-only JSON lines journal of declaration results.
+
+    Appending is thread safe, each record is flushed and synced to disk before
+    `append` returns.
+
+    """
+
+    @logger.logging
+    def __init__(self, path):
+        """
+        Opens the journal for appending, existing records are kept.
+
+        Args:
+            path (str): Path to the journal file.
+
+        """
+        self.path = pathlib.Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.file = open(self.path, 'a', encoding='utf-8')
+        if self.path.stat().st_size > 0:
+            with open(self.path, 'rb') as f:
+                f.seek(-1, os.SEEK_END)
+                if f.read(1) != b'\n':
+                    # terminate a line truncated by a crash, it is skipped by `read`
+                    self.file.write('\n')
+        return
+
+    @logger.logging
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    @logger.logging
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the runtime context related to this object."""
+        self.close()
+
+    @logger.logging
+    def close(self):
+        """Closes the journal file."""
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+        return
+
+    @logger.logging
+    def append(self, record):
+        """
+        Appends a record to the journal.
+
+        Args:
+            record (dict): The record to append. Values that are not JSON types,
+                e.g. paths, are stored as strings.
+
+        """
+        line = json.dumps(record, default=str, ensure_ascii=False)
+        with self.lock:
+            self.file.write(line + '\n')
+            self.file.flush()
+            os.fsync(self.file.fileno())
+        return
+
+    @staticmethod
+    def read(path):
+        """
+        Yields the records of a journal file.
+
+        A truncated last line, as left by a crash while appending, is skipped.
+
+        Args:
+            path (str): Path to the journal file.
+
+        Yields:
+            dict: The journal records in the order they were appended.
+
+        """
+        path = pathlib.Path(path)
+        if not path.exists():
+            return
+        with open(path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    lg.warning(f"skipping broken journal line in {path}: {line!r}")
+        return
+
+
+@logger.logging
+def renderHtml(records, dest):
+    """
+    Renders records as HTML table.
+
+    The columns are the union of the record keys in the order of their first
+    appearance. The file is written next to `dest` and renamed afterwards, so a
+    reader never sees a half written report.
+
+    Args:
+        records (iterable): The records to render.
+        dest (str): Path of the HTML file.
+
+    """
+    records = list(records)
+    columns = list()
+    for record in records:
+        columns.extend( key for key in record if key not in columns )
+
+    dest = pathlib.Path(dest)
+    tmp  = dest.with_name(dest.name + '.tmp')
+    with open(tmp, 'w', encoding='utf-8') as f:
+        f.write('<table border="1" class="dataframe">\n  <thead>\n    <tr style="text-align: right;">\n      <th></th>\n')
+        for column in columns:
+            f.write(f'      <th>{html.escape(str(column))}</th>\n')
+        f.write('    </tr>\n  </thead>\n  <tbody>\n')
+        for n, record in enumerate(records):
+            f.write(f'    <tr>\n      <th>{n}</th>\n')
+            for column in columns:
+                value = record.get(column)
+                f.write(f'      <td>{"None" if value is None else html.escape(str(value))}</td>\n')
+            f.write('    </tr>\n')
+        f.write('  </tbody>\n</table>\n')
+    os.replace(tmp, dest)
+    return
+
+
+@logger.logging
+def completedJobs(directory, pattern=JOURNAL_DEFAULTS['pattern']):
+    """
+    Collects the jobs of earlier runs whose declaration has been downloaded.
+
+    All journals in `directory` are read in the order of their names, which
+    start with the run timestamp, so a later record of a job wins. Only records
+    with a `key` and a `file` that still exists are returned. Each journal is read
+    line by line and every file is checked once, so the scan stays fast even for
+    tens of thousands of completed jobs.
+
+    Args:
+        directory (str): The folder holding the journals of the earlier runs.
+        pattern (str, optional): The glob pattern of the journal names.
+            Defaults to 'bulk_declare_*.jsonl'.
+
+    Returns:
+        dict: The last record of each completed job, indexed by the job key.
+
+    """
+    records = dict()
+    for journal in sorted(pathlib.Path(directory).glob(pattern)):
+        for record in StatusJournal.read(journal):
+            if record.get('key') and record.get('file'):
+                records[record['key']] = record
+    completed = { key : record for key, record in records.items() if os.path.exists(record['file']) }
+    lg.info(f"{len(completed)} completed jobs found in {directory}")
+    return completed
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='statusJournal'
+        , description="renders the HTML status report of a bulkDeclare journal"
+        )
+    parser.add_argument('--journal', dest='journal', default=None, required=True)
+    parser.add_argument('--html', dest='html', default=None, required=True)
+    parser.add_argument('--idx', dest='idx', default=None, type=int, required=False
+                        , help="only render the records of this csv row.")
+    args = vars(parser.parse_args())
+
+    records = StatusJournal.read(args['journal'])
+    if not args['idx'] is None:
+        records = ( r for r in records if r.get('idx') == args['idx'] )
+    renderHtml(records, args['html'])
+    print(f"{args['html']} written")
@@ -0,0 +1,247 @@
+# -*- coding: utf-8 -*-
+"""
+This module learns the timeouts of the portal steps from their observed latency.
+
+Every wait of a declaration for the portal, e.g. for a button of the login or
+the download link, belongs to a step, the stage it runs in. A `LatencyHistory`
+records how long the successful waits of each step took and derives the
+timeout of the next wait from it: a multiple of the p99 of the last samples,
+never below a floor and never above the configured timeout. A broken step is
+detected in a few seconds. A wait that runs out of its timeout doubles the
+timeout of its step until a wait of the step succeeds again, so a slow but
+healthy step still passes on its retry. Until a step has enough samples its
+timeout is the configured one.
+
+The samples are kept in a SQLite table next to the downloads, so a new run
+starts with the timeouts the earlier runs learned.
+
+"""
+
+
+import math
+import time
+import sqlite3
+import pathlib
+import argparse
+import threading
+import collections
+import contextlib
+from loguru import logger as lg
+import logger
+
+#%% defaults
+
+TIMEOUT_DEFAULTS = {
+          'filename'    : 'step_latency.sqlite'
+        , 'window'      : 500  # samples per step the timeout is learned from
+        , 'min_samples' : 20   # samples of a step before its timeout adapts
+        , 'quantile'    : 0.99
+        , 'multiplier'  : 3.0  # timeout as multiple of the quantile
+        , 'floor'       : 2.0  # seconds a timeout never falls below
+    }
+
+#%% constants
+
+LOCK = threading.Lock()
+HISTORIES = dict() # resolved database -> LatencyHistory, guarded by LOCK
+
+#%% logic
+
+def quantile(samples, q):
+    """
+    Returns the nearest-rank quantile of sorted samples.
+
+    Args:
+        samples (list): The samples in ascending order, not empty.
+        q (float): The quantile between 0 and 1.
+
+    Returns:
+        float: The quantile.
+
+    """
+    return samples[min(len(samples) - 1, max(0, math.ceil(q * len(samples)) - 1))]
+
+
+class LatencyHistory:
+    """
+    A persistent, thread safe history of the latency of the portal steps.
+
+    """
+
+    @logger.logging
+    def __init__(  self, path=None, window=TIMEOUT_DEFAULTS['window'], min_samples=TIMEOUT_DEFAULTS['min_samples']
+                 , quantile=TIMEOUT_DEFAULTS['quantile'], multiplier=TIMEOUT_DEFAULTS['multiplier']
+                 , floor=TIMEOUT_DEFAULTS['floor']):
+        """
+        Opens the history and loads the last samples of every step.
+
+        Args:
+            path (str, optional): Path to the SQLite database. Defaults to None,
+                in memory for this process only.
+            window (int, optional): Samples per step the timeout is learned from.
+                Defaults to 500.
+            min_samples (int, optional): Samples of a step before its timeout adapts.
+                Defaults to 20.
+            quantile (float, optional): The quantile of the samples the timeout is
+                a multiple of. Defaults to 0.99.
+            multiplier (float, optional): The timeout as multiple of the quantile.
+                Defaults to 3.0.
+            floor (float, optional): Seconds a timeout never falls below. Defaults to 2.0.
+
+        """
+        self.path        = None if path is None else pathlib.Path(path)
+        self.window      = window
+        self.min_samples = min_samples
+        self.quantile    = quantile
+        self.multiplier  = multiplier
+        self.floor       = floor
+        self.lock        = threading.Lock()
+        self.samples     = collections.defaultdict(lambda: collections.deque(maxlen=self.window))
+        self.budgets     = dict() # step -> learned timeout, dropped when a wait of the step succeeds
+
+        if not self.path is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(':memory:' if self.path is None else self.path, check_same_thread=False)
+        if not self.path is None:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""CREATE TABLE IF NOT EXISTS latency
+                                   ( id       INTEGER PRIMARY KEY AUTOINCREMENT
+                                   , step     TEXT
+                                   , seconds  REAL
+                                   , observed REAL )""")
+        self.connection.execute("CREATE INDEX IF NOT EXISTS latency_step ON latency (step, id)")
+        self.connection.commit()
+        for step, seconds in self.connection.execute(  "SELECT step, seconds FROM latency WHERE id IN "
+                                                       "(SELECT id FROM latency AS l WHERE l.step = latency.step ORDER BY id DESC LIMIT ?) "
+                                                       "ORDER BY id", (self.window,) ).fetchall():
+            self.samples[step].append(seconds)
+        return
+
+    @logger.logging
+    def __enter__(self):
+        """Enter the runtime context related to this object."""
+        return self
+
+    @logger.logging
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        """Exit the runtime context related to this object."""
+        self.close()
+
+    def observe(self, step, seconds, expired=False):
+        """
+        Records the latency of a wait.
+
+        Args:
+            step (str): The step the wait belongs to.
+            seconds (float): The time the wait took.
+            expired (bool, optional): The wait ran out of its learned timeout
+                `seconds`, the timeout of the step is doubled. Defaults to False.
+
+        """
+        with self.lock:
+            self.samples[step].append(seconds)
+            if expired:
+                self.budgets[step] = 2 * seconds
+                lg.warning(f"{step} timed out after {seconds:.1f} sec, its timeout is raised to {2 * seconds:.1f} sec")
+            else:
+                self.budgets.pop(step, None)
+            self.connection.execute(  "INSERT INTO latency (step, seconds, observed) VALUES (?, ?, ?)"
+                                    , (step, seconds, time.time()) )
+            self.connection.commit()
+        return
+
+    def timeout(self, step, ceiling):
+        """
+        Returns the timeout of the next wait of a step.
+
+        Args:
+            step (str): The step the wait belongs to.
+            ceiling (float): The configured timeout, used until the step has
+                enough samples and never exceeded.
+
+        Returns:
+            float: `multiplier` times the quantile of the samples, between `floor`
+                   and `ceiling`.
+
+        """
+        with self.lock:
+            budget = self.budgets.get(step)
+            if budget is None:
+                samples = self.samples.get(step)
+                if samples is None or len(samples) < self.min_samples:
+                    return ceiling
+                budget = self.budgets[step] = max(self.floor, self.multiplier * quantile(sorted(samples), self.quantile))
+        return min(budget, ceiling)
+
+    @logger.logging
+    def timeouts(self, ceiling):
+        """
+        Returns the learned timeouts of all steps.
+
+        Args:
+            ceiling (float): The configured timeout.
+
+        Returns:
+            dict: The timeout in seconds per step, rounded to tenths.
+
+        """
+        return { step : round(self.timeout(step, ceiling), 1) for step in sorted(self.samples) }
+
+    @logger.logging
+    def close(self):
+        """Drops the samples outside of the window of every step and closes the database."""
+        with self.lock:
+            self.connection.execute(  "DELETE FROM latency WHERE id NOT IN "
+                                      "(SELECT id FROM latency AS l WHERE l.step = latency.step ORDER BY id DESC LIMIT ?)"
+                                    , (self.window,) )
+            self.connection.commit()
+            self.connection.close()
+        return
+
+
+def history(path, **kw):
+    """
+    Returns the LatencyHistory of a database, shared by all sessions of the process.
+
+    Args:
+        path (str): Path to the SQLite database.
+        **kw: Further arguments of `LatencyHistory` if it is opened now.
+
+    Returns:
+        LatencyHistory: The history.
+
+    """
+    path = pathlib.Path(path).resolve()
+    with LOCK:
+        if not path in HISTORIES:
+            HISTORIES[path] = LatencyHistory(path, **kw)
+        return HISTORIES[path]
+
+
+@logger.logging
+def close():
+    """Closes the histories of all databases."""
+    with LOCK:
+        for latency in HISTORIES.values():
+            latency.close()
+        HISTORIES.clear()
+    return
+
+
+#%% main
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(
+          prog='stepTimeouts'
+        , description="prints the latency and the learned timeout of every portal step"
+        )
+    parser.add_argument('--db', dest='db', default=TIMEOUT_DEFAULTS['filename'])
+    parser.add_argument('--timeout', dest='timeout', default=60, type=float, help="the configured timeout in seconds")
+    args = vars(parser.parse_args())
+
+    with contextlib.closing(LatencyHistory(args['db'])) as latency:
+        for step, samples in sorted(latency.samples.items()):
+            ordered = sorted(samples)
+            print(  f"{step:<28} n={len(ordered):<5} p50={quantile(ordered, 0.5):7.3f}s "
+                  f"p99={quantile(ordered, 0.99):7.3f}s timeout={latency.timeout(step, args['timeout']):6.1f}s" )
@@ -0,0 +1,13 @@
+# -*- coding: utf-8 -*-
+"""
+Puts the modules of the repository on the import path of the tests.
+
+The modules are not installed as a package, the tests import them the same
+way the scripts import each other.
+
+"""
+
+import sys
+import pathlib
+
+sys.path.insert(0, str(pathlib.Path(__file__).absolute().parent.parent))
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""Tests of the resumable download of `documentDownload.download` against `mockPortal`."""
+
+import hashlib
+import pytest
+import requests
+import mockPortal
+import documentDownload
+
+
+@pytest.fixture
+def portal():
+    with mockPortal.MockPortal(lambda text: None, port=0) as p:
+        p.documents['a'] = mockPortal.minimalPdf("declaration a", 19000)
+        p.documents['b'] = mockPortal.minimalPdf("declaration b", 19895)
+        yield p
+
+
+def url(portal, token):
+    host, port = portal.server.server_address[:2]
+    return f"http://{host}:{port}/pdf-download/{token}"
+
+
+def download(portal, token, dest):
+    with requests.Session() as session:
+        return documentDownload.download(session, url(portal, token), dest, timeout=5)
+
+
+def assertDocument(result, dest, document):
+    assert dest.read_bytes() == document
+    assert result['size'] == len(document)
+    assert result['sha256'] == hashlib.sha256(document).hexdigest()
+    assert not documentDownload.partPath(dest).exists()
+    assert not documentDownload.originPath(dest).exists()
+
+
+def test_download(portal, tmp_path):
+    dest = tmp_path / 'declaration.pdf'
+    assertDocument(download(portal, 'b', dest), dest, portal.documents['b'])
+
+
+def test_part_of_the_same_url_is_resumed(portal, tmp_path):
+    dest = tmp_path / 'declaration.pdf'
+    documentDownload.partPath(dest).write_bytes(portal.documents['b'][:5000])
+    documentDownload.writeOrigin(dest, url(portal, 'b'), None)
+    assertDocument(download(portal, 'b', dest), dest, portal.documents['b'])
+
+
+def test_stale_part_of_another_url_is_discarded(portal, tmp_path):
+    dest = tmp_path / 'declaration.pdf'
+    documentDownload.partPath(dest).write_bytes(b'X' * 19000)
+    documentDownload.writeOrigin(dest, url(portal, 'a'), None)
+    assertDocument(download(portal, 'b', dest), dest, portal.documents['b'])
+
+
+def test_part_of_unknown_origin_is_discarded(portal, tmp_path):
+    # as large as the document, a range request would be refused as complete
+    dest = tmp_path / 'declaration.pdf'
+    documentDownload.partPath(dest).write_bytes(b'X' * len(portal.documents['b']))
+    assertDocument(download(portal, 'b', dest), dest, portal.documents['b'])
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+"""Tests of the HTTP engine `httpDeclaration.HttpDeclaration` against `mockPortal`."""
+
+import pytest
+import mockPortal
+import smsSources
+import gsisDeclaration
+import httpDeclaration
+
+
+class Browser:
+    """The part of a WebDriver the HTTP engine and its fallback use."""
+
+    def __init__(self, cookies=()):
+        self.cookies = list(cookies)
+        self.visited = list()
+
+    def execute_script(self, script, *args):
+        return "Mozilla/5.0"
+
+    def get_cookies(self):
+        return self.cookies
+
+    def get(self, url):
+        self.visited.append(url)
+
+    def quit(self):
+        return
+
+
+@pytest.fixture
+def sms():
+    source = smsSources.PushSMSSource(timeout=5)
+    yield source
+    source.close()
+
+
+def portal(sms, **kw):
+    return mockPortal.MockPortal(sms.push, port=0, sms_delay=0.01, seed=0, **kw)
+
+
+def login(url):
+    """Logs in over HTTP the way the browser does and returns the engine."""
+    engine = httpDeclaration.HttpDeclaration(url, timeout=5)
+    engine._load(engine.session.get(url))
+    engine._submit(engine._form("login", lambda f: f.button('Σύνδεση')))
+    engine._submit(engine._form("taxisnet", lambda f: f.button('ΓΓΠΣΨΔ')))
+    engine._submit(engine._form("credentials", lambda f: f.has(id='j_username')), j_username='user', j_password='secret')
+    engine._submit(engine._form("consent", lambda f: f.button('Αποστολή')), consent='on')
+    engine._submit(engine._form("tax id", lambda f: f.button('Συνέχεια')))
+    return engine
+
+
+def loggedInBrowser(engine):
+    return Browser( { 'name' : c.name, 'value' : c.value, 'domain' : c.domain, 'path' : c.path } for c in engine.session.cookies )
+
+
+def test_declaration_over_http(sms):
+    with portal(sms) as p:
+        engine = login(p.url)
+        try:
+            engine.fillDeclaration('me@example.com', 'Δηλώνω ότι ...', 'ΔΟΥ')
+            with sms.exclusive():
+                engine.requestCode()
+                url = engine.sendCode(sms.wait_for_sms_code())
+            assert '/pdf-download/' in url and url == engine.fileurl
+            document = engine.session.get(url)
+            assert document.status_code == 200 and document.content.startswith(b'%PDF')
+        finally:
+            engine.close()
+        assert p.stats()['issued'] == 1
+
+
+def test_wrong_code_is_rejected_and_the_right_one_accepted(sms):
+    with portal(sms) as p:
+        engine = login(p.url)
+        try:
+            engine.fillDeclaration('me@example.com', 'Δηλώνω ότι ...', 'ΔΟΥ')
+            with sms.exclusive():
+                engine.requestCode()
+                code = sms.wait_for_sms_code()
+                with pytest.raises(Exception, match='wrong SMS code'):
+                    engine.sendCode(f"{(int(code) + 1) % 1000000:06d}")
+                assert engine.fileurl is None
+                assert '/pdf-download/' in engine.sendCode(code)
+        finally:
+            engine.close()
+        assert p.stats()['issued'] == 1
+
+
+def test_unexpected_page_without_session(sms):
+    with portal(sms) as p:
+        engine = httpDeclaration.HttpDeclaration(p.url, timeout=5)
+        try:
+            engine.adoptBrowser(Browser())
+            with pytest.raises(httpDeclaration.UnexpectedResponse, match='email field'):
+                engine.fillDeclaration('me@example.com', 'Δηλώνω ότι ...', 'ΔΟΥ')
+        finally:
+            engine.close()
+
+
+def test_unexpected_error_page(sms):
+    with portal(sms, failures={ 'recipient' : 1.0 }) as p:
+        engine = login(p.url)
+        try:
+            with pytest.raises(httpDeclaration.UnexpectedResponse, match='503'):
+                engine.fillDeclaration('me@example.com', 'Δηλώνω ότι ...', 'ΔΟΥ')
+        finally:
+            engine.close()
+
+
+def grabber(url, driver):
+    """A gsisGrabber on a logged in browser, without starting one."""
+    gsis = object.__new__(gsisDeclaration.gsisGrabber)
+    gsis.__dict__.update( url = url, timeout = 5, driver = driver, browsers = None, http_engine = True, http = None
+                        , downloads = None, tmpdir = None, fileurl = None, filepath = None, stages = dict(), running = list()
+                        , email = 'me@example.com', declarationText = 'Δηλώνω ότι ...', receiver = 'ΔΟΥ' )
+    return gsis
+
+
+def test_grabber_falls_back_to_the_browser(sms):
+    with portal(sms, failures={ 'text' : 1.0 }) as p:
+        engine = login(p.url)
+        browser = loggedInBrowser(engine)
+        engine.close()
+        gsis = grabber(p.url, browser)
+        try:
+            assert not gsis._httpFillDeclaration()
+            assert not gsis.overHttp
+            assert browser.visited == [p.url]
+        finally:
+            gsis.cleanup()
+
+
+def test_grabber_fills_over_http(sms):
+    with portal(sms) as p:
+        engine = login(p.url)
+        browser = loggedInBrowser(engine)
+        engine.close()
+        gsis = grabber(p.url, browser)
+        try:
+            assert gsis._httpFillDeclaration()
+            assert gsis.overHttp
+            assert browser.visited == []
+            assert 'form.http' in gsis.stages
+        finally:
+            gsis.cleanup()
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Tests of the rules of `jobValidation.JobValidator`."""
+
+import pytest
+import jobValidation
+
+
+def job(text="Δηλώνω ότι ...", receiver="ΔΟΥ Αθηνών", folder=None, receiver_index=0):
+    return { 'text' : text, 'receiver' : receiver, 'folder' : folder, 'receiver_index' : receiver_index }
+
+
+def rules(problems):
+    return [ rule for rule, _ in problems ]
+
+
+def test_valid_job():
+    assert jobValidation.JobValidator().check(job(folder='2024 Q1')) == []
+
+
+@pytest.mark.parametrize('text, rule', [ ('', 'text_empty')
+                                       , ('  \n', 'text_empty')
+                                       , ('x' * 11, 'text_length')
+                                       , ('a\x00b', 'text_characters')
+                                       , ('broken �', 'text_characters') ])
+def test_text_rules(text, rule):
+    assert rules(jobValidation.JobValidator(max_text=10).check(job(text=text))) == [rule]
+
+
+@pytest.mark.parametrize('receiver', [ ' ', '12345', 'x' * 201, 'ΔΟΥ\x07' ])
+def test_receiver_rule(receiver):
+    assert rules(jobValidation.JobValidator().check(job(receiver=receiver))) == ['receiver']
+
+
+@pytest.mark.parametrize('folder', [ 'a/b', 'a:b', ' a', 'a.', 'CON', 'lpt1.txt', 'x' * 101 ])
+def test_folder_rule(folder):
+    assert rules(jobValidation.JobValidator().check(job(folder=folder))) == ['folder']
+
+
+def test_several_rules_are_reported():
+    problems = jobValidation.JobValidator().check(job(text='', receiver='', folder='a|b'))
+    assert rules(problems) == ['text_empty', 'receiver', 'folder']
+    assert all( reason for _, reason in problems )
+
+
+def test_only_selected_rules_apply():
+    validator = jobValidation.JobValidator(rules=['folder'])
+    assert validator.check(job(text='', receiver='')) == []
+
+
+def test_unknown_rule():
+    with pytest.raises(ValueError):
+        jobValidation.JobValidator(rules=['text_empty', 'spelling'])
+
+
+def test_duplicate_receiver_columns():
+    validator = jobValidation.JobValidator()
+    validator.header(['ΔΟΥ', 'folder', 'ΔΟΥ'])
+    assert validator.check(job(receiver='ΔΟΥ', receiver_index=0)) == []
+    assert rules(validator.check(job(receiver='ΔΟΥ', receiver_index=2))) == ['receiver']
+
+
+def test_header_without_receivers():
+    with pytest.raises(Exception):
+        jobValidation.JobValidator().header(['folder'])
+
+
+def test_validate_reports_rejected_cells(tmp_path):
+    csv = tmp_path / 'jobs.csv'
+    csv.write_text('ΔΟΥ;Δήμος;folder\nκείμενο;;ok\nκείμενο;κείμενο;a/b\n', encoding='utf-8')
+    count, rejected = jobValidation.validate(csv, jobValidation.JobValidator())
+    assert count == 4
+    assert sorted( (r['idx'], r['receiver'], r['rules']) for r in rejected ) == [ (0, 'Δήμος', 'text_empty')
+                                                                                , (1, 'ΔΟΥ', 'folder')
+                                                                                , (1, 'Δήμος', 'folder') ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Tests of the name allocation of `outputNaming.OutputDirectory`."""
+
+import threading
+import outputNaming
+
+
+def test_allocate_indexes_taken_names(tmp_path):
+    (tmp_path / 'declaration.pdf').write_bytes(b'')
+    folder = outputNaming.OutputDirectory(tmp_path)
+    assert folder.allocate('declaration.pdf') == tmp_path / 'declaration (1).pdf'
+    assert folder.allocate('declaration.pdf') == tmp_path / 'declaration (2).pdf'
+    assert folder.allocate('other.pdf') == tmp_path / 'other.pdf'
+
+
+def test_allocate_skips_indexed_names_on_disk(tmp_path):
+    for name in ('a.pdf', 'a (1).pdf', 'a (2).pdf'):
+        (tmp_path / name).write_bytes(b'')
+    folder = outputNaming.OutputDirectory(tmp_path)
+    assert folder.allocate('a.pdf').name == 'a (3).pdf'
+
+
+def test_release_frees_unwritten_name(tmp_path):
+    folder = outputNaming.OutputDirectory(tmp_path)
+    path = folder.allocate('a.pdf')
+    folder.release(path)
+    assert folder.allocate('a.pdf') == path
+
+
+def test_release_keeps_written_name(tmp_path):
+    folder = outputNaming.OutputDirectory(tmp_path)
+    path = folder.allocate('a.pdf')
+    path.write_bytes(b'%PDF')
+    folder.release(path)
+    assert folder.allocate('a.pdf').name == 'a (1).pdf'
+
+
+def test_allocate_is_unique_across_threads(tmp_path):
+    folder = outputNaming.OutputDirectory(tmp_path)
+    names  = list()
+    def allocate():
+        for _ in range(50):
+            names.append(folder.allocate('a.pdf').name)
+    threads = [ threading.Thread(target=allocate) for _ in range(8) ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(names) == len(set(names)) == 400
+
+
+def test_directory_is_shared_per_folder(tmp_path):
+    try:
+        assert outputNaming.directory(tmp_path) is outputNaming.directory(tmp_path / '.')
+    finally:
+        outputNaming.close()
+
+
+def test_render_makes_fields_safe():
+    fields = { 'row' : 3, 'receiver' : 'ΔΟΥ a/b:c', 'hash' : '0123abcd' }
+    assert outputNaming.render(outputNaming.NAMING_DEFAULTS['template'], fields) == '3_ΔΟΥ a_b_c_0123abcd.pdf'
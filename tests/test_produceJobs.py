@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""Tests of the job stream of `bulkDeclare.produceJobs`."""
+
+import queue
+import pytest
+import bulkDeclare
+import declarationJobs
+
+
+@pytest.fixture
+def csv_file(tmp_path):
+    path = tmp_path / 'jobs.csv'
+    path.write_text("ΔΟΥ Αθηνών;ΔΟΥ Πειραιά\nΔηλώνω ότι ...;Δηλώνω ότι ...\n", encoding='utf-8')
+    return path
+
+
+def produce(csv_file, completed=None):
+    args = { 'csv' : csv_file, 'csv_sep' : ';', 'download_dir' : csv_file.parent / 'out' }
+    jobs, results, warmed = queue.Queue(), queue.Queue(), list()
+    bulkDeclare.produceJobs(args, jobs, results, 1, completed, warm=lambda: warmed.append(True))
+    return list(jobs.queue), list(results.queue), warmed
+
+
+def test_browsers_warmed_once_for_queued_jobs(csv_file):
+    jobs, _, warmed = produce(csv_file)
+    assert len(jobs) == 3 and jobs[-1] is None
+    assert warmed == [True]
+
+
+def test_no_browser_warmed_when_all_jobs_are_completed(csv_file):
+    completed = { job['key'] : { 'file' : 'done.pdf' } for job in declarationJobs.readJobs(csv_file, sep=';') }
+    jobs, results, warmed = produce(csv_file, completed)
+    assert jobs == [None]
+    assert [ status['resumed'] for _, status in results ] == [True, True]
+    assert warmed == []
@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""Tests of the code assignment of `smsDispatcher.CodeDispatcher`."""
+
+import time
+import threading
+import pytest
+import smsSources
+import smsDispatcher
+
+
+def dispatcher(path=None, timeout=5):
+    # codes are delivered by the tests, the wrapped source never receives one
+    return smsDispatcher.CodeDispatcher(smsSources.PushSMSSource(timeout=0.1), path=path, timeout=timeout, poll_interval=0.01)
+
+
+@pytest.fixture
+def codes():
+    opened = list()
+    def create(path=None, timeout=5):
+        opened.append(dispatcher(path, timeout))
+        return opened[-1]
+    yield create
+    for d in opened:
+        d.close()
+
+
+def declare(d, name, drawn, results):
+    """A declaration: draws its ticket, requests the SMS and waits for its code."""
+    with d.exclusive():
+        drawn.set()
+        results[name] = d.wait_for_sms_code()
+
+
+def start(d, name, results):
+    """Starts a declaration and returns once its ticket is drawn."""
+    drawn  = threading.Event()
+    thread = threading.Thread(target=declare, args=(d, name, drawn, results))
+    thread.start()
+    assert drawn.wait(5)
+    return thread
+
+
+def test_overlapping_tickets_get_codes_in_request_order(codes):
+    d = codes()
+    results = dict()
+    threads = [ start(d, name, results) for name in ('first', 'second', 'third') ]
+    for code in ('111111', '222222', '333333'):
+        d.deliver(code)
+    for thread in threads:
+        thread.join(5)
+    assert results == { 'first' : '111111', 'second' : '222222', 'third' : '333333' }
+
+
+def test_stale_code_is_never_handed_out(codes):
+    d = codes()
+    d.deliver('999999', received=time.time() - 10)
+    results = dict()
+    thread  = start(d, 'late', results)
+    d.deliver('111111')
+    thread.join(5)
+    assert results == { 'late' : '111111' }
+
+
+def test_timeout_without_code(codes):
+    d = codes(timeout=0.2)
+    d.deliver('999999', received=time.time() - 10)
+    with d.exclusive():
+        assert d.wait_for_sms_code() is None
+
+
+def test_rewait_after_rejected_code_gets_next_code(codes):
+    d = codes()
+    with d.exclusive():
+        threading.Timer(0.05, d.deliver, args=('111111',)).start()
+        assert d.wait_for_sms_code() == '111111'
+        # the portal rejected the code and sent a new SMS
+        threading.Timer(0.05, d.deliver, args=('222222',)).start()
+        assert d.wait_for_sms_code() == '222222'
+
+
+def test_requests_are_serialized_between_processes(codes, tmp_path):
+    db = tmp_path / 'sms_codes.sqlite'
+    one, other = codes(db), codes(db)
+    results = dict()
+    requested = threading.Event()
+    def request():
+        with other.exclusive():
+            requested.set()
+            results['other'] = other.wait_for_sms_code()
+    with one.exclusive():
+        thread = threading.Thread(target=request)
+        thread.start()
+        # the other process must not draw its ticket while this one requests its SMS
+        assert not requested.wait(0.3)
+        threading.Timer(0.05, one.deliver, args=('111111',)).start()
+        assert one.wait_for_sms_code() == '111111'
+    assert requested.wait(5)
+    other.deliver('222222')
+    thread.join(5)
+    assert results == { 'other' : '222222' }
+
+
+def test_code_read_twice_is_stored_once(codes):
+    d = codes()
+    assert d.deliver('111111')
+    assert not d.deliver('111111')
+
+
+def test_repeated_code_of_a_later_sms_is_handed_out(codes):
+    d = codes()
+    d.deliver('111111', received=time.time() - smsDispatcher.DISPATCH_DEFAULTS['duplicate_window'] - 10)
+    results = dict()
+    thread  = start(d, 'later', results)
+    assert d.deliver('111111')
+    thread.join(5)
+    assert results == { 'later' : '111111' }
+
+
+def test_dispatchers_share_database(codes, tmp_path):
+    db = tmp_path / 'sms_codes.sqlite'
+    one, other = codes(db), codes(db)
+    results = dict()
+    threads = [ start(one, 'first', results), start(other, 'second', results) ]
+    # each code is read by the other process than the one of its ticket
+    other.deliver('111111')
+    one.deliver('222222')
+    for thread in threads:
+        thread.join(5)
+    assert results == { 'first' : '111111', 'second' : '222222' }
+    assert not one.deliver('111111')
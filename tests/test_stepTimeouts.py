@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Tests of the learned timeouts of `stepTimeouts.LatencyHistory`."""
+
+import contextlib
+import pytest
+import stepTimeouts
+
+
+def history(path=None, **kw):
+    kw = { 'min_samples' : 5, 'multiplier' : 3.0, 'floor' : 2.0, 'quantile' : 0.99, **kw }
+    return contextlib.closing(stepTimeouts.LatencyHistory(path, **kw))
+
+
+def test_quantile_nearest_rank():
+    samples = list(range(1, 101))
+    assert stepTimeouts.quantile(samples, 0.5) == 50
+    assert stepTimeouts.quantile(samples, 0.99) == 99
+    assert stepTimeouts.quantile(samples, 1.0) == 100
+    assert stepTimeouts.quantile([7], 0.99) == 7
+
+
+def test_ceiling_until_enough_samples():
+    with history() as latency:
+        for _ in range(4):
+            latency.observe('login', 1.0)
+        assert latency.timeout('login', 60) == 60
+        latency.observe('login', 1.0)
+        assert latency.timeout('login', 60) == pytest.approx(3.0)
+
+
+def test_timeout_between_floor_and_ceiling():
+    with history() as latency:
+        for _ in range(5):
+            latency.observe('fast', 0.1)
+            latency.observe('slow', 30.0)
+        assert latency.timeout('fast', 60) == 2.0
+        assert latency.timeout('slow', 60) == 60
+
+
+def test_expired_wait_doubles_until_success():
+    with history() as latency:
+        for _ in range(5):
+            latency.observe('form', 1.0)
+        assert latency.timeout('form', 60) == pytest.approx(3.0)
+        latency.observe('form', 3.0, expired=True)
+        assert latency.timeout('form', 60) == pytest.approx(6.0)
+        latency.observe('form', 6.0, expired=True)
+        assert latency.timeout('form', 10) == 10
+        latency.observe('form', 1.0)
+        # the success drops the doubled timeout, the expired waits stay samples
+        assert latency.timeout('form', 60) == pytest.approx(3 * 6.0)
+
+
+def test_steps_are_independent():
+    with history() as latency:
+        for _ in range(5):
+            latency.observe('login', 1.0)
+        assert latency.timeout('download', 60) == 60
+        assert latency.timeouts(60) == { 'login' : 3.0 }
+
+
+def test_samples_persist_within_window(tmp_path):
+    db = tmp_path / 'latency.sqlite'
+    with history(db, window=5) as latency:
+        for seconds in (10.0,) * 5 + (1.0,) * 5:
+            latency.observe('login', seconds)
+    with history(db, window=5) as latency:
+        assert list(latency.samples['login']) == [1.0] * 5
+        assert latency.timeout('login', 60) == pytest.approx(3.0)